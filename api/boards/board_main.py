@@ -1,43 +1,60 @@
 from fastapi import APIRouter as _APIRouter, Depends as _Depends, HTTPException as _HTTPException, status as _status, \
-    security as _security
+    security as _security, Response as _Response, Query as _Query, WebSocket as _WebSocket, Request as _Request
 from . import board_services as _board_services
 from ..users.user_services import get_current_user as _get_current_user
 from ..users import user_services as _user_services
 from ..cards import card_services as _card_services
+from ..lists import list_services as _list_services
 from ..users import user_schemas as _user_schemas
 from ..boards.board_services import get_member_board as _get_member_board, get_current_board as _get_current_board
 
-from ..database import get_db as _get_db
+from ..database import get_async_db as _get_async_db, get_read_db as _get_read_db, \
+    UnitOfWorkRoute as _UnitOfWorkRoute, AsyncSessionLocal as _AsyncSessionLocal, after_commit as _after_commit
+from .. import realtime as _realtime
+from .. import conditional as _conditional
+from .. import pagination as _pagination
+from .. import serializers as _serializers
 from . import board_schemas as _board_schemas
-from sqlalchemy.orm import Session as _Session
+from sqlalchemy.ext.asyncio import AsyncSession as _AsyncSession
 
 router = _APIRouter(
     prefix="/boards",
     tags=["boards"],
+    route_class=_UnitOfWorkRoute,
 )
 
 board_labels_router = _APIRouter(
     prefix="/boards/{board_id}/labels",
     tags=["board_labels"],
+    route_class=_UnitOfWorkRoute,
+)
+
+board_events_router = _APIRouter(
+    prefix="/ws/boards",
+    tags=["board_events"],
 )
 
 current_user_dependency = _Depends(_get_current_user)
 board_dependency = _Depends(_get_current_board)
 member_board_dependency = _Depends(_get_member_board)
+page_params_dependency = _Depends(_pagination.page_params)
 
 
 # TODO: UPDATE BOARD ENDPOINTS TO USE MEMBER BOARD DEPENDENCY
 
 @router.get("/get_full_board", response_model=_board_schemas.FullBoard)
-async def get_full_board(board: _board_schemas.FullBoard = board_dependency):
-    board_lists = board.lists
-    _ = [lists.cards for lists in board_lists]
-    return board
+async def get_full_board(request: _Request, response: _Response, board: _board_schemas.Board = board_dependency,
+                         db: _AsyncSession = _Depends(_get_read_db)):
+    version = await _board_services.get_board_version(db=db, board_id=board.id)
+    not_modified = _conditional.check_etag(request, response, _conditional.make_etag("board", board.id, version))
+    if not_modified:
+        return not_modified
+    return await _board_services.get_full_board(db=db, board_id=board.id)
 
 
 # endpoint to add member to board
 @router.post("/add_member/{board_id}", response_model=_board_schemas.Board)
-async def add_member_to_board(board_add: _board_schemas.BoardAddMember, db: _Session = _Depends(_get_db),
+async def add_member_to_board(board_add: _board_schemas.BoardAddMember, db: _AsyncSession = _Depends(_get_async_db),
                               board: _board_schemas.Board = _Depends(_board_services.get_current_board),
                               current_user: _user_schemas.User = current_user_dependency):
     # get user by email
@@ -52,13 +69,16 @@ async def add_member_to_board(board_add: _board_schemas.BoardAddMember, db: _Ses
         raise _HTTPException(status_code=_status.HTTP_400_BAD_REQUEST, detail="User is already a member")
 
     # add user to board
-    await _board_services.add_member_to_board(db=db, board_id=board.id, member_id=user_to_add.id)
+    db_member = await _board_services.add_member_to_board(db=db, board_id=board.id, member_id=user_to_add.id)
+    await _board_services.record_board_change(db=db, board_id=board.id, entity="board_member", entity_id=db_member.id,
+                                              action="created", data=_board_schemas.BoardMember.from_orm(db_member))
     return _board_schemas.Board.from_orm(board)
 
 
 # endpoint to remove member from board
 @router.post("/remove_member/{board_id}", status_code=_status.HTTP_204_NO_CONTENT)
-async def remove_member_from_board(board_remove: _board_schemas.BoardRemoveMember, db: _Session = _Depends(_get_db),
+async def remove_member_from_board(board_remove: _board_schemas.BoardRemoveMember,
+                                   db: _AsyncSession = _Depends(_get_async_db),
                                    board: _board_schemas.Board = _Depends(_board_services.get_current_board),
                                    current_user: _user_schemas.User = current_user_dependency):
     # get user by email
@@ -77,29 +97,33 @@ async def remove_member_from_board(board_remove: _board_schemas.BoardRemoveMembe
                              detail="You cannot remove the owner of the board")
 
     # remove user from board
-    await _board_services.remove_member_from_board(db=db, board_id=board.id, member_id=user_to_remove.id)
+    db_member = await _board_services.remove_member_from_board(db=db, board_id=board.id, member_id=user_to_remove.id)
+    await _board_services.record_board_change(db=db, board_id=board.id, entity="board_member", entity_id=db_member.id,
+                                              action="deleted")
 
-    # remove user from all cards in board
-    # TODO: IMPLEMENT THIS
-    # await _card_services.remove_member_from_all_cards_in_board(db=db, board_id=board.id, user_id=user_to_remove.id)
+    # remove user from all cards in board; the board_member change above already tells clients to drop them
+    await _card_services.remove_member_from_all_cards_in_board(db=db, board_id=board.id, user_id=user_to_remove.id)
 
 
 # list all members of a board
-@router.get("/members/{board_id}", response_model=list[_user_schemas.User])
-async def get_board_members(board: _board_schemas.Board = _Depends(_board_services.get_current_board),
-                            db: _Session = _Depends(_get_db),
+@router.get("/members/{board_id}", response_model=list[_board_schemas.BoardMemberUser])
+async def get_board_members(response: _Response, role: _board_schemas.BoardRole | None = None,
+                            board: _board_schemas.Board = _Depends(_board_services.get_current_board),
+                            page_params: _pagination.PageParams = page_params_dependency,
+                            db: _AsyncSession = _Depends(_get_read_db),
                             current_user: _user_schemas.User = current_user_dependency):
-    if not await _board_services.user_is_board_member(db=db, board_id=board.id, user_id=current_user.id):
+    # cached by get_current_board
+    access = await _board_services.get_board_access(db=db, board_id=board.id, user_id=current_user.id)
+    if not access.role:
         raise _HTTPException(status_code=_status.HTTP_401_UNAUTHORIZED, detail="You are not a member of this board")
-    members = await _board_services.get_board_members(db=db, board_id=board.id)
-
-    # using the user_id from the members, get the user object and return the list of users. make sure to convert to user schema
-    return [_user_schemas.User.from_orm(await _user_services.get_user_by_id(db=db, user_id=member.user_id)) for member
-            in members]
+    page = await _board_services.get_board_members(db=db, board_id=board.id, owner_id=board.owner_id,
+                                                   params=page_params, role=role)
+    _pagination.set_next_cursor(response, page)
+    return _serializers.json_response(page.items, response)
 
 
 @router.post("/create_board", response_model=_board_schemas.Board)
-async def create_board(board: _board_schemas.BoardCreate, db: _Session = _Depends(_get_db),
+async def create_board(board: _board_schemas.BoardCreate, db: _AsyncSession = _Depends(_get_async_db),
                        current_user: _user_schemas.User = current_user_dependency):
     board = await _board_services.create_board(db=db, board=board, owner_id=current_user.id)
     # add owner as member
@@ -108,7 +132,7 @@ async def create_board(board: _board_schemas.BoardCreate, db: _Session = _Depend
 
 
 @router.get("/me", response_model=list[_board_schemas.Board])
-async def read_boards_by_user(db: _Session = _Depends(_get_db),
+async def read_boards_by_user(db: _AsyncSession = _Depends(_get_read_db),
                               current_user: _user_schemas.User = current_user_dependency):
     # get all boards where the user is a member
     db_boards = await _board_services.get_boards_members_by_user_id(db=db, user_id=current_user.id)
@@ -118,13 +142,16 @@ async def read_boards_by_user(db: _Session = _Depends(_get_db),
 
 
 @router.get("/public", response_model=list[_board_schemas.Board])
-async def read_boards_by_user(db: _Session = _Depends(_get_db)):
-    db_boards = await _board_services.get_public_boards(db=db)
-    return [_board_schemas.Board.from_orm(board) for board in db_boards]
+async def read_boards_by_user(response: _Response,
+                              page_params: _pagination.PageParams = page_params_dependency,
+                              db: _AsyncSession = _Depends(_get_read_db)):
+    page = await _board_services.get_public_boards(db=db, params=page_params)
+    _pagination.set_next_cursor(response, page)
+    return [_board_schemas.Board.from_orm(board) for board in page.items]
 
 
 @router.get("/me/{board_id}", response_model=_board_schemas.Board)
-async def read_user_board(board_id: int, db: _Session = _Depends(_get_db),
+async def read_user_board(board_id: int, db: _AsyncSession = _Depends(_get_read_db),
                           current_user: _user_schemas.User = current_user_dependency):
     db_board = await _board_services.get_user_board_by_id(db=db, board_id=board_id, owner_id=current_user.id)
     if db_board is None:
@@ -134,7 +161,7 @@ async def read_user_board(board_id: int, db: _Session = _Depends(_get_db),
 
 # endpoint to get board by id. If the board is private, then only the owner can access it. else, anyone can access it.
 @router.get("/{board_id}", response_model=_board_schemas.Board)
-async def read_user_board(board_id: int, db: _Session = _Depends(_get_db),
+async def read_user_board(board_id: int, db: _AsyncSession = _Depends(_get_read_db),
                           current_user: _user_schemas.User = current_user_dependency):
     db_board = await _board_services.get_board_by_id(db=db, board_id=board_id)
     if db_board is None:
@@ -150,41 +177,57 @@ async def read_user_board(board_id: int, db: _Session = _Depends(_get_db),
 
 
 @router.put("/{board_id}", response_model=_board_schemas.Board, dependencies=[current_user_dependency])
-async def update_user_board(board_data: _board_schemas.BoardUpdate, db: _Session = _Depends(_get_db),
+async def update_user_board(board_data: _board_schemas.BoardUpdate, db: _AsyncSession = _Depends(_get_async_db),
                             board=member_board_dependency):
-    board = await _board_services.update_board(db=db, board=board_data, db_board=board)
+    db_board = await _board_services.get_board_by_id(db=db, board_id=board.id)
+    board = await _board_services.update_board(db=db, board=board_data, db_board=db_board)
+    await _board_services.record_board_change(db=db, board_id=board.id, entity="board", entity_id=board.id,
+                                              action="updated", data=_board_schemas.Board.from_orm(board))
     return _board_schemas.Board.from_orm(board)
 
 
+# changes since the version a client has, so it can stay current without refetching the whole board
+@router.get("/{board_id}/changes", response_model=_board_schemas.BoardChanges)
+async def get_board_changes(since: int = _Query(..., ge=0),
+                            limit: int = _Query(_pagination.DEFAULT_PAGE_SIZE, ge=1, le=_pagination.MAX_PAGE_SIZE),
+                            board: _board_schemas.Board = board_dependency,
+                            db: _AsyncSession = _Depends(_get_read_db)):
+    return await _board_services.get_board_changes(db=db, board_id=board.id, since=since, limit=limit)
+
+
 @router.delete("/{board_id}", status_code=_status.HTTP_204_NO_CONTENT)
-async def delete_user_board(board_id: int, db: _Session = _Depends(_get_db),
+async def delete_user_board(board_id: int, db: _AsyncSession = _Depends(_get_async_db),
                             current_user: _user_schemas.User = current_user_dependency):
     db_board = await _board_services.get_user_board_by_id(db=db, board_id=board_id, owner_id=current_user.id)
     if db_board is None:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Board not found")
     await _board_services.delete_all_members_from_board(db=db, board_id=board_id)
     _ = await _board_services.delete_board(db=db, db_board=db_board)
-    #     remove all members from board
-
+    await _board_services.record_board_change(db=db, board_id=board_id, entity="board", entity_id=board_id,
+                                              action="deleted")
+    # the board is only marked deleted; its lists and cards go in the background
+    _after_commit(db, _list_services.board_purge.wake)
 
 
 # board labels
 # TODO: WHEN A LABEL IS DELETED, REMOVE IT FROM ALL CARDS
 @board_labels_router.post("", response_model=_board_schemas.BoardLabel, dependencies=[current_user_dependency])
-async def create_board_label(board_label: _board_schemas.BoardLabelCreate, db: _Session = _Depends(_get_db),
+async def create_board_label(board_label: _board_schemas.BoardLabelCreate, db: _AsyncSession = _Depends(_get_async_db),
                              board=member_board_dependency):
     db_board_label = await _board_services.create_board_label(db=db, board_label=board_label, board_id=board.id)
+    await _board_services.record_board_change(db=db, board_id=board.id, entity="label", entity_id=db_board_label.id,
+                                              action="created", data=_board_schemas.BoardLabel.from_orm(db_board_label))
     return _board_schemas.BoardLabel.from_orm(db_board_label)
 
 
 @board_labels_router.get("", response_model=list[_board_schemas.BoardLabel])
-async def read_board_labels(db: _Session = _Depends(_get_db), board=board_dependency):
+async def read_board_labels(db: _AsyncSession = _Depends(_get_read_db), board=board_dependency):
     db_board_labels = await _board_services.get_board_labels(db=db, board_id=board.id)
     return [_board_schemas.BoardLabel.from_orm(board_label) for board_label in db_board_labels]
 
 
 @board_labels_router.get("/{label_id}", response_model=_board_schemas.BoardLabel)
-async def read_board_label(label_id: int, db: _Session = _Depends(_get_db), board=board_dependency):
+async def read_board_label(label_id: int, db: _AsyncSession = _Depends(_get_read_db), board=board_dependency):
     db_board_label = await _board_services.get_board_label(db=db, board_id=board.id, label_id=label_id)
     if db_board_label is None:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Label not found")
@@ -194,19 +237,50 @@ async def read_board_label(label_id: int, db: _Session = _Depends(_get_db), boar
 @board_labels_router.put("/{label_id}", response_model=_board_schemas.BoardLabel,
                          dependencies=[current_user_dependency])
 async def update_board_label(label_id: int, board_label: _board_schemas.BoardLabelUpdate,
-                             db: _Session = _Depends(_get_db), board=member_board_dependency):
+                             db: _AsyncSession = _Depends(_get_async_db), board=member_board_dependency):
     db_board_label = await _board_services.get_board_label(db=db, board_id=board.id, label_id=label_id)
     if db_board_label is None:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Label not found")
     db_board_label = await _board_services.update_board_label(db=db, board_label=board_label,
                                                               db_board_label=db_board_label)
+    await _board_services.record_board_change(db=db, board_id=board.id, entity="label", entity_id=db_board_label.id,
+                                              action="updated", data=_board_schemas.BoardLabel.from_orm(db_board_label))
     return _board_schemas.BoardLabel.from_orm(db_board_label)
 
 
 @board_labels_router.delete("/{label_id}", status_code=_status.HTTP_204_NO_CONTENT,
                             dependencies=[current_user_dependency])
-async def delete_board_label(label_id: int, db: _Session = _Depends(_get_db), board=member_board_dependency):
+async def delete_board_label(label_id: int, db: _AsyncSession = _Depends(_get_async_db), board=member_board_dependency):
     db_board_label = await _board_services.get_board_label(db=db, board_id=board.id, label_id=label_id)
     if db_board_label is None:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Label not found")
     await _board_services.delete_board_label(db=db, db_board_label=db_board_label)
+    await _board_services.record_board_change(db=db, board_id=board.id, entity="label", entity_id=label_id,
+                                              action="deleted")
+
+
+# live board changes; browsers can't set headers on a websocket, so the token may also come as ?token=
+@board_events_router.websocket("/{board_id}")
+async def board_events(websocket: _WebSocket, board_id: int, token: str | None = None):
+    scheme, _, credentials = websocket.headers.get("authorization", "").partition(" ")
+    token = token or (credentials if scheme.lower() == "bearer" else None)
+    current_user = None
+    if token:
+        # a short session for the user lookup, rather than one held for as long as the socket is open
+        async with _AsyncSessionLocal() as db:
+            try:
+                current_user = await _get_current_user(db=db, token=token)
+            except _HTTPException:
+                pass
+
+    async def authorize():
+        # cached, and the cache is invalidated when membership or visibility change
+        async with _AsyncSessionLocal() as db:
+            access = await _board_services.get_board_access(db=db, board_id=board_id, user_id=current_user.id)
+        return access is not None and bool(access.board.is_public or access.role)
+
+    if current_user is None or not await authorize():
+        await websocket.close(code=_status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    await _realtime.stream(websocket, board_id, authorize=authorize)
@@ -1,23 +1,39 @@
 from api.database import Base as _Base
-from sqlalchemy import Column as _Column, Integer as _Integer, String as _String, ForeignKey as _ForeignKey
+from api.timestamps import local_now as _local_now, local_today as _local_today
+from sqlalchemy import Column as _Column, Integer as _Integer, String as _String, ForeignKey as _ForeignKey, \
+    Index as _Index, JSON as _JSON, Date as _Date, DateTime as _DateTime, text as _text
 import datetime as _dt
 from sqlalchemy.orm import relationship as _relationship
 
 
 class Board(_Base):
     __tablename__ = "boards"
+    __table_args__ = (
+        # deleted boards waiting to be purged; live boards are left out
+        _Index("ix_boards_deleted_at", "deleted_at", sqlite_where=_text("deleted_at IS NOT NULL"),
+               postgresql_where=_text("deleted_at IS NOT NULL")),
+    )
     id = _Column(_Integer, primary_key=True, index=True)
-    owner_id = _Column(_Integer, _ForeignKey("site_users.id"))
+    owner_id = _Column(_Integer, _ForeignKey("site_users.id"), index=True)
     name = _Column(_String, index=True)
-    is_public = _Column(_Integer, default=True)
-    created_date = _Column(_String, default=str(_dt.date.today()))
+    is_public = _Column(_Integer, default=True, index=True)
+    created_date = _Column(_Date, default=_dt.date.today, server_default=_local_today())
+    # bumped by every change recorded in board_changes
+    version = _Column(_Integer, nullable=False, default=0, server_default="0")
+    # set when the board is deleted; its rows are removed in the background, see api.purge
+    deleted_at = _Column(_DateTime, nullable=True)
 
-    lists = _relationship("List", back_populates="board")
+    lists = _relationship("List", back_populates="board", order_by="List.rank, List.id")
     board_members = _relationship("BoardMember", back_populates="board")
 
 
 class BoardMember(_Base):
     __tablename__ = "board_members"
+    __table_args__ = (
+        _Index("uq_board_members_user_id_board_id", "user_id", "board_id", unique=True),
+        # a board's members in user order, joined to site_users without reading the rows
+        _Index("ix_board_members_board_id_user_id", "board_id", "user_id"),
+    )
     id = _Column(_Integer, primary_key=True, index=True)
     user_id = _Column(_Integer, _ForeignKey("site_users.id"))
     board_id = _Column(_Integer, _ForeignKey("boards.id"))
@@ -40,8 +56,27 @@ class BoardLabel(_Base):
     # applies to a specific board
     __tablename__ = "board_labels"
     id = _Column(_Integer, primary_key=True, index=True)
-    board_id = _Column(_Integer, _ForeignKey("boards.id"))
+    board_id = _Column(_Integer, _ForeignKey("boards.id"), index=True)
     name = _Column(_String)
     color = _Column(_String)
 
     card_label = _relationship("CardLabel", back_populates="board_label")
+
+
+class BoardChange(_Base):
+    # what changed on a board at each version, so clients can catch up without refetching the board
+    __tablename__ = "board_changes"
+    __table_args__ = (
+        _Index("uq_board_changes_board_id_version", "board_id", "version", unique=True),
+    )
+    id = _Column(_Integer, primary_key=True, index=True)
+    board_id = _Column(_Integer, _ForeignKey("boards.id"))
+    version = _Column(_Integer, nullable=False)
+    # "board", "list", "card", "comment", "checklist", "label" or "card_label"
+    entity = _Column(_String, nullable=False)
+    entity_id = _Column(_Integer, nullable=False)
+    # "created", "updated", "moved", "deleted" or "rebalanced"
+    action = _Column(_String, nullable=False)
+    # the entity as it is after the change, None when deleted; the children's new ranks when rebalanced
+    data = _Column(_JSON)
+    created_datetime = _Column(_DateTime, default=_dt.datetime.now, server_default=_local_now())
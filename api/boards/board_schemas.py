@@ -1,5 +1,7 @@
 import datetime as _dt
+import typing as _typing
 import pydantic as _pydantic
+from ..users.user_schemas import User as _User
 
 
 class _BaseBoard(_pydantic.BaseModel):
@@ -24,6 +26,15 @@ class Board(_BaseBoard):
         orm_mode = True
 
 
+BoardRole = _typing.Literal["owner", "member"]
+
+
+class BoardAccess(_pydantic.BaseModel):
+    board: Board
+    # "owner", "member", or None when the user isn't a member of the board
+    role: str | None
+
+
 class _BaseBoardMember(_pydantic.BaseModel):
     email: str
 
@@ -52,10 +63,13 @@ class BoardMember(_pydantic.BaseModel):
 
 
 class FullBoardMember(BoardMember):
-    from ..users.user_schemas import User as _User
     user: _User | None
 
 
+class BoardMemberUser(_User):
+    role: BoardRole
+
+
 class _BaseBoardLabel(_pydantic.BaseModel):
     name: str
     color: str
@@ -79,8 +93,38 @@ class BoardLabel(_BaseBoardLabel):
 
 class FullBoard(Board):
     from ..lists.list_schemas import List as _List
+    # the change feed version this snapshot is at, see BoardChanges
+    version: int
     lists: list[_List] | None
     board_members: list[FullBoardMember] | None
 
 
+class BoardChange(_pydantic.BaseModel):
+    version: int
+    entity: str
+    entity_id: int
+    action: str
+    data: dict | None
+
+    class Config:
+        orm_mode = True
+
+
+class SiblingRank(_pydantic.BaseModel):
+    id: int
+    rank: str
+
+
+class Rebalanced(_pydantic.BaseModel):
+    # data of a "rebalanced" change: the new rank of every card of the list, or every list of the board, in order
+    ranks: list[SiblingRank]
+
 
+class BoardChanges(_pydantic.BaseModel):
+    # the version the client is at once it has applied `changes`
+    version: int
+    # the changes since the client's version are no longer kept: refetch the board with get_full_board
+    resync: bool
+    # there are more changes after `version`, ask again with since=version
+    has_more: bool
+    changes: list[BoardChange]
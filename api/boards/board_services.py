@@ -1,33 +1,114 @@
-from sqlalchemy.orm import Session as _Session
+import datetime as _dt
+import functools as _functools
+import itertools as _itertools
+import json as _json
+import os as _os
+import time as _time
+
+import pydantic as _pydantic
+from sqlalchemy import select as _select, delete as _delete, update as _update
+from sqlalchemy.ext.asyncio import AsyncSession as _AsyncSession
+from sqlalchemy.orm import selectinload as _selectinload
 from . import board_models as _board_models
+from ..lists import list_models as _list_models
+from ..cards import card_models as _card_models
 import email_validator as _email_check
 import passlib.hash as _hash
 from fastapi import HTTPException as _HTTPException, status as _status, Depends as _Depends
 import fastapi.security as _security
 import jwt as _jwt
 from . import board_schemas as _board_schemas
-from api.database import get_db as _get_db
+from api.database import get_async_db as _get_async_db, after_commit as _after_commit
 from ..users.user_services import get_current_user as _get_current_user
 from ..users import user_schemas as _user_schemas
+from ..users import user_models as _user_models
+from api.cache import TTLCache as _TTLCache
+from api import pagination as _pagination
+from api import ranking as _ranking
+from api import realtime as _realtime
+from api import serializers as _serializers
+
+# (user_id, board_id, generation) -> BoardAccess, so the board dependencies are a memory hit on the hot path.
+# Writes that change visibility or membership bump the board's generation, which orphans every cached entry
+# for it at once. Other worker processes only see the change once their entries expire.
+_BOARD_ACCESS_TTL = 15
+_board_access_cache = _TTLCache(maxsize=50_000, ttl=_BOARD_ACCESS_TTL)
+# board_id -> (generation, monotonic time of the bump), oldest bump first. Generations come from one counter, so a
+# board never gets a generation back. A bump is forgotten once every entry cached before it has expired, which keeps
+# the dict to the boards changed in the last few TTLs; the margin covers a lookup that was in flight during the bump.
+_board_generations = {}
+_generation_counter = _itertools.count(1)
+_GENERATION_RETENTION = 2 * _BOARD_ACCESS_TTL
+
+# changes older than this many versions are compacted away; clients further behind have to resync
+BOARD_CHANGE_RETENTION = int(_os.environ.get("BOARD_CHANGE_RETENTION", "1000"))
+_COMPACT_EVERY = 100
+
+# boards that haven't been deleted; deleted ones wait for the purge and must not be read
+_live_board = _board_models.Board.deleted_at.is_(None)
+
+_member_serializer = _serializers.RowSerializer(_board_schemas.BoardMemberUser, _user_models.User, exclude=("role",))
+
+
+def invalidate_board_access(board_id: int):
+    now = _time.monotonic()
+    # re-inserted, so the dict stays in bump order
+    _board_generations.pop(board_id, None)
+    _board_generations[board_id] = (next(_generation_counter), now)
+    # the board just bumped is last and recent, so this stops at it at the latest
+    while True:
+        oldest = next(iter(_board_generations))
+        if _board_generations[oldest][1] + _GENERATION_RETENTION > now:
+            break
+        del _board_generations[oldest]
+
+
+def _board_generation(board_id: int) -> int:
+    return _board_generations.get(board_id, (0, None))[0]
+
+
+async def get_board_access(db: _AsyncSession, board_id: int, user_id: int):
+    """
+    Get the board and the user's role on it, from the cache when possible
+    :param db:
+    :param board_id:
+    :param user_id:
+    :return: BoardAccess or None if the board doesn't exist
+    """
+    # read the generation before querying, so a write that lands mid-lookup leaves this entry unreachable
+    key = (user_id, board_id, _board_generation(board_id))
+    access = _board_access_cache.get(key)
+    if access is not None:
+        return access
 
-
-async def get_current_board(board_id: int, db: _Session = _Depends(_get_db),
-                            current_user: _user_schemas.User = _Depends(_get_current_user)):
     board = await get_board_by_id(db=db, board_id=board_id)
     if not board:
+        return None
+    role = None
+    if await get_board_members_by_user_id_board_id(db=db, user_id=user_id, board_id=board_id):
+        role = "owner" if board.owner_id == user_id else "member"
+    access = _board_schemas.BoardAccess(board=_board_schemas.Board.from_orm(board), role=role)
+    _board_access_cache.set(key, access)
+    return access
+
+
+async def get_current_board(board_id: int, db: _AsyncSession = _Depends(_get_async_db),
+                            current_user: _user_schemas.User = _Depends(_get_current_user)):
+    access = await get_board_access(db=db, board_id=board_id, user_id=current_user.id)
+    if not access:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Board not found")
 
-    if board.is_public:
-        return board
+    if access.board.is_public:
+        return access.board
 
     # return board if user is member of board
-    if await get_board_members_by_user_id_board_id(db=db, user_id=current_user.id, board_id=board_id):
-        return board
+    if access.role:
+        return access.board
     else:
         raise _HTTPException(status_code=_status.HTTP_401_UNAUTHORIZED, detail="User is authorized to view this board")
 
 
-async def get_member_board(board_id: int, db: _Session = _Depends(_get_db),
+async def get_member_board(board_id: int, db: _AsyncSession = _Depends(_get_async_db),
                            current_user: _user_schemas.User = _Depends(_get_current_user)):
     """
     Get board by id, but only if user is a member of the board
@@ -35,94 +116,166 @@ async def get_member_board(board_id: int, db: _Session = _Depends(_get_db),
     :param db:
     :return:
     """
-    board = await get_board_by_id(db=db, board_id=board_id)
-    if not board:
+    access = await get_board_access(db=db, board_id=board_id, user_id=current_user.id)
+    if not access:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Board not found")
 
-    if await get_board_members_by_user_id_board_id(db=db, user_id=current_user.id, board_id=board_id):
-        return board
+    if access.role:
+        return access.board
     else:
         raise _HTTPException(status_code=_status.HTTP_403_FORBIDDEN, detail="User is not a member of this board")
 
 
-
-async def create_board(db: _Session, board: _board_schemas.BoardCreate, owner_id: int):
+async def create_board(db: _AsyncSession, board: _board_schemas.BoardCreate, owner_id: int):
     db_board = _board_models.Board(**board.dict(), owner_id=owner_id)
     db.add(db_board)
-    db.commit()
-    db.refresh(db_board)
+    await db.flush()
     return db_board
 
 
-async def get_boards_by_user(db: _Session, skip: int = 0, limit: int = 100, owner_id: int = None):
-    return db.query(_board_models.Board).filter(_board_models.Board.owner_id == owner_id).offset(skip).limit(
-        limit).all()
+async def get_boards_by_user(db: _AsyncSession, skip: int = 0, limit: int = 100, owner_id: int = None):
+    result = await db.scalars(_select(_board_models.Board).filter(_board_models.Board.owner_id == owner_id).filter(
+        _live_board).offset(skip).limit(limit))
+    return result.all()
 
 
-async def get_user_board_by_id(db: _Session, board_id: int, owner_id: int = None):
-    return db.query(_board_models.Board).filter(_board_models.Board.owner_id == owner_id).filter(
-        _board_models.Board.id == board_id).first()
+async def get_user_board_by_id(db: _AsyncSession, board_id: int, owner_id: int = None):
+    return await db.scalar(_select(_board_models.Board).filter(_board_models.Board.owner_id == owner_id).filter(
+        _board_models.Board.id == board_id).filter(_live_board))
 
 
-async def get_board_by_id(db: _Session, board_id: int) -> _board_models.Board:
-    return db.query(_board_models.Board).filter(_board_models.Board.id == board_id).first()
+async def get_board_by_id(db: _AsyncSession, board_id: int) -> _board_models.Board:
+    return await db.scalar(_select(_board_models.Board).filter(_board_models.Board.id == board_id).filter(_live_board))
 
 
-async def update_board(db: _Session, board: _board_schemas.BoardUpdate, db_board: _board_models.Board):
+async def get_full_board(db: _AsyncSession, board_id: int):
+    """
+    Get board by id with everything FullBoard serializes: lists, their cards and card members, and board members.
+    Each relationship level is one selectin query, so the query count doesn't grow with the size of the board.
+    :param db:
+    :param board_id:
+    :return: Board or None
+    """
+    return await db.scalar(_select(_board_models.Board).filter(_board_models.Board.id == board_id).filter(
+        _live_board).options(
+        _selectinload(_board_models.Board.lists).selectinload(_list_models.List.cards).selectinload(
+            _card_models.Card.card_members).selectinload(_card_models.CardMember.user),
+        _selectinload(_board_models.Board.board_members).selectinload(_board_models.BoardMember.user)))
+
+
+async def update_board(db: _AsyncSession, board: _board_schemas.BoardUpdate, db_board: _board_models.Board):
     update_data = board.dict(exclude_unset=True)
     for key, value in update_data.items():
         setattr(db_board, key, value)
     db.add(db_board)
-    db.commit()
-    db.refresh(db_board)
+    await db.flush()
+    _after_commit(db, _functools.partial(invalidate_board_access, db_board.id))
     return db_board
 
 
-async def delete_board(db: _Session, db_board: _board_models.Board):
-    db.delete(db_board)
-    db.commit()
+async def delete_board(db: _AsyncSession, db_board: _board_models.Board):
+    """
+    Mark the board deleted. Every read skips it from then on; its rows are removed later, a batch at a time, so
+    deleting a large board doesn't hold the writer lock for long (see list_services.board_purge).
+    :param db:
+    :param db_board:
+    :return: True
+    """
+    db_board.deleted_at = _dt.datetime.now()
+    await db.flush()
+    _after_commit(db, _functools.partial(invalidate_board_access, db_board.id))
     return True
 
 
-async def get_board_member_by_id(db: _Session, board_id: int, member_id: int):
-    return db.query(_board_models.BoardMember).filter(_board_models.BoardMember.board_id == board_id).filter(
-        _board_models.BoardMember.user_id == member_id).first()
+async def get_deleted_board_ids(db: _AsyncSession, limit: int = 100) -> list[int]:
+    """
+    Boards marked deleted and not purged yet, those deleted first first
+    """
+    result = await db.scalars(_select(_board_models.Board.id).filter(_board_models.Board.deleted_at.is_not(None))
+                              .order_by(_board_models.Board.deleted_at, _board_models.Board.id).limit(limit))
+    return result.all()
 
 
-async def user_is_board_member(db: _Session, board_id: int, user_id: int):
+async def purge_board(db: _AsyncSession, board_id: int):
+    """
+    Delete a deleted board's own rows: its labels, members and change log, then the board. Its lists and cards must
+    be gone already.
+    :param db:
+    :param board_id:
+    """
+    # SQLite can hand a deleted board's id to the next board, which must not inherit its change log
+    for model in (_board_models.BoardLabel, _board_models.BoardMember, _board_models.BoardChange):
+        await db.execute(_delete(model).filter(model.board_id == board_id).execution_options(
+            synchronize_session=False))
+    await db.execute(_delete(_board_models.Board).filter(_board_models.Board.id == board_id).filter(
+        _board_models.Board.deleted_at.is_not(None)).execution_options(synchronize_session=False))
+
+
+async def get_board_member_by_id(db: _AsyncSession, board_id: int, member_id: int):
+    return await db.scalar(_select(_board_models.BoardMember).filter(
+        _board_models.BoardMember.board_id == board_id).filter(_board_models.BoardMember.user_id == member_id))
+
+
+async def user_is_board_member(db: _AsyncSession, board_id: int, user_id: int):
     return True if await get_board_member_by_id(db=db, board_id=board_id, member_id=user_id) else False
 
 
-async def add_member_to_board(db: _Session, board_id: int, member_id: int):
+async def add_member_to_board(db: _AsyncSession, board_id: int, member_id: int):
     db_member = _board_models.BoardMember(board_id=board_id, user_id=member_id)
     db.add(db_member)
-    db.commit()
-    db.refresh(db_member)
+    await db.flush()
+    _after_commit(db, _functools.partial(invalidate_board_access, board_id))
     return db_member
 
 
-async def get_public_boards(db: _Session):
-    return db.query(_board_models.Board).filter(_board_models.Board.is_public == True).all()
+async def get_public_boards(db: _AsyncSession, params: _pagination.PageParams):
+    query = _select(_board_models.Board).filter(_board_models.Board.is_public == True).filter(_live_board)
+    return await _pagination.paginate(db, query, order_by=[_board_models.Board.id], key=lambda board: (board.id,),
+                                      params=params)
 
 
-async def remove_member_from_board(db: _Session, board_id: int, member_id: int):
+async def remove_member_from_board(db: _AsyncSession, board_id: int, member_id: int):
     db_member = await get_board_member_by_id(db=db, board_id=board_id, member_id=member_id)
     if not db_member:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Member not found")
-    db.delete(db_member)
-    db.commit()
-    return True
-
-
-async def get_board_members(db: _Session, board_id: int):
-    return db.query(_board_models.BoardMember).filter(_board_models.BoardMember.board_id == board_id).all()
-
-
-async def get_boards_members_by_user_id(db: _Session, user_id: int):
-    return db.query(_board_models.BoardMember).filter(_board_models.BoardMember.user_id == user_id).all()
+    await db.delete(db_member)
+    await db.flush()
+    _after_commit(db, _functools.partial(invalidate_board_access, board_id))
+    return db_member
 
 
-async def get_board_members_by_user_id_board_id(db: _Session, user_id: int, board_id: int):
+async def get_board_members(db: _AsyncSession, board_id: int, owner_id: int, params: _pagination.PageParams,
+                            role: _board_schemas.BoardRole | None = None):
+    """
+    A page of the board's members with their user data, in one query
+    :param db: async session
+    :param board_id: the board
+    :param owner_id: the board's owner, who has the "owner" role
+    :param params: cursor and page size
+    :param role: only members with this role
+    :return: Page of dicts serialized like BoardMemberUser, in user id order
+    """
+    query = _member_serializer.select().join(
+        _board_models.BoardMember, _board_models.BoardMember.user_id == _user_models.User.id).filter(
+        _board_models.BoardMember.board_id == board_id)
+    if role == "owner":
+        query = query.filter(_board_models.BoardMember.user_id == owner_id)
+    elif role == "member":
+        query = query.filter(_board_models.BoardMember.user_id != owner_id)
+    page = await _pagination.paginate(db, query, order_by=[_board_models.BoardMember.user_id],
+                                      key=lambda user: (user.id,), params=params, rows=True)
+    members = _member_serializer.serialize(page.items)
+    for member in members:
+        member["role"] = "owner" if member["id"] == owner_id else "member"
+    return page._replace(items=members)
+
+
+async def get_boards_members_by_user_id(db: _AsyncSession, user_id: int):
+    result = await db.scalars(_select(_board_models.BoardMember).filter(_board_models.BoardMember.user_id == user_id))
+    return result.all()
+
+
+async def get_board_members_by_user_id_board_id(db: _AsyncSession, user_id: int, board_id: int):
     """
     Get board member by user id and board id
     :param db:
@@ -130,45 +283,115 @@ async def get_board_members_by_user_id_board_id(db: _Session, user_id: int, boar
     :param board_id:
     :return:  BoardMember or None
     """
-    return db.query(_board_models.BoardMember).filter(_board_models.BoardMember.user_id == user_id).filter(
-        _board_models.BoardMember.board_id == board_id).first()
+    return await db.scalar(_select(_board_models.BoardMember).filter(
+        _board_models.BoardMember.user_id == user_id).filter(_board_models.BoardMember.board_id == board_id))
 
 
-async def delete_all_members_from_board(db: _Session, board_id: int):
-    db.query(_board_models.BoardMember).filter(_board_models.BoardMember.board_id == board_id).delete()
-    db.commit()
+async def delete_all_members_from_board(db: _AsyncSession, board_id: int):
+    await db.execute(_delete(_board_models.BoardMember).filter(_board_models.BoardMember.board_id == board_id))
+    await db.flush()
+    _after_commit(db, _functools.partial(invalidate_board_access, board_id))
     return True
 
 
-async def create_board_label(db: _Session, board_id: int, board_label: _board_schemas.BoardLabelCreate):
+async def create_board_label(db: _AsyncSession, board_id: int, board_label: _board_schemas.BoardLabelCreate):
     db_label = _board_models.BoardLabel(**board_label.dict(), board_id=board_id)
     db.add(db_label)
-    db.commit()
-    db.refresh(db_label)
+    await db.flush()
     return db_label
 
 
-async def get_board_labels(db: _Session, board_id: int):
-    return db.query(_board_models.BoardLabel).filter(_board_models.BoardLabel.board_id == board_id).all()
+async def get_board_labels(db: _AsyncSession, board_id: int):
+    result = await db.scalars(_select(_board_models.BoardLabel).filter(_board_models.BoardLabel.board_id == board_id))
+    return result.all()
 
 
-async def get_board_label(db: _Session, board_id: int, label_id: int):
-    return db.query(_board_models.BoardLabel).filter(_board_models.BoardLabel.board_id == board_id).filter(
-        _board_models.BoardLabel.id == label_id).first()
+async def get_board_label(db: _AsyncSession, board_id: int, label_id: int):
+    return await db.scalar(_select(_board_models.BoardLabel).filter(
+        _board_models.BoardLabel.board_id == board_id).filter(_board_models.BoardLabel.id == label_id))
 
 
-async def update_board_label(db: _Session, db_board_label: _board_models.BoardLabel,
+async def update_board_label(db: _AsyncSession, db_board_label: _board_models.BoardLabel,
                              board_label: _board_schemas.BoardLabelUpdate):
     update_data = board_label.dict(exclude_unset=True)
     for key, value in update_data.items():
         setattr(db_board_label, key, value)
     db.add(db_board_label)
-    db.commit()
-    db.refresh(db_board_label)
+    await db.flush()
     return db_board_label
 
 
-async def delete_board_label(db: _Session, db_board_label: _board_models.BoardLabel):
-    db.delete(db_board_label)
-    db.commit()
+async def delete_board_label(db: _AsyncSession, db_board_label: _board_models.BoardLabel):
+    await db.delete(db_board_label)
+    await db.flush()
     return True
+
+
+async def record_board_change(db: _AsyncSession, board_id: int, entity: str, entity_id: int, action: str,
+                              data: _pydantic.BaseModel | None = None):
+    """
+    Bump the board's version and log the change under it, in the request's unit of work. Once that commits, the
+    change is pushed to the board's websocket subscribers.
+    :param db: async session
+    :param board_id: board the change belongs to
+    :param entity: kind of thing that changed, e.g. "card"
+    :param entity_id: its id
+    :param action: "created", "updated", "moved", "deleted" or "rebalanced"
+    :param data: the entity's schema after the change, None when deleted, Rebalanced when rebalanced
+    :return: the new version, None if the board doesn't exist
+    """
+    # the increment happens in SQL, so concurrent changes can never get the same version
+    version = await db.scalar(_update(_board_models.Board).filter(_board_models.Board.id == board_id).values(
+        version=_board_models.Board.version + 1).returning(_board_models.Board.version).execution_options(
+        synchronize_session="fetch"))
+    if version is None:
+        return None
+    data = _json.loads(data.json()) if data is not None else None
+    db.add(_board_models.BoardChange(board_id=board_id, version=version, entity=entity, entity_id=entity_id,
+                                     action=action, data=data, created_datetime=_dt.datetime.now()))
+    event = {"board_id": board_id, "version": version, "entity": entity, "entity_id": entity_id, "action": action,
+             "data": data}
+    _after_commit(db, _functools.partial(_realtime.hub.publish, board_id, event))
+    if version % _COMPACT_EVERY == 0:
+        await db.execute(_delete(_board_models.BoardChange).filter(
+            _board_models.BoardChange.board_id == board_id).filter(
+            _board_models.BoardChange.version <= version - BOARD_CHANGE_RETENTION))
+    return version
+
+
+def rebalanced(ids: list[int]) -> _board_schemas.Rebalanced:
+    """
+    Data of a "rebalanced" change for siblings respread by api.ranking.rebalance
+    :param ids: the siblings, in order
+    """
+    return _board_schemas.Rebalanced(ranks=[_board_schemas.SiblingRank(id=sibling_id, rank=rank)
+                                            for sibling_id, rank in zip(ids, _ranking.spread(len(ids)))])
+
+
+async def get_board_version(db: _AsyncSession, board_id: int):
+    return await db.scalar(_select(_board_models.Board.version).filter(_board_models.Board.id == board_id))
+
+
+async def get_board_changes(db: _AsyncSession, board_id: int, since: int, limit: int):
+    """
+    Changes made to a board after version `since`, oldest first
+    :param db: async session
+    :param board_id:
+    :param since: the version the client has
+    :param limit: most changes to return
+    :return: BoardChanges
+    """
+    version = await get_board_version(db=db, board_id=board_id) or 0
+    if since >= version:
+        # a client ahead of us is reading from a replica that hasn't caught up yet
+        return _board_schemas.BoardChanges(version=since, resync=False, has_more=False, changes=[])
+    changes = (await db.scalars(_select(_board_models.BoardChange).filter(
+        _board_models.BoardChange.board_id == board_id).filter(_board_models.BoardChange.version > since).order_by(
+        _board_models.BoardChange.version).limit(limit + 1))).all()
+    if not changes or changes[0].version != since + 1:
+        # the changes right after `since` have been compacted away
+        return _board_schemas.BoardChanges(version=version, resync=True, has_more=False, changes=[])
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    return _board_schemas.BoardChanges(version=changes[-1].version, resync=False, has_more=has_more,
+                                       changes=[_board_schemas.BoardChange.from_orm(change) for change in changes])
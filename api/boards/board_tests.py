@@ -1,6 +1,14 @@
+import asyncio
 import unittest
 from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+from sqlalchemy import event, text
 from api.main import app
+from api.database import async_engine, engine, AsyncSessionLocal, commit
+from api.boards import board_services
+from api.lists import list_services
+from api.purge import PurgeJob
+from api import realtime
 
 client = TestClient(app)
 
@@ -154,3 +162,353 @@ class TestBoard(unittest.TestCase):
         }
         response = client.delete(f"/boards/{board_id}", headers=headers)
         self.assertEqual(response.status_code, 204)
+
+    def test_deleted_board_is_hidden_then_purged_in_batches(self):
+        board, _ = self.create_board_and_get_id()
+        board_id = board["id"]
+        headers = {
+            "Authorization": f"Bearer {self.access_token}"
+        }
+        self.grow_board(board_id=board_id, member_email="test3_member5@gmail.com")
+        full_board = client.get("/boards/get_full_board", params={"board_id": board_id}, headers=headers).json()
+        card_ids = [card["id"] for board_list in full_board["lists"] for card in board_list["cards"]]
+
+        response = client.delete(f"/boards/{board_id}", headers=headers)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(client.get(f"/boards/{board_id}", headers=headers).status_code, 404)
+        self.assertEqual(client.get("/boards/get_full_board", params={"board_id": board_id},
+                                    headers=headers).status_code, 404)
+        self.assertEqual(client.delete(f"/boards/{board_id}", headers=headers).status_code, 404)
+
+        def count(table, column, ids):
+            with engine.connect() as connection:
+                return connection.execute(text(f"SELECT count(*) FROM {table} WHERE {column} IN "
+                                               f"({', '.join(map(str, ids))})")).scalar()
+
+        # nothing under the board has been deleted yet
+        self.assertEqual(count("cards", "id", card_ids), 9)
+
+        batches = []
+
+        async def purge(purge_board_id):
+            async with AsyncSessionLocal() as db:
+                done = await list_services.purge_board_batch(db=db, board_id=purge_board_id, batch_size=4)
+                await commit(db)
+            if purge_board_id == board_id:
+                batches.append(done)
+            return done
+
+        asyncio.run(PurgeJob(pending=list_services._deleted_board_ids, purge=purge, pause=0).run())
+        self.assertEqual(batches, [False, False, False, True])
+        self.assertEqual([count(table, "card_id", card_ids) for table in ("card_members", "card_activities")], [0, 0])
+        self.assertEqual(count("cards", "id", card_ids), 0)
+        self.assertEqual([count(table, "board_id", [board_id]) for table in ("lists", "board_members",
+                                                                              "board_changes")], [0, 0, 0])
+        self.assertEqual(count("boards", "id", [board_id]), 0)
+
+    def capture_queries(self, request):
+        """
+        Run request() and collect the SQL statements it executes
+        :return: what request() returned, and the statements
+        """
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            result = request()
+        finally:
+            event.remove(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+        return result, statements
+
+    def grow_board(self, board_id, member_email):
+        headers = {
+            "Authorization": f"Bearer {self.access_token}"
+        }
+        client.post("/users/create_user", json={"email": member_email, "password": self.password,
+                                                "username": self.username})
+        response = client.post(f"/boards/add_member/{board_id}", json={"email": member_email}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        for list_number in range(3):
+            response = client.post(f"/lists/{board_id}/create_list", json={
+                "name": f"List {list_number}",
+                "position": list_number
+            }, headers=headers)
+            list_id = response.json()["id"]
+            for card_number in range(3):
+                response = client.post(f"/cards/{board_id}/{list_id}/create_card", json={
+                    "title": f"Card {card_number}",
+                    "description": "Card description"
+                }, headers=headers)
+                card_id = response.json()["id"]
+                response = client.post(f"/card_members/{board_id}/{card_id}/add_member", json={"email": member_email},
+                                       headers=headers)
+                self.assertEqual(response.status_code, 200)
+
+    def test_get_full_board_query_count_is_bounded(self):
+        board, old_board = self.create_board_and_get_id()
+        board_id = board["id"]
+        headers = {
+            "Authorization": f"Bearer {self.access_token}"
+        }
+
+        def get_full_board():
+            response = client.get("/boards/get_full_board", params={"board_id": board_id}, headers=headers)
+            self.assertEqual(response.status_code, 200)
+
+        self.grow_board(board_id=board_id, member_email="test3_member1@gmail.com")
+        small_board_queries = len(self.capture_queries(get_full_board)[1])
+        self.grow_board(board_id=board_id, member_email="test3_member2@gmail.com")
+        large_board_queries = len(self.capture_queries(get_full_board)[1])
+
+        response = client.get("/boards/get_full_board", params={"board_id": board_id}, headers=headers)
+        self.assertEqual(len(response.json()["lists"]), 6)
+        self.assertEqual(len(response.json()["board_members"]), 3)
+        self.assertEqual(small_board_queries, large_board_queries)
+
+    def test_board_access_is_cached(self):
+        board, old_board = self.create_board_and_get_id()
+        board_id = board["id"]
+        headers = {
+            "Authorization": f"Bearer {self.access_token}"
+        }
+        client.get(f"/boards/{board_id}/labels", headers=headers)
+        response, statements = self.capture_queries(lambda: client.get(f"/boards/{board_id}/labels", headers=headers))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([statement for statement in statements if "board_members" in statement], [])
+        self.assertEqual([statement for statement in statements if "FROM boards" in statement], [])
+
+    def test_board_generations_are_forgotten_once_stale(self):
+        board_services.invalidate_board_access(-1)
+        generation = board_services._board_generation(-1)
+        # as if every bump so far was made long enough ago for the entries cached before it to have expired
+        generations = board_services._board_generations
+        for board_id, (board_generation, bumped_at) in list(generations.items()):
+            generations[board_id] = (board_generation, bumped_at - board_services._GENERATION_RETENTION)
+        board_services.invalidate_board_access(-2)
+        self.assertEqual(list(generations), [-2])
+        self.assertEqual(board_services._board_generation(-1), 0)
+        self.assertGreater(board_services._board_generation(-2), generation)
+
+    def test_board_access_is_revoked_with_membership(self):
+        headers = {
+            "Authorization": f"Bearer {self.access_token}"
+        }
+        response = client.post("/boards/create_board", json={"name": "Private board", "is_public": False},
+                               headers=headers)
+        board_id = response.json()["id"]
+        member_email = "test3_member3@gmail.com"
+        client.post("/users/create_user", json={"email": member_email, "password": self.password,
+                                                "username": self.username})
+        response = client.post("/users/token", data={"username": member_email, "password": self.password})
+        member_headers = {
+            "Authorization": f"Bearer {response.json()['access_token']}"
+        }
+        client.post(f"/boards/add_member/{board_id}", json={"email": member_email}, headers=headers)
+        response = client.get(f"/boards/{board_id}/labels", headers=member_headers)
+        self.assertEqual(response.status_code, 200)
+
+        response = client.post(f"/boards/remove_member/{board_id}", json={"email": member_email}, headers=headers)
+        self.assertEqual(response.status_code, 204)
+        response = client.get(f"/boards/{board_id}/labels", headers=member_headers)
+        self.assertEqual(response.status_code, 401)
+
+    def test_removed_member_leaves_every_card_on_the_board(self):
+        headers = {
+            "Authorization": f"Bearer {self.access_token}"
+        }
+        member_email = "test3_member4@gmail.com"
+        client.post("/users/create_user", json={"email": member_email, "password": self.password,
+                                                "username": self.username})
+        boards = []
+        for _ in range(2):
+            board_id = client.post("/boards/create_board", json={"name": "Board", "is_public": False},
+                                   headers=headers).json()["id"]
+            client.post(f"/boards/add_member/{board_id}", json={"email": member_email}, headers=headers)
+            list_id = client.post(f"/lists/{board_id}/create_list", json={"name": "List", "position": 0},
+                                  headers=headers).json()["id"]
+            card_ids = [client.post(f"/cards/{board_id}/{list_id}/create_card",
+                                    json={"title": "Card", "description": "Description"}, headers=headers).json()["id"]
+                        for _ in range(3)]
+            for card_id in card_ids:
+                client.post(f"/card_members/{board_id}/{card_id}/add_member", json={"email": member_email},
+                            headers=headers)
+            boards.append((board_id, card_ids))
+
+        def card_member_count(board_id, card_id):
+            return len(client.get(f"/card_members/{board_id}/{card_id}/get_card_members", headers=headers).json())
+
+        (board_id, card_ids), (other_board_id, other_card_ids) = boards
+        response, statements = self.capture_queries(lambda: client.post(
+            f"/boards/remove_member/{board_id}", json={"email": member_email}, headers=headers))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(len([statement for statement in statements if "card_members" in statement]), 1)
+        self.assertEqual([card_member_count(board_id, card_id) for card_id in card_ids], [0, 0, 0])
+        self.assertEqual([card_member_count(other_board_id, card_id) for card_id in other_card_ids], [1, 1, 1])
+
+    def test_board_members_in_one_query(self):
+        headers = {
+            "Authorization": f"Bearer {self.access_token}"
+        }
+        board, _ = self.create_board_and_get_id()
+        board_id = board["id"]
+        for number in range(4):
+            email = f"test3_members{number}@gmail.com"
+            client.post("/users/create_user", json={"email": email, "password": self.password,
+                                                    "username": self.username})
+            client.post(f"/boards/add_member/{board_id}", json={"email": email}, headers=headers)
+
+        def get_members(**params):
+            response = client.get(f"/boards/members/{board_id}", params=params, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            return response
+
+        members = get_members().json()
+        self.assertEqual(len(members), 5)
+        self.assertEqual([member["id"] for member in members], sorted(member["id"] for member in members))
+        owner = [member for member in members if member["role"] == "owner"]
+        self.assertEqual([member["email"] for member in owner], [self.email])
+        self.assertEqual(get_members(role="owner").json(), owner)
+        self.assertEqual(len(get_members(role="member").json()), 4)
+        self.assertEqual(client.get(f"/boards/members/{board_id}", params={"role": "admin"},
+                                    headers=headers).status_code, 422)
+
+        first = get_members(limit=3)
+        second = get_members(limit=3, cursor=first.headers["X-Next-Cursor"])
+        self.assertNotIn("X-Next-Cursor", second.headers)
+        self.assertEqual(first.json() + second.json(), members)
+        self.assertEqual(len(self.capture_queries(get_members)[1]), 1)
+
+    def test_board_changes_since_version(self):
+        headers = {
+            "Authorization": f"Bearer {self.access_token}"
+        }
+        board, _ = self.create_board_and_get_id()
+        board_id = board["id"]
+        self.assertEqual(client.get(f"/boards/get_full_board?board_id={board_id}", headers=headers).json()["version"],
+                         0)
+        list_id = client.post(f"/lists/{board_id}/create_list", json={"name": "List", "position": 0},
+                              headers=headers).json()["id"]
+        card_id = client.post(f"/cards/{board_id}/{list_id}/create_card",
+                              json={"title": "Card", "description": "Description"}, headers=headers).json()["id"]
+        client.put(f"/lists/{list_id}/{board_id}", json={"name": "Renamed", "position": 0}, headers=headers)
+
+        response = client.get(f"/boards/{board_id}/changes?since=0", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        changes = response.json()
+        self.assertEqual((changes["version"], changes["resync"], changes["has_more"]), (3, False, False))
+        self.assertEqual([(change["version"], change["entity"], change["entity_id"], change["action"])
+                          for change in changes["changes"]],
+                         [(1, "list", list_id, "created"), (2, "card", card_id, "created"),
+                          (3, "list", list_id, "updated")])
+        self.assertEqual(changes["changes"][2]["data"]["name"], "Renamed")
+
+        changes = client.get(f"/boards/{board_id}/changes?since=1&limit=1", headers=headers).json()
+        self.assertEqual((changes["version"], changes["has_more"]), (2, True))
+        changes = client.get(f"/boards/{board_id}/changes?since=3", headers=headers).json()
+        self.assertEqual((changes["version"], changes["changes"]), (3, []))
+
+    def test_board_changes_resync_after_compaction(self):
+        headers = {
+            "Authorization": f"Bearer {self.access_token}"
+        }
+        board, _ = self.create_board_and_get_id()
+        board_id = board["id"]
+        retention, compact_every = board_services.BOARD_CHANGE_RETENTION, board_services._COMPACT_EVERY
+        board_services.BOARD_CHANGE_RETENTION, board_services._COMPACT_EVERY = 2, 2
+        try:
+            for number in range(4):
+                client.post(f"/boards/{board_id}/labels", json={"name": f"Label {number}", "color": "red"},
+                            headers=headers)
+        finally:
+            board_services.BOARD_CHANGE_RETENTION, board_services._COMPACT_EVERY = retention, compact_every
+
+        changes = client.get(f"/boards/{board_id}/changes?since=0", headers=headers).json()
+        self.assertEqual((changes["version"], changes["resync"], changes["changes"]), (4, True, []))
+        changes = client.get(f"/boards/{board_id}/changes?since=2", headers=headers).json()
+        self.assertFalse(changes["resync"])
+        self.assertEqual([change["version"] for change in changes["changes"]], [3, 4])
+
+    def test_board_reads_not_modified(self):
+        headers = {
+            "Authorization": f"Bearer {self.access_token}"
+        }
+        board, _ = self.create_board_and_get_id()
+        board_id = board["id"]
+        paths = [f"/boards/get_full_board?board_id={board_id}", f"/lists/{board_id}"]
+        etags = [client.get(path, headers=headers).headers["ETag"] for path in paths]
+        for path, etag in zip(paths, etags):
+            response = client.get(path, headers={**headers, "If-None-Match": etag})
+            self.assertEqual((response.status_code, response.content), (304, b""))
+
+        client.post(f"/lists/{board_id}/create_list", json={"name": "List", "position": 0}, headers=headers)
+        for path, etag in zip(paths, etags):
+            response = client.get(path, headers={**headers, "If-None-Match": etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers["ETag"], etag)
+        self.assertEqual(response.json()[0]["name"], "List")
+
+    def test_board_events_stream_committed_changes(self):
+        board, _ = self.create_board_and_get_id()
+        board_id = board["id"]
+        headers = {
+            "Authorization": f"Bearer {self.access_token}"
+        }
+        # one portal for the socket and the requests, so they share an event loop
+        with TestClient(app) as live_client:
+            with live_client.websocket_connect(f"/ws/boards/{board_id}?token={self.access_token}") as websocket:
+                list_id = live_client.post(f"/lists/{board_id}/create_list", json={"name": "List", "position": 0},
+                                           headers=headers).json()["id"]
+                event = websocket.receive_json()
+        self.assertEqual((event["board_id"], event["version"], event["entity"], event["entity_id"], event["action"]),
+                         (board_id, 1, "list", list_id, "created"))
+        self.assertEqual(event["data"]["name"], "List")
+        self.assertEqual(realtime.hub.subscriber_count(board_id), 0)
+
+    def test_board_events_stop_when_the_member_is_removed(self):
+        headers = {
+            "Authorization": f"Bearer {self.access_token}"
+        }
+        board_id = client.post("/boards/create_board", json={"name": "Private board", "is_public": False},
+                               headers=headers).json()["id"]
+        member_email = "test3_member6@gmail.com"
+        client.post("/users/create_user", json={"email": member_email, "password": self.password,
+                                                "username": self.username})
+        member_token = client.post("/users/token", data={"username": member_email,
+                                                         "password": self.password}).json()["access_token"]
+        client.post(f"/boards/add_member/{board_id}", json={"email": member_email}, headers=headers)
+        with TestClient(app) as live_client:
+            with live_client.websocket_connect(f"/ws/boards/{board_id}?token={member_token}") as websocket:
+                live_client.post(f"/lists/{board_id}/create_list", json={"name": "List", "position": 0},
+                                 headers=headers)
+                self.assertEqual(websocket.receive_json()["entity"], "list")
+                live_client.post(f"/boards/remove_member/{board_id}", json={"email": member_email},
+                                 headers=headers)
+                live_client.post(f"/lists/{board_id}/create_list", json={"name": "Secret", "position": 1},
+                                 headers=headers)
+                with self.assertRaises(WebSocketDisconnect) as raised:
+                    websocket.receive_json()
+        self.assertEqual(raised.exception.code, 1008)
+        self.assertEqual(realtime.hub.subscriber_count(board_id), 0)
+
+    def test_board_events_require_access(self):
+        board, _ = self.create_board_and_get_id()
+        for url in (f"/ws/boards/{board['id']}", f"/ws/boards/{board['id']}?token=invalid"):
+            with self.assertRaises(WebSocketDisconnect) as raised:
+                with client.websocket_connect(url):
+                    pass
+            self.assertEqual(raised.exception.code, 1008)
+
+    def test_board_hub_drops_slow_subscribers(self):
+        hub = realtime.BoardHub(queue_size=1)
+        slow, other_board = hub.subscribe(1), hub.subscribe(2)
+        hub.publish(1, {"version": 1})
+        self.assertFalse(slow.dropped)
+        hub.publish(1, {"version": 2})
+        self.assertTrue(slow.dropped)
+        self.assertIsNone(slow.queue.get_nowait())
+        self.assertEqual((hub.subscriber_count(1), hub.subscriber_count(2)), (0, 1))
+        self.assertFalse(other_board.dropped)
+
@@ -1,7 +1,9 @@
+import os as _os
 import shutil
 
 from fastapi import APIRouter as _APIRouter, Depends as _Depends, HTTPException as _HTTPException, status as _status, \
-    security as _security, UploadFile as _UploadFile
+    security as _security, UploadFile as _UploadFile, Response as _Response, Header as _Header, \
+    BackgroundTasks as _BackgroundTasks, Request as _Request
 from . import card_services as _card_services
 from ..users.user_services import get_current_user as _get_current_user
 from ..boards.board_services import get_current_board as _get_current_board
@@ -12,9 +14,15 @@ from ..lists.list_services import get_member_list as _get_member_list
 from ..lists import list_services as _list_services
 from ..users import user_schemas as _user_schemas
 from ..users import user_services as _user_services
-from ..database import get_db as _get_db
+from ..database import get_async_db as _get_async_db, get_read_db as _get_read_db, \
+    UnitOfWorkRoute as _UnitOfWorkRoute
+from .. import pagination as _pagination
+from .. import storage as _storage
+from .. import ranking as _ranking
+from .. import conditional as _conditional
+from .. import serializers as _serializers
 from . import card_schemas as _card_schemas
-from sqlalchemy.orm import Session as _Session
+from sqlalchemy.ext.asyncio import AsyncSession as _AsyncSession
 from ..boards import board_schemas as _board_schemas
 from ..lists import list_schemas as _list_schemas
 import datetime as _dt
@@ -22,36 +30,43 @@ import datetime as _dt
 card_router = _APIRouter(
     prefix="/cards",
     tags=["cards"],
+    route_class=_UnitOfWorkRoute,
 )
 
 comments_router = _APIRouter(
     prefix="/comments",
     tags=["comments"],
+    route_class=_UnitOfWorkRoute,
 )
 
 checklists_router = _APIRouter(
     prefix="/checklists",
     tags=["checklists"],
+    route_class=_UnitOfWorkRoute,
 )
 
 card_member_router = _APIRouter(
     prefix="/card_members",
     tags=["card_members"],
+    route_class=_UnitOfWorkRoute,
 )
 
 card_activity_router = _APIRouter(
     prefix="/card_activity",
     tags=["card_activity"],
+    route_class=_UnitOfWorkRoute,
 )
 
 card_label_router = _APIRouter(
     prefix="/card_labels",
     tags=["card_labels"],
+    route_class=_UnitOfWorkRoute,
 )
 
 card_attachment_router = _APIRouter(
     prefix="/card_attachments",
     tags=["card_attachments"],
+    route_class=_UnitOfWorkRoute,
 )
 
 current_user_dependency = _Depends(_get_current_user)
@@ -60,6 +75,7 @@ member_board_dependency = _Depends(_get_member_board)
 list_dependency = _Depends(_get_current_list)
 member_list_dependency = _Depends(_get_member_list)
 card_dependency = _Depends(_card_services.get_current_card)
+page_params_dependency = _Depends(_pagination.page_params)
 
 card_activities = {
     "create_card": "{} created this card",
@@ -75,52 +91,85 @@ card_activities = {
 }
 
 
+async def _check_card_etag(db: _AsyncSession, request: _Request, response: _Response, board_id: int, card_id: int):
+    # the board's version covers everything on the card but its activity, which is written behind
+    version = await _board_services.get_board_version(db=db, board_id=board_id)
+    activity_id = await _card_services.get_latest_card_activity_id(db=db, card_id=card_id)
+    return _conditional.check_etag(request, response, _conditional.make_etag("card", card_id, version, activity_id))
+
+
 @card_router.get("/{board_id}/{card_id}/get_full_card", response_model=_card_schemas.FullCard,
                  dependencies=[board_dependency])
-async def get_full_card(card: _card_schemas.FullCard = card_dependency,
-                        db: _Session = _Depends(_get_db)):
-    return card
+async def get_full_card(board_id: int, card_id: int, request: _Request, response: _Response,
+                        db: _AsyncSession = _Depends(_get_read_db)):
+    # the ETag is built from the path board's version, so it only holds for a card on that board
+    if not await _card_services.get_board_card(db=db, card_id=card_id, board_id=board_id):
+        raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Card not found")
+    not_modified = await _check_card_etag(db=db, request=request, response=response, board_id=board_id,
+                                          card_id=card_id)
+    if not_modified:
+        return not_modified
+    db_card = await _card_services.get_full_card(db=db, card_id=card_id)
+    if not db_card:
+        raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Card not found")
+    return _card_schemas.FullCard.from_orm(db_card)
 
 
 @card_router.post("/{board_id}/{list_id}/create_card", response_model=_card_schemas.FullCardMember)
-async def create_card(card_data: _card_schemas.CardCreate, db: _Session = _Depends(_get_db),
+async def create_card(card_data: _card_schemas.CardCreate, db: _AsyncSession = _Depends(_get_async_db),
                       current_user: _user_schemas.User = current_user_dependency,
                       list_data: _list_schemas.List = member_list_dependency):
     db_card = await _card_services.create_card(db=db, card_data=card_data, list_id=list_data.id)
+    await _board_services.record_board_change(db=db, board_id=list_data.board_id, entity="card", entity_id=db_card.id,
+                                              action="created", data=_card_schemas.Card.from_orm(db_card))
     # add card activity
     activity = card_activities["create_card"].format(current_user.username)
-    await _card_services.add_card_activity(db=db, card_id=db_card.id, user_id=current_user.id,
-                                           activity=activity)
+    await _card_services.record_card_activity(db=db, card_id=db_card.id, user_id=current_user.id, activity=activity)
     return _card_schemas.Card.from_orm(db_card)
 
 
 @card_router.get("/{board_id}/{list_id}/get_cards", response_model=list[_card_schemas.Card])
-async def get_cards(db: _Session = _Depends(_get_db), list_data: _list_schemas.List = list_dependency):
-    db_cards = await _card_services.get_cards_by_list(db=db, list_id=list_data.id)
-    return [_card_schemas.Card.from_orm(db_card) for db_card in db_cards]
+async def get_cards(request: _Request, response: _Response,
+                    page_params: _pagination.PageParams = page_params_dependency,
+                    db: _AsyncSession = _Depends(_get_read_db), list_data: _list_schemas.List = list_dependency):
+    version = await _board_services.get_board_version(db=db, board_id=list_data.board_id)
+    not_modified = _conditional.check_etag(request, response,
+                                           _conditional.make_etag("board", list_data.board_id, version))
+    if not_modified:
+        return not_modified
+    page = await _card_services.get_cards_by_list(db=db, list_id=list_data.id, params=page_params)
+    _pagination.set_next_cursor(response, page)
+    return _serializers.json_response(page.items, response)
 
 
 @card_router.get("/{board_id}/{list_id}/{card_id}/get_card", response_model=_card_schemas.Card)
-async def get_card(card_id: int, list_data: _list_schemas.List = list_dependency, db: _Session = _Depends(_get_db), ):
+async def get_card(card_id: int, list_data: _list_schemas.List = list_dependency,
+                   db: _AsyncSession = _Depends(_get_read_db), ):
     db_card = await _card_services.get_card_by_id(db=db, card_id=card_id, list_id=list_data.id)
     return _card_schemas.Card.from_orm(db_card)
 
 
 @card_router.put("/{board_id}/{list_id}/{card_id}/update_card", response_model=_card_schemas.Card)
-async def update_card(card_data: _card_schemas.CardUpdate, card_id: int,
+async def update_card(card_data: _card_schemas.CardUpdate, card_id: int, background_tasks: _BackgroundTasks,
                       list_data: _list_schemas.List = member_list_dependency,
-                      db: _Session = _Depends(_get_db)):
+                      current_user: _user_schemas.User = current_user_dependency,
+                      db: _AsyncSession = _Depends(_get_async_db)):
     db_card = await _card_services.get_card_by_id(db=db, card_id=card_id, list_id=list_data.id)
     if not db_card:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Card not found")
-    # check if list_id exists in db
-    db_list = await _list_services.get_list_by_id(db=db, list_id=card_data.list_id)
+    # the card may move to another list, but only one on the same board
+    db_list = await _list_services.get_board_list_by_id(db=db, list_id=card_data.list_id, board_id=list_data.board_id)
     if not db_list:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="List not found")
     db_card = await _card_services.update_card(db=db, card_data=card_data, db_card=db_card)
+    await _board_services.record_board_change(db=db, board_id=list_data.board_id, entity="card", entity_id=db_card.id,
+                                              action="updated", data=_card_schemas.Card.from_orm(db_card))
+    if _ranking.needs_rebalance(db_card.rank):
+        background_tasks.add_task(_card_services.rebalance_list_cards, db_list.id)
 
     # add card activity
-    activity = card_activities["update_card"].format(db_card.user.username)
+    activity = card_activities["update_card"].format(current_user.username)
+    await _card_services.record_card_activity(db=db, card_id=db_card.id, user_id=current_user.id, activity=activity)
     return _card_schemas.Card.from_orm(db_card)
 
 
@@ -130,43 +179,80 @@ async def update_card(card_data: _card_schemas.CardUpdate, card_id: int,
 async def update_card_basics(card_data: _card_schemas.CardUpdateTitle, card_id: int,
                              list_data: _list_schemas.List = member_list_dependency,
                              current_user: _user_schemas.User = current_user_dependency,
-                             db: _Session = _Depends(_get_db)):
+                             db: _AsyncSession = _Depends(_get_async_db)):
     db_card = await _card_services.get_card_by_id(db=db, card_id=card_id, list_id=list_data.id)
     if not db_card:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Card not found")
     db_card = await _card_services.update_card_basics(db=db, card_data=card_data, db_card=db_card)
+    await _board_services.record_board_change(db=db, board_id=list_data.board_id, entity="card", entity_id=db_card.id,
+                                              action="updated", data=_card_schemas.Card.from_orm(db_card))
     # add card activity
     activity = card_activities["update_card"].format(current_user.username)
-    await _card_services.add_card_activity(db=db, card_id=db_card.id, user_id=current_user.id,
-                                           activity=activity)
+    await _card_services.record_card_activity(db=db, card_id=db_card.id, user_id=current_user.id, activity=activity)
     return _card_schemas.Card.from_orm(db_card)
 
 
 @card_router.delete("/{board_id}/{list_id}/{card_id}/delete_card", status_code=_status.HTTP_204_NO_CONTENT)
 async def delete_card(card_id: int, list_data: _list_schemas.List = member_list_dependency,
-                      db: _Session = _Depends(_get_db)):
+                      db: _AsyncSession = _Depends(_get_async_db)):
     db_card = await _card_services.get_card_by_id(db=db, card_id=card_id, list_id=list_data.id)
     if not db_card:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Card not found")
     db_card = await _card_services.delete_card(db=db, db_card=db_card)
+    await _board_services.record_board_change(db=db, board_id=list_data.board_id, entity="card", entity_id=card_id,
+                                              action="deleted")
+
+
+# declared before update_card_list, whose {list_id} would otherwise match "move"
+@card_router.put("/{board_id}/{card_id}/move", response_model=_card_schemas.Card)
+async def move_card(card_id: int, card_move: _card_schemas.CardMove, background_tasks: _BackgroundTasks,
+                    db: _AsyncSession = _Depends(_get_async_db),
+                    board: _board_schemas.Board = member_board_dependency,
+                    current_user: _user_schemas.User = current_user_dependency):
+    db_card = await _card_services.get_board_card(db=db, card_id=card_id, board_id=board.id)
+    if not db_card:
+        raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Card not found")
+    db_list = await _list_services.get_board_list_by_id(db=db, list_id=card_move.list_id, board_id=board.id)
+    if not db_list:
+        raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="List not found")
+    old_list_id = db_card.list_id
+    old_list_name = (await db_card.awaitable_attrs.list).name if old_list_id != db_list.id else None
+    try:
+        db_card = await _card_services.move_card(db=db, db_card=db_card, card_move=card_move)
+    except LookupError:
+        raise _HTTPException(status_code=_status.HTTP_400_BAD_REQUEST,
+                             detail="after_id and before_id must be other cards in the target list")
+    await _board_services.record_board_change(db=db, board_id=board.id, entity="card", entity_id=db_card.id,
+                                              action="moved", data=_card_schemas.Card.from_orm(db_card))
+    if _ranking.needs_rebalance(db_card.rank):
+        background_tasks.add_task(_card_services.rebalance_list_cards, db_list.id)
+
+    if old_list_name is not None:
+        activity = card_activities["change_list"].format(current_user.username, old_list_name, db_list.name)
+        await _card_services.record_card_activity(db=db, card_id=db_card.id, user_id=current_user.id, activity=activity)
+    return _card_schemas.Card.from_orm(db_card)
 
 
 # update card list
-@card_router.put("/{board_id}/{card_id}/{list_id}", response_model=_card_schemas.Card,
-                 dependencies=[member_board_dependency])
-async def update_card_list(card_id: int, list_id: int, db: _Session = _Depends(_get_db),
+@card_router.put("/{board_id}/{card_id}/{list_id}", response_model=_card_schemas.Card)
+async def update_card_list(card_id: int, list_id: int, background_tasks: _BackgroundTasks,
+                           db: _AsyncSession = _Depends(_get_async_db),
+                           board: _board_schemas.Board = member_board_dependency,
                            current_user: _user_schemas.User = current_user_dependency):
-    db_card = await _card_services.get_card_with_id(db=db, card_id=card_id)
+    db_card = await _card_services.get_board_card(db=db, card_id=card_id, board_id=board.id)
     if not db_card:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Card not found")
-    card_list = db_card.list.name
-    db_list = await _list_services.get_list_by_id(db=db, list_id=list_id)
+    card_list = (await db_card.awaitable_attrs.list).name
+    db_list = await _list_services.get_board_list_by_id(db=db, list_id=list_id, board_id=board.id)
     if not db_list:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="List not found")
-    new_list = await _card_services.update_card_list(db=db, db_card=db_card, db_list=db_list)
-    activity = card_activities["change_list"].format(current_user.username, card_list, new_list.list.name)
-    await _card_services.add_card_activity(db=db, card_id=db_card.id, user_id=current_user.id,
-                                           activity=activity)
+    db_card = await _card_services.update_card_list(db=db, db_card=db_card, db_list=db_list)
+    await _board_services.record_board_change(db=db, board_id=board.id, entity="card", entity_id=db_card.id,
+                                              action="moved", data=_card_schemas.Card.from_orm(db_card))
+    if _ranking.needs_rebalance(db_card.rank):
+        background_tasks.add_task(_card_services.rebalance_list_cards, db_list.id)
+    activity = card_activities["change_list"].format(current_user.username, card_list, db_list.name)
+    await _card_services.record_card_activity(db=db, card_id=db_card.id, user_id=current_user.id, activity=activity)
     return _card_schemas.Card.from_orm(db_card)
 
 
@@ -175,17 +261,18 @@ async def update_card_list(card_id: int, list_id: int, db: _Session = _Depends(_
 async def set_due_date(card_id: int, card_data: _card_schemas.CardDueDate,
                        list_data: _list_schemas.List = member_list_dependency,
                        current_user: _user_schemas.User = current_user_dependency,
-                       db: _Session = _Depends(_get_db)):
+                       db: _AsyncSession = _Depends(_get_async_db)):
     db_card = await _card_services.get_card_by_id(db=db, card_id=card_id, list_id=list_data.id)
     if not db_card:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Card not found")
     db_card = await _card_services.set_due_date(db=db, db_card=db_card, card_data=card_data)
+    await _board_services.record_board_change(db=db, board_id=list_data.board_id, entity="card", entity_id=db_card.id,
+                                              action="updated", data=_card_schemas.Card.from_orm(db_card))
 
     # add card activity
     activity = card_activities["set_due_date"].format(current_user.username, card_data.due_date)
 
-    await _card_services.add_card_activity(db=db, card_id=db_card.id, user_id=current_user.id,
-                                           activity=activity)
+    await _card_services.record_card_activity(db=db, card_id=db_card.id, user_id=current_user.id, activity=activity)
 
     return _card_schemas.Card.from_orm(db_card)
 
@@ -194,16 +281,17 @@ async def set_due_date(card_id: int, card_data: _card_schemas.CardDueDate,
 @card_router.put("/{board_id}/{list_id}/{card_id}/archive_card", response_model=_card_schemas.Card)
 async def archive_card(card_id: int, list_data: _list_schemas.List = member_list_dependency,
                        current_user: _user_schemas.User = current_user_dependency,
-                       db: _Session = _Depends(_get_db)):
+                       db: _AsyncSession = _Depends(_get_async_db)):
     db_card = await _card_services.get_card_by_id(db=db, card_id=card_id, list_id=list_data.id)
     if not db_card:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Card not found")
     db_card = await _card_services.archive_card(db=db, db_card=db_card)
+    await _board_services.record_board_change(db=db, board_id=list_data.board_id, entity="card", entity_id=db_card.id,
+                                              action="updated", data=_card_schemas.Card.from_orm(db_card))
 
     # add card activity
     activity = card_activities["archive_card"].format(current_user.username)
-    await _card_services.add_card_activity(db=db, card_id=db_card.id, user_id=current_user.id,
-                                           activity=activity)
+    await _card_services.record_card_activity(db=db, card_id=db_card.id, user_id=current_user.id, activity=activity)
 
     return _card_schemas.Card.from_orm(db_card)
 
@@ -212,16 +300,17 @@ async def archive_card(card_id: int, list_data: _list_schemas.List = member_list
 @card_router.put("/{board_id}/{list_id}/{card_id}/unarchive_card", response_model=_card_schemas.Card)
 async def unarchive_card(card_id: int, list_data: _list_schemas.List = member_list_dependency,
                          current_user: _user_schemas.User = current_user_dependency,
-                         db: _Session = _Depends(_get_db)):
+                         db: _AsyncSession = _Depends(_get_async_db)):
     db_card = await _card_services.get_card_by_id(db=db, card_id=card_id, list_id=list_data.id)
     if not db_card:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Card not found")
     db_card = await _card_services.unarchive_card(db=db, db_card=db_card)
+    await _board_services.record_board_change(db=db, board_id=list_data.board_id, entity="card", entity_id=db_card.id,
+                                              action="updated", data=_card_schemas.Card.from_orm(db_card))
 
     # add card activity
     activity = card_activities["unarchive_card"].format(current_user.username)
-    await _card_services.add_card_activity(db=db, card_id=db_card.id, user_id=current_user.id,
-                                           activity=activity)
+    await _card_services.record_card_activity(db=db, card_id=db_card.id, user_id=current_user.id, activity=activity)
 
     return _card_schemas.Card.from_orm(db_card)
 
@@ -231,24 +320,33 @@ async def unarchive_card(card_id: int, list_data: _list_schemas.List = member_li
 
 @comments_router.post("/{board_id}/{list_id}/{card_id}/create_comment", response_model=_card_schemas.FullComment,
                       dependencies=[member_list_dependency])
-async def create_comment(comment_data: _card_schemas.CommentCreate, card_id: int,
+async def create_comment(comment_data: _card_schemas.CommentCreate, board_id: int, card_id: int,
                          current_user: _user_schemas.User = current_user_dependency,
-                         db: _Session = _Depends(_get_db)):
+                         db: _AsyncSession = _Depends(_get_async_db)):
     db_comment = await _card_services.create_comment(db=db, comment_data=comment_data, card_id=card_id,
                                                      user_id=current_user.id)
+    await _board_services.record_board_change(db=db, board_id=board_id, entity="comment", entity_id=db_comment.id,
+                                              action="created", data=_card_schemas.Comment.from_orm(db_comment))
     return _card_schemas.FullComment.from_orm(db_comment)
 
 
 @comments_router.get("/{board_id}/{list_id}/{card_id}/get_comments", response_model=list[_card_schemas.Comment],
                      dependencies=[list_dependency])
-async def get_comments(card_id: int, db: _Session = _Depends(_get_db)):
-    db_comments = await _card_services.get_comments_by_card(db=db, card_id=card_id)
-    return [_card_schemas.Comment.from_orm(db_comment) for db_comment in db_comments]
+async def get_comments(board_id: int, card_id: int, request: _Request, response: _Response,
+                       page_params: _pagination.PageParams = page_params_dependency,
+                       db: _AsyncSession = _Depends(_get_read_db)):
+    version = await _board_services.get_board_version(db=db, board_id=board_id)
+    not_modified = _conditional.check_etag(request, response, _conditional.make_etag("board", board_id, version))
+    if not_modified:
+        return not_modified
+    page = await _card_services.get_comments_by_card(db=db, card_id=card_id, params=page_params)
+    _pagination.set_next_cursor(response, page)
+    return _serializers.json_response(page.items, response)
 
 
 @comments_router.get("/{board_id}/{list_id}/{card_id}/{comment_id}/get_comment", response_model=_card_schemas.Comment,
                      dependencies=[list_dependency, current_user_dependency])
-async def get_comment(comment_id: int, card_id: int, db: _Session = _Depends(_get_db),
+async def get_comment(comment_id: int, card_id: int, db: _AsyncSession = _Depends(_get_read_db),
                       ):
     db_comment = await _card_services.get_comment_by_id(db=db, comment_id=comment_id, card_id=card_id)
     return _card_schemas.Comment.from_orm(db_comment)
@@ -257,29 +355,34 @@ async def get_comment(comment_id: int, card_id: int, db: _Session = _Depends(_ge
 @comments_router.put("/{board_id}/{list_id}/{card_id}/{comment_id}/update_comment",
                      response_model=_card_schemas.FullComment,
                      dependencies=[member_list_dependency])
-async def update_comment(comment_data: _card_schemas.CommentUpdate, comment_id: int, card_id: int,
+async def update_comment(comment_data: _card_schemas.CommentUpdate, board_id: int, comment_id: int, card_id: int,
                          current_user: _user_schemas.User = current_user_dependency,
-                         db: _Session = _Depends(_get_db)):
+                         db: _AsyncSession = _Depends(_get_async_db)):
     db_comment = await _card_services.get_comment_by_id(db=db, comment_id=comment_id, card_id=card_id)
     if not db_comment:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Comment not found")
     if db_comment.user_id != current_user.id:
         raise _HTTPException(status_code=_status.HTTP_403_FORBIDDEN, detail="You can't update this comment")
     db_comment = await _card_services.update_comment(db=db, comment_data=comment_data, db_comment=db_comment)
+    await _board_services.record_board_change(db=db, board_id=board_id, entity="comment", entity_id=db_comment.id,
+                                              action="updated", data=_card_schemas.Comment.from_orm(db_comment))
     return _card_schemas.FullComment.from_orm(db_comment)
 
 
 @comments_router.delete("/{board_id}/{list_id}/{card_id}/{comment_id}/delete_comment",
                         status_code=_status.HTTP_204_NO_CONTENT,
                         dependencies=[member_list_dependency])
-async def delete_comment(comment_id: int, card_id: int, current_user: _user_schemas.User = current_user_dependency,
-                         db: _Session = _Depends(_get_db)):
+async def delete_comment(board_id: int, comment_id: int, card_id: int,
+                         current_user: _user_schemas.User = current_user_dependency,
+                         db: _AsyncSession = _Depends(_get_async_db)):
     db_comment = await _card_services.get_comment_by_id(db=db, comment_id=comment_id, card_id=card_id)
     if not db_comment:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Comment not found")
     if db_comment.user_id != current_user.id:
         raise _HTTPException(status_code=_status.HTTP_403_FORBIDDEN, detail="You can't delete this comment")
     db_comment = await _card_services.delete_comment(db=db, db_comment=db_comment)
+    await _board_services.record_board_change(db=db, board_id=board_id, entity="comment", entity_id=comment_id,
+                                              action="deleted")
 
 
 # checklists
@@ -287,53 +390,61 @@ async def delete_comment(comment_id: int, card_id: int, current_user: _user_sche
 
 @checklists_router.post("/{board_id}/{card_id}/create_checklist", response_model=_card_schemas.CheckList,
                         dependencies=[member_board_dependency])
-async def create_checklist(checklist_data: _card_schemas.CheckListCreate, card_id: int,
-                           db: _Session = _Depends(_get_db)):
+async def create_checklist(checklist_data: _card_schemas.CheckListCreate, board_id: int, card_id: int,
+                           db: _AsyncSession = _Depends(_get_async_db)):
     db_checklist = await _card_services.create_checklist(db=db, checklist_data=checklist_data, card_id=card_id)
+    await _board_services.record_board_change(db=db, board_id=board_id, entity="checklist", entity_id=db_checklist.id,
+                                              action="created", data=_card_schemas.CheckList.from_orm(db_checklist))
     return _card_schemas.CheckList.from_orm(db_checklist)
 
 
 @checklists_router.get("/{board_id}/{card_id}/get_checklists", response_model=list[_card_schemas.CheckList],
                        dependencies=[board_dependency])
-async def get_checklists(card_id: int, db: _Session = _Depends(_get_db)):
-    db_checklists = await _card_services.get_checklists_by_card(db=db, card_id=card_id)
-    return [_card_schemas.CheckList.from_orm(db_checklist) for db_checklist in db_checklists]
+async def get_checklists(card_id: int, response: _Response, db: _AsyncSession = _Depends(_get_read_db)):
+    checklists = await _card_services.get_checklists_by_card(db=db, card_id=card_id)
+    return _serializers.json_response(checklists, response)
 
 
 @checklists_router.get("/{board_id}/{card_id}/{checklist_id}/get_checklist", response_model=_card_schemas.CheckList,
                        dependencies=[board_dependency])
-async def get_checklist(checklist_id: int, card_id: int, db: _Session = _Depends(_get_db)):
+async def get_checklist(checklist_id: int, card_id: int, db: _AsyncSession = _Depends(_get_read_db)):
     db_checklist = await _card_services.get_checklist_by_id(db=db, checklist_id=checklist_id, card_id=card_id)
     return _card_schemas.CheckList.from_orm(db_checklist)
 
 
 @checklists_router.put("/{board_id}/{card_id}/{checklist_id}/update_checklist", response_model=_card_schemas.CheckList,
                        dependencies=[member_board_dependency])
-async def update_checklist(checklist_data: _card_schemas.CheckListUpdate, checklist_id: int, card_id: int,
-                           db: _Session = _Depends(_get_db)):
+async def update_checklist(checklist_data: _card_schemas.CheckListUpdate, board_id: int, checklist_id: int,
+                           card_id: int,
+                           db: _AsyncSession = _Depends(_get_async_db)):
     db_checklist = await _card_services.get_checklist_by_id(db=db, checklist_id=checklist_id, card_id=card_id)
     if not db_checklist:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Checklist not found")
     db_checklist = await _card_services.update_checklist(db=db, checklist_data=checklist_data,
                                                          db_checklist=db_checklist)
+    await _board_services.record_board_change(db=db, board_id=board_id, entity="checklist", entity_id=db_checklist.id,
+                                              action="updated", data=_card_schemas.CheckList.from_orm(db_checklist))
     return _card_schemas.CheckList.from_orm(db_checklist)
 
 
 @checklists_router.delete("/{board_id}/{card_id}/{checklist_id}/delete_checklist",
                           status_code=_status.HTTP_204_NO_CONTENT,
                           dependencies=[member_board_dependency])
-async def delete_checklist(checklist_id: int, card_id: int, db: _Session = _Depends(_get_db)):
+async def delete_checklist(board_id: int, checklist_id: int, card_id: int,
+                           db: _AsyncSession = _Depends(_get_async_db)):
     db_checklist = await _card_services.get_checklist_by_id(db=db, checklist_id=checklist_id, card_id=card_id)
     if not db_checklist:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Checklist not found")
     db_checklist = await _card_services.delete_checklist(db=db, db_checklist=db_checklist)
+    await _board_services.record_board_change(db=db, board_id=board_id, entity="checklist", entity_id=checklist_id,
+                                              action="deleted")
 
 
 # card members
 
 @card_member_router.post("/{board_id}/{card_id}/add_member", response_model=_card_schemas.CardMember)
 async def add_card_member(card_id: int, card_member_data: _card_schemas.CardMemberCreate,
-                          db: _Session = _Depends(_get_db),
+                          db: _AsyncSession = _Depends(_get_async_db),
                           current_user: _user_schemas.User = current_user_dependency,
                           board=member_board_dependency):
     db_user = await _user_services.get_user_by_email(db=db, email=card_member_data.email)
@@ -348,24 +459,27 @@ async def add_card_member(card_id: int, card_member_data: _card_schemas.CardMemb
 
     db_card_member = await _card_services.add_card_member(db=db, card_id=card_id,
                                                           user_id=db_user.id)
+    await _board_services.record_board_change(db=db, board_id=board.id, entity="card_member",
+                                              entity_id=db_card_member.id, action="created",
+                                              data=_card_schemas.CardMember.from_orm(db_card_member))
 
     # add card activity
     activity = card_activities['add_member'].format(current_user.username, db_user.username)
-    await _card_services.add_card_activity(db=db, card_id=card_id, user_id=current_user.id, activity=activity)
+    await _card_services.record_card_activity(db=db, card_id=card_id, user_id=current_user.id, activity=activity)
 
     return _card_schemas.CardMember.from_orm(db_card_member)
 
 
 @card_member_router.get("/{board_id}/{card_id}/get_card_members", response_model=list[_card_schemas.CardMember],
                         dependencies=[board_dependency])
-async def get_card_members(card_id: int, db: _Session = _Depends(_get_db)):
+async def get_card_members(card_id: int, db: _AsyncSession = _Depends(_get_read_db)):
     db_card_members = await _card_services.get_card_members_by_card(db=db, card_id=card_id)
     return [_card_schemas.CardMember.from_orm(db_card_member) for db_card_member in db_card_members]
 
 
 @card_member_router.get("/{board_id}/{card_id}/{card_member_id}/get_card_member",
                         response_model=_card_schemas.CardMember, dependencies=[board_dependency])
-async def get_card_member(card_id: int, db: _Session = _Depends(_get_db),
+async def get_card_member(card_id: int, db: _AsyncSession = _Depends(_get_read_db),
                           current_user: _user_schemas.User = current_user_dependency):
     db_card_member = await _card_services.get_card_member_by_id(db=db, card_id=card_id, user_id=current_user.id)
     return _card_schemas.CardMember.from_orm(db_card_member)
@@ -374,36 +488,45 @@ async def get_card_member(card_id: int, db: _Session = _Depends(_get_db),
 @card_member_router.delete("/{board_id}/{card_id}/delete_card_member",
                            status_code=_status.HTTP_204_NO_CONTENT,
                            dependencies=[member_board_dependency])
-async def delete_card_member(card_id: int, card_member: _card_schemas.CardMemberRemove,
+async def delete_card_member(board_id: int, card_id: int, card_member: _card_schemas.CardMemberRemove,
                              current_user: _user_schemas.User = current_user_dependency,
-                             db: _Session = _Depends(_get_db)):
+                             db: _AsyncSession = _Depends(_get_async_db)):
     db_user = await _user_services.get_user_by_email(db=db, email=card_member.email)
     if not db_user:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="User not found")
     db_card_member = await _card_services.get_card_member_by_user(db=db, user_id=db_user.id, card_id=card_id)
     if not db_card_member:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="User not found")
-    db_card_member = await _card_services.delete_card_member(db=db, db_card_member=db_card_member)
+    await _card_services.delete_card_member(db=db, db_card_member=db_card_member)
+    await _board_services.record_board_change(db=db, board_id=board_id, entity="card_member",
+                                              entity_id=db_card_member.id, action="deleted")
 
     # TODO: MAKE AN UPDATE. IDEALLY, SAVE THE USER ID INSTEAD OF NAME SO IT CAN BE DYANMIC. ie, if user changes name
     # add card activity
     activity = card_activities['remove_member'].format(current_user.username, db_user.username)
-    await _card_services.add_card_activity(db=db, card_id=card_id, user_id=current_user.id, activity=activity)
+    await _card_services.record_card_activity(db=db, card_id=card_id, user_id=current_user.id, activity=activity)
 
 
 # card activity
 
 @card_activity_router.get("/{board_id}/{card_id}/get_card_activity", response_model=list[_card_schemas.CardActivity],
                           dependencies=[board_dependency])
-async def get_card_activity(card_id: int, db: _Session = _Depends(_get_db)):
-    db_card_activity = await _card_services.get_card_activity_by_card(db=db, card_id=card_id)
-    return [_card_schemas.CardActivity.from_orm(db_card_activity) for db_card_activity in db_card_activity]
+async def get_card_activity(board_id: int, card_id: int, request: _Request, response: _Response,
+                            page_params: _pagination.PageParams = page_params_dependency,
+                            db: _AsyncSession = _Depends(_get_read_db)):
+    not_modified = await _check_card_etag(db=db, request=request, response=response, board_id=board_id,
+                                          card_id=card_id)
+    if not_modified:
+        return not_modified
+    page = await _card_services.get_card_activity_by_card(db=db, card_id=card_id, params=page_params)
+    _pagination.set_next_cursor(response, page)
+    return [_card_schemas.CardActivity.from_orm(db_card_activity) for db_card_activity in page.items]
 
 
 @card_activity_router.post("/{board_id}/{card_id}/add_card_activity", response_model=_card_schemas.CardActivity,
                            dependencies=[member_board_dependency])
 async def add_card_activity(card_id: int, card_activity_data: _card_schemas.CardActivityCreate,
-                            db: _Session = _Depends(_get_db),
+                            db: _AsyncSession = _Depends(_get_async_db),
                             current_user: _user_schemas.User = current_user_dependency):
     db_card_activity = await _card_services.add_card_activity(db=db, card_id=card_id,
                                                               user_id=current_user.id,
@@ -415,17 +538,21 @@ async def add_card_activity(card_id: int, card_activity_data: _card_schemas.Card
 
 @card_label_router.post("/{board_id}/{card_id}/{label_id}/add_card_label", response_model=_card_schemas.FullCardLabel,
                         dependencies=[member_board_dependency, current_user_dependency])
-async def add_card_label(card_id: int, label_id: int, db: _Session = _Depends(_get_db)):
+async def add_card_label(board_id: int, card_id: int, label_id: int, db: _AsyncSession = _Depends(_get_async_db)):
+    if await _card_services.get_card_label_by_label(db=db, card_id=card_id, label_id=label_id):
+        raise _HTTPException(status_code=_status.HTTP_409_CONFLICT, detail="Label already added")
     db_card_label = await _card_services.add_card_label(db=db, card_id=card_id,
                                                         label_id=label_id)
     if not db_card_label:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Label not found")
+    await _board_services.record_board_change(db=db, board_id=board_id, entity="card_label", entity_id=db_card_label.id,
+                                              action="created", data=_card_schemas.CardLabel.from_orm(db_card_label))
     return _card_schemas.FullCardLabel.from_orm(db_card_label)
 
 
 @card_label_router.get("/{board_id}/{card_id}/get_card_labels", response_model=list[_card_schemas.CardLabel],
                        dependencies=[board_dependency])
-async def get_card_labels(card_id: int, db: _Session = _Depends(_get_db)):
+async def get_card_labels(card_id: int, db: _AsyncSession = _Depends(_get_read_db)):
     db_card_labels = await _card_services.get_card_labels_by_card(db=db, card_id=card_id)
     return [_card_schemas.CardLabel.from_orm(db_card_label) for db_card_label in db_card_labels]
 
@@ -433,11 +560,14 @@ async def get_card_labels(card_id: int, db: _Session = _Depends(_get_db)):
 @card_label_router.delete("/{board_id}/{card_id}/{label_id}/delete_card_label",
                           status_code=_status.HTTP_204_NO_CONTENT,
                           dependencies=[member_board_dependency])
-async def delete_card_label(card_id: int, label_id: int, db: _Session = _Depends(_get_db)):
+async def delete_card_label(board_id: int, card_id: int, label_id: int,
+                            db: _AsyncSession = _Depends(_get_async_db)):
     db_card_label = await _card_services.get_card_label_by_id(db=db, card_id=card_id, card_label_id=label_id)
     if not db_card_label:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Label not found")
     db_card_label = await _card_services.delete_card_label(db=db, db_card_label=db_card_label)
+    await _board_services.record_board_change(db=db, board_id=board_id, entity="card_label", entity_id=label_id,
+                                              action="deleted")
     # return _card_schemas.CardLabel.from_orm(db_card_label)
 
 
@@ -448,42 +578,69 @@ async def delete_card_label(card_id: int, label_id: int, db: _Session = _Depends
 @card_attachment_router.post("/{board_id}/{card_id}/add_card_attachment",
                              response_model=_card_schemas.CardAttachment,
                              dependencies=[member_board_dependency])
-async def add_card_attachment(card_id: int, file: _UploadFile, db: _Session = _Depends(_get_db),
+async def add_card_attachment(board_id: int, card_id: int, file: _UploadFile,
+                              db: _AsyncSession = _Depends(_get_async_db),
                               current_user: _user_schemas.User = current_user_dependency):
-    # write file to storage and get path
-    # TODO: SAVE FILE TO STORAGE
-    # path = await _card_services.write_file_to_storage(file=file, folder_name='card_attachments')
+    blob = await _card_services.write_file_to_storage(file=file)
     db_card_attachment = await _card_services.add_card_attachment(db=db, card_id=card_id, filename=file.filename,
-                                                                  uploaded_date=str(_dt.date.today()),
-                                                                  location="attachment/location")
+                                                                  uploaded_date=_dt.date.today(),
+                                                                  location=blob.location)
+    await _board_services.record_board_change(db=db, board_id=board_id, entity="card_attachment",
+                                              entity_id=db_card_attachment.id, action="created",
+                                              data=_card_schemas.CardAttachment.from_orm(db_card_attachment))
 
     # add card activity
     activity = card_activities['add_attachment'].format(current_user.username, file.filename)
 
-    await _card_services.add_card_activity(db=db, card_id=card_id, user_id=current_user.id, activity=activity)
+    await _card_services.record_card_activity(db=db, card_id=card_id, user_id=current_user.id, activity=activity)
     return _card_schemas.CardAttachment.from_orm(db_card_attachment)
 
 
 @card_attachment_router.get("/{board_id}/{card_id}/get_card_attachments",
                             response_model=list[_card_schemas.CardAttachment],
                             dependencies=[board_dependency])
-async def get_card_attachments(card_id: int, db: _Session = _Depends(_get_db)):
+async def get_card_attachments(card_id: int, db: _AsyncSession = _Depends(_get_read_db)):
     db_card_attachments = await _card_services.get_card_attachments_by_card(db=db, card_id=card_id)
     return [_card_schemas.CardAttachment.from_orm(db_card_attachment) for db_card_attachment in db_card_attachments]
 
 
+@card_attachment_router.get("/{board_id}/{card_id}/{attachment_id}/download", response_class=_storage.RangeFileResponse,
+                            dependencies=[board_dependency])
+async def download_card_attachment(card_id: int, attachment_id: int, range: str | None = _Header(None),
+                                   db: _AsyncSession = _Depends(_get_read_db)):
+    db_card_attachment = await _card_services.get_card_attachment_by_id(db=db, card_id=card_id,
+                                                                        attachment_id=attachment_id)
+    if not db_card_attachment:
+        raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Attachment not found")
+    try:
+        path = _storage.storage.path(db_card_attachment.location)
+        size = await _storage.storage.size(db_card_attachment.location)
+    except FileNotFoundError:
+        raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Attachment file not found")
+    try:
+        byte_range = _storage.parse_range(range, size)
+    except ValueError:
+        raise _HTTPException(status_code=_status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                             detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return _storage.RangeFileResponse(path=path, size=size, filename=db_card_attachment.file_name,
+                                      byte_range=byte_range, etag=_os.path.basename(path))
+
+
 @card_attachment_router.delete("/{board_id}/{card_id}/{attachment_id}/delete_card_attachment",
                                status_code=_status.HTTP_204_NO_CONTENT,
                                dependencies=[member_board_dependency])
-async def delete_card_attachment(card_id: int, attachment_id: int, db: _Session = _Depends(_get_db),
+async def delete_card_attachment(board_id: int, card_id: int, attachment_id: int,
+                                 db: _AsyncSession = _Depends(_get_async_db),
                                  current_user: _user_schemas.User = current_user_dependency):
     db_card_attachment = await _card_services.get_card_attachment_by_id(db=db, card_id=card_id,
                                                                         attachment_id=attachment_id)
     if not db_card_attachment:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Attachment not found")
-    db_card_attachment = await _card_services.delete_card_attachment(db=db, db_card_attachment=db_card_attachment)
+    await _card_services.delete_card_attachment(db=db, db_card_attachment=db_card_attachment)
+    await _board_services.record_board_change(db=db, board_id=board_id, entity="card_attachment",
+                                              entity_id=attachment_id, action="deleted")
 
     # add card activity
-    activity = card_activities['delete_attachment'].format(current_user.username, db_card_attachment.filename)
+    activity = card_activities['delete_attachment'].format(current_user.username, db_card_attachment.file_name)
 
-    await _card_services.add_card_activity(db=db, card_id=card_id, user_id=current_user.id, activity=activity)
+    await _card_services.record_card_activity(db=db, card_id=card_id, user_id=current_user.id, activity=activity)
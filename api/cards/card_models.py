@@ -1,39 +1,57 @@
 from api.database import Base as _Base
+from api.timestamps import local_now as _local_now, local_today as _local_today
 from sqlalchemy import Column as _Column, Integer as _Integer, String as _String, ForeignKey as _ForeignKey, \
-    ForeignKeyConstraint, Boolean as _Boolean
+    ForeignKeyConstraint, Boolean as _Boolean, Index as _Index, text as _text, Date as _Date, DateTime as _DateTime
 import datetime as _dt
 from sqlalchemy.orm import relationship as _relationship
 
 
 class Card(_Base):
     __tablename__ = "cards"
+    __table_args__ = (
+        _Index("ix_cards_list_id_rank", "list_id", "rank"),
+        # the reminder scheduler's range query; most cards have no reminder, so they are left out
+        _Index("ix_cards_reminder_datetime", "reminder_datetime", sqlite_where=_text("reminder_datetime IS NOT NULL"),
+               postgresql_where=_text("reminder_datetime IS NOT NULL")),
+        # overdue and due-date range queries
+        _Index("ix_cards_due_date", "due_date", sqlite_where=_text("due_date IS NOT NULL"),
+               postgresql_where=_text("due_date IS NOT NULL")),
+    )
     id = _Column(_Integer, primary_key=True, index=True)
-    list_id = _Column(_Integer, _ForeignKey("lists.id"))
+    list_id = _Column(_Integer, _ForeignKey("lists.id"), index=True)
     title = _Column(_String, index=True)
     description = _Column(_String)
-    created_date = _Column(_String, default=str(_dt.date.today()))
+    created_date = _Column(_Date, default=_dt.date.today, server_default=_local_today())
 
     is_active = _Column(_Boolean, default=True)
-    due_date = _Column(_String, nullable=True)
-    reminder_datetime = _Column(_String, nullable=True)
+    due_date = _Column(_Date, nullable=True)
+    reminder_datetime = _Column(_DateTime, nullable=True)
+    # order within the list, see api.ranking
+    rank = _Column(_String)
 
     list = _relationship("List", back_populates="cards")
-    comments = _relationship("Comment", back_populates="card")
+    # newest first, sorted by the database whenever the collection is loaded
+    comments = _relationship("Comment", back_populates="card",
+                             order_by=lambda: [Comment.created_datetime.desc(), Comment.id.desc()])
     check_lists = _relationship("CheckList", back_populates="card")
     card_members = _relationship("CardMember", back_populates="card")
-    card_activities = _relationship("CardActivity", back_populates="card")
+    card_activities = _relationship("CardActivity", back_populates="card",
+                                    order_by=lambda: [CardActivity.created_datetime.desc(), CardActivity.id.desc()])
     labels = _relationship("CardLabel", back_populates="card")
     attachments = _relationship("CardAttachment", back_populates="card")
 
 
 class Comment(_Base):
     __tablename__ = "comments"
+    __table_args__ = (
+        # a card's comments, newest first
+        _Index("ix_comments_card_id_created_datetime", "card_id", "created_datetime"),
+    )
     id = _Column(_Integer, primary_key=True, index=True)
-    card_id = _Column(_Integer, _ForeignKey("cards.id"))
+    card_id = _Column(_Integer, _ForeignKey("cards.id"), index=True)
     user_id = _Column(_Integer, _ForeignKey("site_users.id"))
     comment = _Column(_String)
-    created_datetime = _Column(_String, default=str(_dt.datetime.now()))
-    # TODO: UPDATE DATE FIELDS TO USE DATE IN ALL MODELS AND SCHEMAS
+    created_datetime = _Column(_DateTime, default=_dt.datetime.now, server_default=_local_now())
 
     card = _relationship("Card", back_populates="comments")
     user = _relationship("User", back_populates="comments")
@@ -42,7 +60,7 @@ class Comment(_Base):
 class CheckList(_Base):
     __tablename__ = "check_lists"
     id = _Column(_Integer, primary_key=True, index=True)
-    card_id = _Column(_Integer, _ForeignKey("cards.id"))
+    card_id = _Column(_Integer, _ForeignKey("cards.id"), index=True)
     title = _Column(_String)
     is_checked = _Column(_Integer, default=False)
     position = _Column(_Integer, default=0)
@@ -52,9 +70,12 @@ class CheckList(_Base):
 
 class CardMember(_Base):
     __tablename__ = "card_members"
+    __table_args__ = (
+        _Index("uq_card_members_card_id_user_id", "card_id", "user_id", unique=True),
+    )
     id = _Column(_Integer, primary_key=True, index=True)
     card_id = _Column(_Integer, _ForeignKey("cards.id"))
-    user_id = _Column(_Integer, _ForeignKey("site_users.id"))
+    user_id = _Column(_Integer, _ForeignKey("site_users.id"), index=True)
 
     # TODO: ADD SOME DATA ABOUT THE USER
 
@@ -64,11 +85,15 @@ class CardMember(_Base):
 
 class CardActivity(_Base):
     __tablename__ = "card_activities"
+    __table_args__ = (
+        # a card's activity, newest first
+        _Index("ix_card_activities_card_id_created_datetime", "card_id", "created_datetime"),
+    )
     id = _Column(_Integer, primary_key=True, index=True)
-    card_id = _Column(_Integer, _ForeignKey("cards.id"))
+    card_id = _Column(_Integer, _ForeignKey("cards.id"), index=True)
     user_id = _Column(_Integer, _ForeignKey("site_users.id"))
     activity = _Column(_String)
-    created_datetime = _Column(_String, default=str(_dt.datetime.now()))
+    created_datetime = _Column(_DateTime, default=_dt.datetime.now, server_default=_local_now())
 
     card = _relationship("Card", back_populates="card_activities")
     user = _relationship("User", back_populates="card_activities")
@@ -76,9 +101,12 @@ class CardActivity(_Base):
 
 class CardLabel(_Base):
     __tablename__ = "card_labels"
+    __table_args__ = (
+        _Index("uq_card_labels_card_id_label_id", "card_id", "label_id", unique=True),
+    )
     id = _Column(_Integer, primary_key=True, index=True)
     card_id = _Column(_Integer, _ForeignKey("cards.id"))
-    label_id = _Column(_Integer, _ForeignKey("board_labels.id"))
+    label_id = _Column(_Integer, _ForeignKey("board_labels.id"), index=True)
 
     card = _relationship("Card", back_populates="labels")
     board_label = _relationship("BoardLabel", back_populates="card_label")
@@ -87,9 +115,9 @@ class CardLabel(_Base):
 class CardAttachment(_Base):
     __tablename__ = "card_attachments"
     id = _Column(_Integer, primary_key=True, index=True)
-    card_id = _Column(_Integer, _ForeignKey("cards.id"))
-    uploaded_date = _Column(_String, default=str(_dt.date.today()))
+    card_id = _Column(_Integer, _ForeignKey("cards.id"), index=True)
+    uploaded_date = _Column(_Date, default=_dt.date.today, server_default=_local_today())
     file_name = _Column(_String)
-    location = _Column(_String)
+    location = _Column(_String, index=True)
 
     card = _relationship("Card", back_populates="attachments")
@@ -32,13 +32,22 @@ class Card(_BaseCard):
     is_active: bool
     due_date: _dt.date | None
     reminder_datetime: _dt.datetime | None
+    rank: str | None
 
     class Config:
         orm_mode = True
 
 
+class CardMove(_pydantic.BaseModel):
+    list_id: int
+    after_id: int | None = None
+    before_id: int | None = None
+
+
 class CardDueDate(_pydantic.BaseModel):
     due_date: _dt.date
+    # left out: the reminder stays as it is; null clears it
+    reminder_datetime: _dt.datetime | None
 
 
 class _BaseComment(_pydantic.BaseModel):
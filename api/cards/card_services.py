@@ -1,18 +1,89 @@
-from sqlalchemy.orm import Session as _Session
+import datetime as _dt
+import functools as _functools
+import os as _os
+
+from sqlalchemy import select as _select, func as _func, tuple_ as _tuple_, delete as _delete, Select as _Select
+from sqlalchemy.ext.asyncio import AsyncSession as _AsyncSession
+from sqlalchemy.orm import selectinload as _selectinload
 from . import card_models as _card_models
 from ..lists import list_models as _list_models
 import email_validator as _email_check
 import passlib.hash as _hash
-from fastapi import HTTPException as _HTTPException, status as _status, Depends as _Depends
+from fastapi import HTTPException as _HTTPException, status as _status, Depends as _Depends, UploadFile as _UploadFile
 import fastapi.security as _security
 import jwt as _jwt
 from . import card_schemas as _card_schemas
-from api.database import get_db as _get_db
+from api.database import get_async_db as _get_async_db, AsyncSessionLocal as _AsyncSessionLocal, \
+    async_engine as _async_engine, after_commit as _after_commit, commit as _commit
+from api import pagination as _pagination
+from api import storage as _storage
+from api import ranking as _ranking
+from api import serializers as _serializers
+from api.write_behind import WriteBehindBuffer as _WriteBehindBuffer
+from api.reminders import ReminderScheduler as _ReminderScheduler
 from ..users.user_services import get_current_user as _get_current_user
 from ..users import user_schemas as _user_schemas
+from ..users import user_services as _user_services
+from ..boards import board_services as _board_services
+from ..notifications import notification_models as _notification_models
+from ..notifications import notification_services as _notification_services
+
+
+# activity rows are only ever appended and read back for display, so mutations don't wait for them to be written;
+# CARD_ACTIVITY_WRITE_BEHIND=0 writes them synchronously
+activity_log = _WriteBehindBuffer(_card_models.CardActivity.__table__, _async_engine,
+                                  synchronous=_os.environ.get("CARD_ACTIVITY_WRITE_BEHIND", "1") == "0")
+
+card_serializer = _serializers.RowSerializer(_card_schemas.Card, _card_models.Card)
+_card_member_serializer = _serializers.RowSerializer(_card_schemas.CardMember, _card_models.CardMember,
+                                                     exclude=("user",))
+_comment_serializer = _serializers.RowSerializer(_card_schemas.Comment, _card_models.Comment)
+_checklist_serializer = _serializers.RowSerializer(_card_schemas.CheckList, _card_models.CheckList)
+
+
+async def get_upcoming_reminders(db: _AsyncSession, after: tuple[_dt.datetime, int], until: _dt.datetime,
+                                 limit: int):
+    """
+    The next reminders of active cards, read in index order from ix_cards_reminder_datetime
+    :param db: async session
+    :param after: (reminder time, card id) to start after
+    :param until: last reminder time to include
+    :param limit: maximum number of reminders
+    :return: list of (reminder time, card id)
+    """
+    query = _select(_card_models.Card.reminder_datetime, _card_models.Card.id) \
+        .filter(_tuple_(_card_models.Card.reminder_datetime, _card_models.Card.id) > _tuple_(after[0], after[1])) \
+        .filter(_card_models.Card.reminder_datetime <= until) \
+        .filter(_card_models.Card.is_active == True) \
+        .order_by(_card_models.Card.reminder_datetime, _card_models.Card.id).limit(limit)
+    return [(when, card_id) for when, card_id in await db.execute(query)]
+
+
+async def _load_reminders(after: tuple[_dt.datetime, int], until: _dt.datetime, limit: int):
+    async with _AsyncSessionLocal() as db:
+        return await get_upcoming_reminders(db=db, after=after, until=until, limit=limit)
+
+
+# sends due-date reminders to card members; started with the app, see api/reminders.py
+reminder_scheduler = _ReminderScheduler(load=_load_reminders, deliver=_notification_services.deliver_reminder)
+
+
+def _local_datetime(value: _dt.datetime | None) -> _dt.datetime | None:
+    # stored and compared as naive local times
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value
 
 
-async def get_current_card(card_id: int, db: _Session = _Depends(_get_db)):
+def _reschedule_reminder(db: _AsyncSession, db_card: _card_models.Card, deleted: bool = False):
+    """
+    Move the card's reminder in the scheduler once the change has committed
+    """
+    when = None if deleted or not db_card.is_active else db_card.reminder_datetime
+    _after_commit(db, _functools.partial(reminder_scheduler.reschedule, db_card.id, when))
+
+
+async def get_current_card(card_id: int, db: _AsyncSession = _Depends(_get_async_db)):
     card = await get_card_with_id(db=db, card_id=card_id)
     if not card:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Card not found")
@@ -20,45 +91,92 @@ async def get_current_card(card_id: int, db: _Session = _Depends(_get_db)):
     return card
 
 
-async def get_card_with_id(db: _Session, card_id: int):
+async def get_card_with_id(db: _AsyncSession, card_id: int):
     """
     Get card by id only
     :param db:
     :param card_id:
     :return:
     """
-    return db.query(_card_models.Card).filter(_card_models.Card.id == card_id).first()
+    return await db.scalar(_select(_card_models.Card).filter(_card_models.Card.id == card_id))
 
 
-async def create_card(db: _Session, card_data: _card_schemas.CardCreate, list_id: int):
-    db_card = _card_models.Card(**card_data.dict(), list_id=list_id)
+async def get_full_card(db: _AsyncSession, card_id: int):
+    """
+    Get card by id with everything FullCard serializes. Each collection is one selectin query with its users or
+    board labels joined in, so opening a card costs the same few queries however much it holds.
+    :param db:
+    :param card_id:
+    :return: Card or None
+    """
+    return await db.scalar(_select(_card_models.Card).filter(_card_models.Card.id == card_id).options(
+        _selectinload(_card_models.Card.comments).joinedload(_card_models.Comment.user),
+        _selectinload(_card_models.Card.check_lists),
+        _selectinload(_card_models.Card.card_members).joinedload(_card_models.CardMember.user),
+        _selectinload(_card_models.Card.card_activities).joinedload(_card_models.CardActivity.user),
+        _selectinload(_card_models.Card.labels).joinedload(_card_models.CardLabel.board_label),
+        _selectinload(_card_models.Card.attachments)))
+
+
+async def create_card(db: _AsyncSession, card_data: _card_schemas.CardCreate, list_id: int):
+    # new cards go to the bottom of the list
+    rank = await _ranking.rank_for_move(db=db, model=_card_models.Card, scope=_card_models.Card.list_id == list_id,
+                                        moving_id=None)
+    db_card = _card_models.Card(**card_data.dict(), list_id=list_id, rank=rank)
     db.add(db_card)
-    db.commit()
-    db.refresh(db_card)
+    await db.flush()
     return db_card
 
 
-async def archive_card(db: _Session, db_card: _card_models.Card):
+async def archive_card(db: _AsyncSession, db_card: _card_models.Card):
     db_card.is_active = False
     db.add(db_card)
-    db.commit()
-    db.refresh(db_card)
+    await db.flush()
+    _reschedule_reminder(db, db_card)
     return db_card
 
 
-async def unarchive_card(db: _Session, db_card: _card_models.Card):
+async def unarchive_card(db: _AsyncSession, db_card: _card_models.Card):
     db_card.is_active = True
     db.add(db_card)
-    db.commit()
-    db.refresh(db_card)
+    await db.flush()
+    _reschedule_reminder(db, db_card)
     return db_card
 
 
-async def get_cards_by_list(db: _Session, list_id: int):
-    return db.query(_card_models.Card).filter(_card_models.Card.list_id == list_id).all()
+async def get_cards_by_list(db: _AsyncSession, list_id: int, params: _pagination.PageParams):
+    """
+    A page of the list's cards, serialized like Card
+    """
+    query = card_serializer.select().filter(_card_models.Card.list_id == list_id)
+    page = await _pagination.paginate(db, query, order_by=[_card_models.Card.rank, _card_models.Card.id],
+                                      key=lambda card: (card.rank, card.id), params=params, rows=True)
+    return page._replace(items=card_serializer.serialize(page.items))
 
 
-async def get_card_by_id(db: _Session, card_id: int, list_id: int):
+async def get_cards_by_lists(db: _AsyncSession, list_ids: list[int]):
+    """
+    The cards of several lists with their members, serialized like FullCardMember
+    :return: {list_id: [card, ...]} in rank order
+    """
+    cards = card_serializer.serialize(await db.execute(card_serializer.select().filter(
+        _card_models.Card.list_id.in_(list_ids)).order_by(_card_models.Card.rank, _card_models.Card.id)))
+    members = _card_member_serializer.serialize(await db.execute(_card_member_serializer.select().filter(
+        _card_models.CardMember.card_id.in_([card["id"] for card in cards])).order_by(_card_models.CardMember.id)))
+    users = await _user_services.get_users_by_ids(db=db, user_ids={member["user_id"] for member in members})
+
+    cards_by_id, cards_by_list = {}, {list_id: [] for list_id in list_ids}
+    for card in cards:
+        card["card_members"] = []
+        cards_by_id[card["id"]] = card
+        cards_by_list[card["list_id"]].append(card)
+    for member in members:
+        member["user"] = users.get(member["user_id"])
+        cards_by_id[member["card_id"]]["card_members"].append(member)
+    return cards_by_list
+
+
+async def get_card_by_id(db: _AsyncSession, card_id: int, list_id: int):
     """
     get card for a specific list by id
     :param db:
@@ -66,217 +184,354 @@ async def get_card_by_id(db: _Session, card_id: int, list_id: int):
     :param list_id:
     :return:
     """
-    return db.query(_card_models.Card).filter(_card_models.Card.list_id == list_id).filter(
-        _card_models.Card.id == card_id).first()
+    return await db.scalar(_select(_card_models.Card).filter(_card_models.Card.list_id == list_id).filter(
+        _card_models.Card.id == card_id))
 
 
-async def update_card(db: _Session, card_data: _card_schemas.CardUpdate, db_card: _card_models.Card):
-    update_data = card_data.dict(exclude_unset=True)
+async def update_card(db: _AsyncSession, card_data: _card_schemas.CardUpdate, db_card: _card_models.Card):
+    """
+    Update a card; a new list_id moves it to the bottom of that list
+    """
+    update_data = card_data.dict(exclude_unset=True, exclude={"list_id"})
+    if card_data.list_id != db_card.list_id:
+        await move_card(db=db, db_card=db_card, card_move=_card_schemas.CardMove(list_id=card_data.list_id))
+    if "reminder_datetime" in update_data:
+        update_data["reminder_datetime"] = _local_datetime(update_data["reminder_datetime"])
     for key, value in update_data.items():
         setattr(db_card, key, value)
     db.add(db_card)
-    db.commit()
-    db.refresh(db_card)
+    await db.flush()
+    _reschedule_reminder(db, db_card)
     return db_card
 
 
-async def update_card_basics(db: _Session, card_data: _card_schemas.CardUpdateTitle, db_card: _card_models.Card):
+async def update_card_basics(db: _AsyncSession, card_data: _card_schemas.CardUpdateTitle,
+                             db_card: _card_models.Card):
     update_data = card_data.dict(exclude_unset=True)
     for key, value in update_data.items():
         setattr(db_card, key, value)
     db.add(db_card)
-    db.commit()
-    db.refresh(db_card)
+    await db.flush()
     return db_card
 
 
-async def delete_card(db: _Session, db_card: _card_models.Card):
-    db.delete(db_card)
-    db.commit()
+async def delete_card(db: _AsyncSession, db_card: _card_models.Card):
+    await delete_cards(db=db, card_ids=[db_card.id])
+    _reschedule_reminder(db, db_card, deleted=True)
 
 
-async def update_card_list(db: _Session, db_card: _card_models.Card, db_list: _list_models.List):
-    db_card.list_id = db_list.id
-    db.add(db_card)
-    db.commit()
-    db.refresh(db_card)
+# everything that belongs to a card, deleted along with it
+_card_children = (_card_models.Comment, _card_models.CheckList, _card_models.CardMember, _card_models.CardActivity,
+                  _card_models.CardLabel, _card_models.CardAttachment, _notification_models.Notification)
+
+
+async def delete_cards(db: _AsyncSession, card_ids) -> int:
+    """
+    Delete cards and everything under them with one statement per table, however many cards there are.
+    Attachment blobs no other attachment uses are removed, and activity queued for the cards dropped, once the
+    transaction commits.
+    :param db:
+    :param card_ids: list of card ids, or a select of them
+    :return: number of cards deleted
+    """
+    if activity_log.running:
+        # activity still queued for these cards would be inserted after them, orphaned
+        deleted_ids = (await db.scalars(card_ids)).all() if isinstance(card_ids, _Select) else card_ids
+        _after_commit(db, _functools.partial(activity_log.discard, "card_id", deleted_ids))
+    attachments = _card_models.CardAttachment
+    locations = set((await db.scalars(_select(attachments.location).filter(attachments.card_id.in_(card_ids)))).all())
+    for model in _card_children:
+        await db.execute(_delete(model).filter(model.card_id.in_(card_ids)).execution_options(
+            synchronize_session=False))
+    result = await db.execute(_delete(_card_models.Card).filter(_card_models.Card.id.in_(card_ids)).execution_options(
+        synchronize_session=False))
+    if locations:
+        # identical uploads share one blob, which may still be used by a card elsewhere
+        still_used = set((await db.scalars(_select(attachments.location).filter(
+            attachments.location.in_(locations)).distinct())).all())
+        for location in locations - still_used:
+            _after_commit(db, _functools.partial(_storage.storage.delete, location))
+    return result.rowcount
+
+
+async def update_card_list(db: _AsyncSession, db_card: _card_models.Card, db_list: _list_models.List):
+    return await move_card(db=db, db_card=db_card, card_move=_card_schemas.CardMove(list_id=db_list.id))
+
+
+async def get_board_card(db: _AsyncSession, card_id: int, board_id: int):
+    return await db.scalar(_select(_card_models.Card).join(_card_models.Card.list).filter(
+        _list_models.List.board_id == board_id).filter(_card_models.Card.id == card_id))
+
+
+async def move_card(db: _AsyncSession, db_card: _card_models.Card, card_move: _card_schemas.CardMove):
+    """
+    Move a card to a place in a list by giving it a new rank; no other card is touched
+    :param db:
+    :param db_card: card to move
+    :param card_move: target list, and the cards to land after and/or before, neither for the bottom of the list
+    :return: moved card
+    :raises LookupError: if after_id or before_id isn't another card in the target list
+    """
+    db_card.rank = await _ranking.rank_for_move(db=db, model=_card_models.Card,
+                                                scope=_card_models.Card.list_id == card_move.list_id,
+                                                moving_id=db_card.id, after_id=card_move.after_id,
+                                                before_id=card_move.before_id)
+    if db_card.list_id != card_move.list_id:
+        db_card.list_id = card_move.list_id
+        db.expire(db_card, ["list"])
+    await db.flush()
     return db_card
 
 
-async def set_due_date(db: _Session, db_card: _card_models.Card, card_data: _card_schemas.CardDueDate):
-    db_card.due_date = str(card_data.due_date)
+async def rebalance_list_cards(list_id: int):
+    """
+    Spread out the ranks of a list's cards once they have grown long. Runs as a background task with its own session.
+    """
+    async with _AsyncSessionLocal() as db:
+        card_ids = await _ranking.rebalance(db=db, model=_card_models.Card, scope=_card_models.Card.list_id == list_id)
+        board_id = await db.scalar(_select(_list_models.List.board_id).filter(_list_models.List.id == list_id))
+        # one change for the whole list, not one per card
+        await _board_services.record_board_change(db=db, board_id=board_id, entity="list", entity_id=list_id,
+                                                  action="rebalanced", data=_board_services.rebalanced(card_ids))
+        await _commit(db)
+
+
+async def set_due_date(db: _AsyncSession, db_card: _card_models.Card, card_data: _card_schemas.CardDueDate):
+    db_card.due_date = card_data.due_date
+    if "reminder_datetime" in card_data.__fields_set__:
+        db_card.reminder_datetime = _local_datetime(card_data.reminder_datetime)
     db.add(db_card)
-    db.commit()
-    db.refresh(db_card)
+    await db.flush()
+    _reschedule_reminder(db, db_card)
     return db_card
 
 
 # comments
 
-async def create_comment(db: _Session, comment_data: _card_schemas.CommentCreate, card_id: int, user_id: int):
+async def create_comment(db: _AsyncSession, comment_data: _card_schemas.CommentCreate, card_id: int, user_id: int):
     db_comment = _card_models.Comment(**comment_data.dict(), card_id=card_id, user_id=user_id)
     db.add(db_comment)
-    db.commit()
-    db.refresh(db_comment)
+    await db.flush()
+    # many-to-one, so this is an identity map hit when the user is already in the session
+    await db_comment.awaitable_attrs.user
     return db_comment
 
 
-async def get_comments_by_card(db: _Session, card_id: int):
-    return db.query(_card_models.Comment).filter(_card_models.Comment.card_id == card_id).all()
+async def get_comments_by_card(db: _AsyncSession, card_id: int, params: _pagination.PageParams):
+    """
+    A page of the card's comments, serialized like Comment
+    """
+    query = _comment_serializer.select().filter(_card_models.Comment.card_id == card_id)
+    page = await _pagination.paginate(db, query, order_by=[_card_models.Comment.id],
+                                      key=lambda comment: (comment.id,), params=params, rows=True)
+    return page._replace(items=_comment_serializer.serialize(page.items))
 
 
-async def get_comment_by_id(db: _Session, comment_id: int, card_id: int):
-    return db.query(_card_models.Comment).filter(_card_models.Comment.card_id == card_id).filter(
-        _card_models.Comment.id == comment_id).first()
+async def get_comment_by_id(db: _AsyncSession, comment_id: int, card_id: int):
+    return await db.scalar(_select(_card_models.Comment).filter(_card_models.Comment.card_id == card_id).filter(
+        _card_models.Comment.id == comment_id))
 
 
-async def update_comment(db: _Session, comment_data: _card_schemas.CommentUpdate, db_comment: _card_models.Comment):
+async def update_comment(db: _AsyncSession, comment_data: _card_schemas.CommentUpdate,
+                         db_comment: _card_models.Comment):
     update_data = comment_data.dict(exclude_unset=True)
     for key, value in update_data.items():
         setattr(db_comment, key, value)
     db.add(db_comment)
-    db.commit()
-    db.refresh(db_comment)
+    await db.flush()
+    # many-to-one, so this is an identity map hit when the user is already in the session
+    await db_comment.awaitable_attrs.user
     return db_comment
 
 
-async def delete_comment(db: _Session, db_comment: _card_models.Comment):
-    db.delete(db_comment)
-    db.commit()
+async def delete_comment(db: _AsyncSession, db_comment: _card_models.Comment):
+    await db.delete(db_comment)
+    await db.flush()
 
 
 # checklists
 
-async def create_checklist(db: _Session, checklist_data: _card_schemas.CheckListCreate, card_id: int):
+async def create_checklist(db: _AsyncSession, checklist_data: _card_schemas.CheckListCreate, card_id: int):
     db_checklist = _card_models.CheckList(**checklist_data.dict(), card_id=card_id)
     db.add(db_checklist)
-    db.commit()
-    db.refresh(db_checklist)
+    await db.flush()
     return db_checklist
 
 
-async def get_checklists_by_card(db: _Session, card_id: int):
-    return db.query(_card_models.CheckList).filter(_card_models.CheckList.card_id == card_id).all()
+async def get_checklists_by_card(db: _AsyncSession, card_id: int):
+    """
+    The card's checklist items, serialized like CheckList
+    """
+    return _checklist_serializer.serialize(await db.execute(_checklist_serializer.select().filter(
+        _card_models.CheckList.card_id == card_id)))
 
 
-async def get_checklist_by_id(db: _Session, checklist_id: int, card_id: int):
-    return db.query(_card_models.CheckList).filter(_card_models.CheckList.card_id == card_id).filter(
-        _card_models.CheckList.id == checklist_id).first()
+async def get_checklist_by_id(db: _AsyncSession, checklist_id: int, card_id: int):
+    return await db.scalar(_select(_card_models.CheckList).filter(_card_models.CheckList.card_id == card_id).filter(
+        _card_models.CheckList.id == checklist_id))
 
 
-async def update_checklist(db: _Session, checklist_data: _card_schemas.CheckListUpdate,
+async def update_checklist(db: _AsyncSession, checklist_data: _card_schemas.CheckListUpdate,
                            db_checklist: _card_models.CheckList):
     update_data = checklist_data.dict(exclude_unset=True)
     for key, value in update_data.items():
         setattr(db_checklist, key, value)
     db.add(db_checklist)
-    db.commit()
-    db.refresh(db_checklist)
+    await db.flush()
     return db_checklist
 
 
-async def delete_checklist(db: _Session, db_checklist: _card_models.CheckList):
-    db.delete(db_checklist)
-    db.commit()
+async def delete_checklist(db: _AsyncSession, db_checklist: _card_models.CheckList):
+    await db.delete(db_checklist)
+    await db.flush()
 
 
 # card members
 
-async def add_card_member(db: _Session, card_id: int, user_id: int):
+async def add_card_member(db: _AsyncSession, card_id: int, user_id: int):
     db_card_member = _card_models.CardMember(card_id=card_id, user_id=user_id)
     db.add(db_card_member)
-    db.commit()
-    db.refresh(db_card_member)
+    await db.flush()
+    await db_card_member.awaitable_attrs.user
     return db_card_member
 
 
-async def get_card_member_by_id(db: _Session, card_id: int, user_id: int):
-    return db.query(_card_models.CardMember).filter(_card_models.CardMember.card_id == card_id).filter(
-        _card_models.CardMember.user_id == user_id).first()
+async def get_card_member_by_id(db: _AsyncSession, card_id: int, user_id: int):
+    return await db.scalar(_select(_card_models.CardMember).filter(_card_models.CardMember.card_id == card_id).filter(
+        _card_models.CardMember.user_id == user_id).options(_selectinload(_card_models.CardMember.user)))
 
 
-async def delete_card_member(db: _Session, db_card_member: _card_models.CardMember):
-    db.delete(db_card_member)
-    db.commit()
+async def delete_card_member(db: _AsyncSession, db_card_member: _card_models.CardMember):
+    await db.delete(db_card_member)
+    await db.flush()
 
 
-async def get_card_members_by_card(db: _Session, card_id: int):
-    return db.query(_card_models.CardMember).filter(_card_models.CardMember.card_id == card_id).all()
+async def get_card_members_by_card(db: _AsyncSession, card_id: int):
+    result = await db.scalars(_select(_card_models.CardMember).filter(
+        _card_models.CardMember.card_id == card_id).options(_selectinload(_card_models.CardMember.user)))
+    return result.all()
 
 
-async def get_card_member_by_user(db: _Session, user_id: int, card_id: int):
-    return db.query(_card_models.CardMember).filter(_card_models.CardMember.card_id == card_id).filter(
-        _card_models.CardMember.user_id == user_id).first()
+async def get_card_member_by_user(db: _AsyncSession, user_id: int, card_id: int):
+    return await db.scalar(_select(_card_models.CardMember).filter(_card_models.CardMember.card_id == card_id).filter(
+        _card_models.CardMember.user_id == user_id))
 
 
-# async def remove_member_from_all_cards_in_board(db: _Session, user_id: int, board_id: int):
+async def remove_member_from_all_cards_in_board(db: _AsyncSession, user_id: int, board_id: int):
+    """
+    Take the user off every card on the board with a single DELETE, in the request's unit of work
+    :param db: async session
+    :param user_id: the user leaving the board
+    :param board_id: the board
+    :return: number of card memberships removed
+    """
+    board_cards = _select(_card_models.Card.id).join(_card_models.Card.list).filter(
+        _list_models.List.board_id == board_id)
+    # nothing on this path has loaded card members, so the session has no objects to sync
+    result = await db.execute(_delete(_card_models.CardMember).filter(
+        _card_models.CardMember.user_id == user_id).filter(_card_models.CardMember.card_id.in_(board_cards))
+        .execution_options(synchronize_session=False))
+    return result.rowcount
 
 
 # card activity
 
-async def get_card_activity_by_card(db: _Session, card_id: int):
-    return db.query(_card_models.CardActivity).filter(_card_models.CardActivity.card_id == card_id).all()
+async def get_card_activity_by_card(db: _AsyncSession, card_id: int, params: _pagination.PageParams):
+    # newest first, like the activity on the full card
+    query = _select(_card_models.CardActivity).filter(_card_models.CardActivity.card_id == card_id)
+    return await _pagination.paginate(db, query, order_by=[_card_models.CardActivity.id],
+                                      key=lambda activity: (activity.id,), params=params, descending=True)
+
+
+async def get_latest_card_activity_id(db: _AsyncSession, card_id: int):
+    """
+    Id of the card's newest activity, 0 if it has none. Activity is written behind, after the change that caused it
+    has bumped the board's version, so reads that include activity add this to their ETag.
+    """
+    latest = await db.scalar(_select(_func.max(_card_models.CardActivity.id)).filter(
+        _card_models.CardActivity.card_id == card_id))
+    return latest or 0
+
+
+async def record_card_activity(db: _AsyncSession, card_id: int, user_id: int, activity: str):
+    """
+    Log what a user did to a card as part of the request's unit of work. With the write-behind log running the row
+    is queued once the request commits, otherwise it is inserted in the request's own transaction.
+    """
+    row = {"card_id": card_id, "user_id": user_id, "activity": activity, "created_datetime": _dt.datetime.now()}
+    if activity_log.running:
+        _after_commit(db, _functools.partial(activity_log.add, row))
+    else:
+        db.add(_card_models.CardActivity(**row))
 
 
-async def add_card_activity(db: _Session, card_id: int, user_id: int, activity: str):
-    db_card_activity = _card_models.CardActivity(card_id=card_id, user_id=user_id, activity=activity)
+async def add_card_activity(db: _AsyncSession, card_id: int, user_id: int, activity: str):
+    db_card_activity = _card_models.CardActivity(card_id=card_id, user_id=user_id, activity=activity,
+                                                 created_datetime=_dt.datetime.now())
     db.add(db_card_activity)
-    db.commit()
-    db.refresh(db_card_activity)
+    await db.flush()
     return db_card_activity
 
 
 # labels
 
-async def add_card_label(db: _Session, card_id: int, label_id: int):
+async def add_card_label(db: _AsyncSession, card_id: int, label_id: int):
     db_card_label = _card_models.CardLabel(card_id=card_id, label_id=label_id)
     db.add(db_card_label)
-    db.commit()
-    db.refresh(db_card_label)
+    await db.flush()
+    await db_card_label.awaitable_attrs.board_label
     return db_card_label
 
 
-async def get_card_labels_by_card(db: _Session, card_id: int):
-    return db.query(_card_models.CardLabel).filter(_card_models.CardLabel.card_id == card_id).all()
+async def get_card_labels_by_card(db: _AsyncSession, card_id: int):
+    result = await db.scalars(_select(_card_models.CardLabel).filter(_card_models.CardLabel.card_id == card_id))
+    return result.all()
 
 
-async def get_card_label_by_label(db: _Session, card_id: int, label_id: int):
-    return db.query(_card_models.CardLabel).filter(_card_models.CardLabel.card_id == card_id).filter(
-        _card_models.CardLabel.label_id == label_id).first()
+async def get_card_label_by_label(db: _AsyncSession, card_id: int, label_id: int):
+    return await db.scalar(_select(_card_models.CardLabel).filter(_card_models.CardLabel.card_id == card_id).filter(
+        _card_models.CardLabel.label_id == label_id))
 
 
-async def get_card_label_by_id(db: _Session, card_label_id: int, card_id: int):
-    return db.query(_card_models.CardLabel).filter(_card_models.CardLabel.card_id == card_id).filter(
-        _card_models.CardLabel.id == card_label_id).first()
+async def get_card_label_by_id(db: _AsyncSession, card_label_id: int, card_id: int):
+    return await db.scalar(_select(_card_models.CardLabel).filter(_card_models.CardLabel.card_id == card_id).filter(
+        _card_models.CardLabel.id == card_label_id))
 
 
-async def delete_card_label(db: _Session, db_card_label: _card_models.CardLabel):
-    db.delete(db_card_label)
-    db.commit()
+async def delete_card_label(db: _AsyncSession, db_card_label: _card_models.CardLabel):
+    await db.delete(db_card_label)
+    await db.flush()
 
 
-async def write_file_to_storage(file, path: str):
-    pass
+async def write_file_to_storage(file: _UploadFile) -> _storage.StoredBlob:
+    return await _storage.storage.save(file)
 
 
-async def add_card_attachment(db: _Session, card_id: int, filename: str, uploaded_date: str, location: str):
+async def add_card_attachment(db: _AsyncSession, card_id: int, filename: str, uploaded_date: _dt.date,
+                              location: str):
     db_file = _card_models.CardAttachment(card_id=card_id, uploaded_date=uploaded_date, file_name=filename,
                                           location=location)
     db.add(db_file)
-    db.commit()
-    db.refresh(db_file)
+    await db.flush()
     return db_file
 
 
-async def get_card_attachments_by_card(db: _Session, card_id: int):
-    return db.query(_card_models.CardAttachment).filter(_card_models.CardAttachment.card_id == card_id).all()
+async def get_card_attachments_by_card(db: _AsyncSession, card_id: int):
+    result = await db.scalars(_select(_card_models.CardAttachment).filter(
+        _card_models.CardAttachment.card_id == card_id))
+    return result.all()
 
 
-async def get_card_attachment_by_id(db: _Session, attachment_id: int, card_id: int):
-    return db.query(_card_models.CardAttachment).filter(_card_models.CardAttachment.card_id == card_id).filter(
-        _card_models.CardAttachment.id == attachment_id).first()
+async def get_card_attachment_by_id(db: _AsyncSession, attachment_id: int, card_id: int):
+    return await db.scalar(_select(_card_models.CardAttachment).filter(
+        _card_models.CardAttachment.card_id == card_id).filter(_card_models.CardAttachment.id == attachment_id))
 
 
-async def delete_card_attachment(db: _Session, db_card_attachment: _card_models.CardAttachment):
-    db.delete(db_card_attachment)
-    db.commit()
+async def delete_card_attachment(db: _AsyncSession, db_card_attachment: _card_models.CardAttachment):
+    await db.delete(db_card_attachment)
+    await db.flush()
+    # identical uploads share one blob, so it can only go once no attachment points at it
+    still_used = await db.scalar(_select(_card_models.CardAttachment.id).filter(
+        _card_models.CardAttachment.location == db_card_attachment.location).limit(1))
+    if still_used is None:
+        _after_commit(db, _functools.partial(_storage.storage.delete, db_card_attachment.location))
@@ -0,0 +1,451 @@
+import asyncio
+import datetime
+import os
+import unittest
+import uuid
+from fastapi.testclient import TestClient
+from sqlalchemy import event, func, select, text
+from api.main import app
+from api.database import AsyncSessionLocal, async_engine, commit
+from api import ranking, storage
+from api.cards import card_services
+from api.cards.card_models import Card, CardActivity
+from api.write_behind import WriteBehindBuffer
+
+client = TestClient(app)
+
+
+class TestCard(unittest.TestCase):
+    email = "test3@gmail.com"
+    password = "password123"
+    username = "Test User"
+
+    from api.database import create_db as _create_db
+    _create_db()
+
+    def setUp(self):
+        self.create_user()
+        self.access_token = self.login_and_get_token()
+        self.headers = {
+            "Authorization": f"Bearer {self.access_token}"
+        }
+        self.board = self.create_board()
+        self.list = self.create_list()
+        self.card = self.create_card()
+
+    def create_user(self):
+        user_data = {
+            "email": self.email,
+            "password": self.password,
+            "username": self.username
+        }
+        response = client.post("/users/create_user", json=user_data)
+        if response.status_code != 200:
+            # User already exists
+            pass
+        else:
+            self.assertEqual(response.status_code, 200)
+
+    def login_and_get_token(self):
+        login_data = {
+            "username": self.email,
+            "password": self.password
+        }
+        response = client.post("/users/token", data=login_data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["token_type"], "bearer")
+        return response.json()["access_token"]
+
+    def create_board(self):
+        response = client.post("/boards/create_board", json={
+            "name": "Board name 2",
+            "is_public": True
+        }, headers=self.headers)
+        return response.json()
+
+    def create_list(self):
+        response = client.post(f"/lists/{self.board['id']}/create_list", json={
+            "name": "List name",
+            "position": 0
+        }, headers=self.headers)
+        return response.json()
+
+    def create_card(self):
+        response = client.post(f"/cards/{self.board['id']}/{self.list['id']}/create_card", json={
+            "title": "Card title",
+            "description": "Card description"
+        }, headers=self.headers)
+        return response.json()
+
+    def count_queries(self, request):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            request()
+        finally:
+            event.remove(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+        return len(statements)
+
+    def fill_card(self):
+        board_id, list_id, card_id = self.board["id"], self.list["id"], self.card["id"]
+        label = client.post(f"/boards/{board_id}/labels", json={"name": "Label", "color": "red"},
+                            headers=self.headers).json()
+        for number in range(3):
+            client.post(f"/comments/{board_id}/{list_id}/{card_id}/create_comment",
+                        json={"comment": f"Comment {number}"}, headers=self.headers)
+            client.post(f"/checklists/{board_id}/{card_id}/create_checklist",
+                        json={"title": f"Item {number}", "is_checked": False, "position": number},
+                        headers=self.headers)
+            client.post(f"/card_activity/{board_id}/{card_id}/add_card_activity",
+                        json={"activity": f"Activity {number}"}, headers=self.headers)
+            client.post(f"/card_attachments/{board_id}/{card_id}/add_card_attachment",
+                        files={"file": (f"file{number}.txt", b"attachment")}, headers=self.headers)
+        client.post(f"/card_labels/{board_id}/{card_id}/{label['id']}/add_card_label", headers=self.headers)
+
+    def test_get_full_card(self):
+        response = client.get(f"/cards/{self.board['id']}/{self.card['id']}/get_full_card", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        card_data = response.json()
+        self.assertEqual(card_data["id"], self.card["id"])
+        self.assertEqual(card_data["title"], "Card title")
+        self.assertEqual(len(card_data["card_activities"]), 1)
+
+    def test_get_full_card_not_modified(self):
+        path = f"/cards/{self.board['id']}/{self.card['id']}/get_full_card"
+        etag = client.get(path, headers=self.headers).headers["ETag"]
+        response = client.get(path, headers={**self.headers, "If-None-Match": etag})
+        self.assertEqual((response.status_code, response.content), (304, b""))
+        self.assertEqual(response.headers["ETag"], etag)
+
+        # activity doesn't bump the board's version, but still changes the card
+        client.post(f"/card_activity/{self.board['id']}/{self.card['id']}/add_card_activity",
+                    json={"activity": "Activity"}, headers=self.headers)
+        response = client.get(path, headers={**self.headers, "If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["card_activities"]), 2)
+        etag = response.headers["ETag"]
+
+        client.post(f"/card_attachments/{self.board['id']}/{self.card['id']}/add_card_attachment",
+                    files={"file": ("file.txt", b"attachment")}, headers=self.headers)
+        response = client.get(path, headers={**self.headers, "If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_get_full_card_not_found(self):
+        response = client.get(f"/cards/{self.board['id']}/0/get_full_card", headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+        other_board = self.create_board()
+        response = client.get(f"/cards/{other_board['id']}/{self.card['id']}/get_full_card", headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+
+    def test_mutation_and_activity_commit_together(self):
+        commits = []
+
+        def commit(conn):
+            commits.append(conn)
+
+        event.listen(async_engine.sync_engine, "commit", commit)
+        try:
+            response = client.put(f"/cards/{self.board['id']}/{self.list['id']}/{self.card['id']}/update_card_basics",
+                                  json={"title": "Renamed"}, headers=self.headers)
+        finally:
+            event.remove(async_engine.sync_engine, "commit", commit)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["title"], "Renamed")
+        self.assertEqual(len(commits), 1)
+        activities = client.get(f"/card_activity/{self.board['id']}/{self.card['id']}/get_card_activity",
+                                headers=self.headers).json()
+        self.assertEqual(activities[0]["activity"], f"{self.username} updated this card")
+
+    def test_get_full_card_query_count_is_bounded(self):
+        def get_full_card():
+            response = client.get(f"/cards/{self.board['id']}/{self.card['id']}/get_full_card",
+                                  headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+
+        empty_card_queries = self.count_queries(get_full_card)
+        self.fill_card()
+        full_card_queries = self.count_queries(get_full_card)
+        self.assertEqual(empty_card_queries, full_card_queries)
+
+    def read_all_pages(self, path, limit):
+        items, params = [], {"limit": limit}
+        while True:
+            response = client.get(path, params=params, headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.json()), limit)
+            items += response.json()
+            if "X-Next-Cursor" not in response.headers:
+                return items
+            params["cursor"] = response.headers["X-Next-Cursor"]
+
+    def test_get_card_activity_pages(self):
+        self.fill_card()
+        activities = self.read_all_pages(f"/card_activity/{self.board['id']}/{self.card['id']}/get_card_activity", 2)
+        activity_ids = [activity["id"] for activity in activities]
+        self.assertGreater(len(activity_ids), 2)
+        self.assertEqual(activity_ids, sorted(set(activity_ids), reverse=True))
+
+    def test_get_comments_pages(self):
+        self.fill_card()
+        comments = self.read_all_pages(f"/comments/{self.board['id']}/{self.list['id']}/{self.card['id']}/get_comments",
+                                       2)
+        self.assertEqual([comment["comment"] for comment in comments], ["Comment 0", "Comment 1", "Comment 2"])
+
+    def test_invalid_cursor(self):
+        response = client.get(f"/cards/{self.board['id']}/{self.list['id']}/get_cards",
+                              params={"cursor": "not a cursor"}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_full_card_sorts_newest_first(self):
+        self.fill_card()
+        response = client.get(f"/cards/{self.board['id']}/{self.card['id']}/get_full_card", headers=self.headers)
+        card_data = response.json()
+        comment_ids = [comment["id"] for comment in card_data["comments"]]
+        activity_ids = [activity["id"] for activity in card_data["card_activities"]]
+        self.assertEqual(comment_ids, sorted(comment_ids, reverse=True))
+        self.assertEqual(activity_ids, sorted(activity_ids, reverse=True))
+        self.assertEqual(card_data["comments"][0]["user"]["email"], self.email)
+
+    def upload_attachment(self, filename, content):
+        response = client.post(f"/card_attachments/{self.board['id']}/{self.card['id']}/add_card_attachment",
+                               files={"file": (filename, content)}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def download_attachment(self, attachment, headers=None):
+        return client.get(f"/card_attachments/{self.board['id']}/{self.card['id']}/{attachment['id']}/download",
+                          headers={**self.headers, **(headers or {})})
+
+    def test_attachment_download(self):
+        content = bytes(range(256)) * 8192
+        attachment = self.upload_attachment("data.bin", content)
+        self.assertEqual(os.path.getsize(storage.storage.path(attachment["location"])), len(content))
+
+        response = self.download_attachment(attachment)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, content)
+        self.assertEqual(response.headers["accept-ranges"], "bytes")
+        self.assertIn("data.bin", response.headers["content-disposition"])
+
+    def test_attachment_range_download(self):
+        content = b"0123456789" * 1000
+        attachment = self.upload_attachment("digits.txt", content)
+
+        response = self.download_attachment(attachment, {"Range": "bytes=10-19"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, content[10:20])
+        self.assertEqual(response.headers["content-range"], f"bytes 10-19/{len(content)}")
+
+        response = self.download_attachment(attachment, {"Range": "bytes=-5"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, content[-5:])
+
+        response = self.download_attachment(attachment, {"Range": f"bytes={len(content)}-"})
+        self.assertEqual(response.status_code, 416)
+
+    def test_identical_attachments_share_storage(self):
+        first = self.upload_attachment("first.txt", b"same content")
+        second = self.upload_attachment("second.txt", b"same content")
+        self.assertNotEqual(first["id"], second["id"])
+        self.assertEqual(first["location"], second["location"])
+
+        response = client.delete(f"/card_attachments/{self.board['id']}/{self.card['id']}/{first['id']}"
+                                 f"/delete_card_attachment", headers=self.headers)
+        self.assertEqual(response.status_code, 204)
+        response = self.download_attachment(second)
+        self.assertEqual(response.content, b"same content")
+
+    def card_ids(self, list_id):
+        response = client.get(f"/cards/{self.board['id']}/{list_id}/get_cards", headers=self.headers)
+        return [card["id"] for card in response.json()]
+
+    def move_card(self, card, list_id, **neighbours):
+        response = client.put(f"/cards/{self.board['id']}/{card['id']}/move", json={"list_id": list_id, **neighbours},
+                              headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_move_card_within_list(self):
+        second, third = self.create_card(), self.create_card()
+        self.move_card(third, self.list["id"], after_id=self.card["id"], before_id=second["id"])
+        self.assertEqual(self.card_ids(self.list["id"]), [self.card["id"], third["id"], second["id"]])
+        self.move_card(self.card, self.list["id"])
+        self.assertEqual(self.card_ids(self.list["id"]), [third["id"], second["id"], self.card["id"]])
+
+    def test_move_card_to_other_list(self):
+        other_list = client.post(f"/lists/{self.board['id']}/create_list", json={"name": "Done", "position": 1},
+                                 headers=self.headers).json()
+        moved = self.move_card(self.card, other_list["id"])
+        self.assertEqual(moved["list_id"], other_list["id"])
+        self.assertEqual(self.card_ids(other_list["id"]), [self.card["id"]])
+        response = client.get(f"/card_activity/{self.board['id']}/{self.card['id']}/get_card_activity",
+                              headers=self.headers)
+        self.assertIn("moved this card from List name to Done", response.json()[0]["activity"])
+
+        response = client.put(f"/cards/{self.board['id']}/{self.card['id']}/move",
+                              json={"list_id": self.list["id"], "before_id": self.card["id"]}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_update_card_list_off_board(self):
+        other_board = self.create_board()
+        other_list = client.post(f"/lists/{other_board['id']}/create_list", json={"name": "Elsewhere", "position": 0},
+                                 headers=self.headers).json()
+        response = client.put(f"/cards/{self.board['id']}/{self.card['id']}/{other_list['id']}", headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+        # the card is on this board, not the one in the path
+        response = client.put(f"/cards/{other_board['id']}/{self.card['id']}/{other_list['id']}", headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+        self.assertIn(self.card["id"], self.card_ids(self.list["id"]))
+
+    def test_deleting_card_drops_its_queued_activity(self):
+        activity_log = card_services.activity_log
+
+        async def delete_with_activity_queued():
+            interval, activity_log.interval = activity_log.interval, 60
+            activity_log.start()
+            try:
+                await activity_log.add({"card_id": self.card["id"], "user_id": 0, "activity": "Queued",
+                                        "created_datetime": datetime.datetime.now()})
+                async with AsyncSessionLocal() as db:
+                    # the select a list deletion passes
+                    await card_services.delete_cards(db=db, card_ids=select(Card.id).filter(Card.id == self.card["id"]))
+                    await commit(db)
+                queued = len(activity_log)
+                await activity_log.stop()
+            finally:
+                activity_log.interval = interval
+            async with async_engine.connect() as connection:
+                orphans = await connection.scalar(select(func.count()).select_from(CardActivity).filter(
+                    CardActivity.card_id == self.card["id"]))
+            return queued, orphans
+
+        self.assertEqual(asyncio.run(delete_with_activity_queued()), (0, 0))
+
+    def update_card(self, list_id, **fields):
+        return client.put(f"/cards/{self.board['id']}/{self.list['id']}/{self.card['id']}/update_card",
+                          json={"title": "Card title", "description": "Card description", "list_id": list_id,
+                                "is_active": True, "due_date": "2030-01-01", **fields}, headers=self.headers)
+
+    def test_update_card_to_other_list(self):
+        other_list = client.post(f"/lists/{self.board['id']}/create_list", json={"name": "Done", "position": 1},
+                                 headers=self.headers).json()
+        first = self.move_card(self.create_card(), other_list["id"])
+        response = self.update_card(other_list["id"], title="Renamed")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()["list_id"], response.json()["title"]), (other_list["id"], "Renamed"))
+        # it lands below the cards already there rather than keeping the rank it had in the old list
+        self.assertEqual(self.card_ids(other_list["id"]), [first["id"], self.card["id"]])
+        self.assertNotIn(self.card["id"], self.card_ids(self.list["id"]))
+
+    def test_update_card_to_list_on_other_board(self):
+        other_board = self.create_board()
+        other_list = client.post(f"/lists/{other_board['id']}/create_list", json={"name": "Elsewhere", "position": 0},
+                                 headers=self.headers).json()
+        response = self.update_card(other_list["id"])
+        self.assertEqual(response.status_code, 404)
+        self.assertIn(self.card["id"], self.card_ids(self.list["id"]))
+
+    def test_dense_ranks_are_rebalanced(self):
+        first, second = self.create_card(), self.create_card()
+        moving = [first, second]
+        # keep inserting into the same gap until the ranks get long enough to be respread
+        for move in range(100):
+            moved = self.move_card(moving[move % 2], self.list["id"], after_id=self.card["id"])
+            if ranking.needs_rebalance(moved["rank"]):
+                break
+        else:
+            self.fail("ranks never grew")
+
+        cards = client.get(f"/cards/{self.board['id']}/{self.list['id']}/get_cards", headers=self.headers).json()
+        self.assertEqual([card["id"] for card in cards], [self.card["id"], moved["id"], moving[(move + 1) % 2]["id"]])
+        self.assertTrue(all(len(card["rank"]) <= ranking.RANK_WIDTH for card in cards))
+        # the move itself, then one change for the whole rebalance
+        version = client.get("/boards/get_full_board", params={"board_id": self.board["id"]},
+                             headers=self.headers).json()["version"]
+        changes = client.get(f"/boards/{self.board['id']}/changes", params={"since": version - 2},
+                             headers=self.headers).json()["changes"]
+        self.assertEqual([(change["entity"], change["action"]) for change in changes],
+                         [("card", "moved"), ("list", "rebalanced")])
+        self.assertEqual(changes[1]["data"]["ranks"], [{"id": card["id"], "rank": card["rank"]} for card in cards])
+
+
+
+async def count_activities(activity):
+    async with async_engine.connect() as connection:
+        return await connection.scalar(select(func.count()).select_from(CardActivity).filter(
+            CardActivity.activity == activity))
+
+
+class TestCardActivityLog(unittest.TestCase):
+
+    def activity_row(self, activity):
+        return {"card_id": 0, "user_id": 0, "activity": activity, "created_datetime": datetime.datetime(2023, 1, 1)}
+
+    def test_unstarted_log_writes_immediately(self):
+        activity = f"unstarted {uuid.uuid4()}"
+        activity_log = WriteBehindBuffer(CardActivity.__table__, async_engine)
+        asyncio.run(activity_log.add(self.activity_row(activity)))
+        self.assertEqual(len(activity_log), 0)
+        self.assertEqual(asyncio.run(count_activities(activity)), 1)
+
+    def test_started_log_writes_in_batches(self):
+        activity = f"batched {uuid.uuid4()}"
+        inserts = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith("INSERT INTO card_activities"):
+                inserts.append(statement)
+
+        async def write_behind():
+            activity_log = WriteBehindBuffer(CardActivity.__table__, async_engine, batch_size=3, interval=60)
+            activity_log.start()
+            written = []
+            for _ in range(3):
+                await activity_log.add(self.activity_row(activity))
+            written.append(await count_activities(activity))
+            # a full batch wakes the flusher
+            await asyncio.sleep(0.2)
+            written.append(await count_activities(activity))
+            for _ in range(2):
+                await activity_log.add(self.activity_row(activity))
+            await asyncio.sleep(0.2)
+            written.append(await count_activities(activity))
+            # the rest waits for the timer, or for shutdown
+            await activity_log.stop()
+            written.append(await count_activities(activity))
+            return written
+
+        event.listen(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            written = asyncio.run(write_behind())
+        finally:
+            event.remove(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+        self.assertEqual(written, [0, 3, 3, 5])
+        self.assertEqual(len(inserts), 2)
+
+    def test_timestamps_default_to_insert_time(self):
+        activity = f"defaults {uuid.uuid4()}"
+
+        async def insert_and_read():
+            async with async_engine.begin() as connection:
+                # plain SQL only gets the server default, Core and the ORM get the Python one
+                await connection.execute(text("INSERT INTO card_activities (card_id, user_id, activity) "
+                                              "VALUES (0, 0, :activity)"), {"activity": activity})
+                await connection.execute(CardActivity.__table__.insert().values(card_id=0, user_id=0,
+                                                                                activity=activity))
+            async with async_engine.connect() as connection:
+                return (await connection.execute(select(CardActivity.created_datetime).filter(
+                    CardActivity.activity == activity))).scalars().all()
+
+        before = datetime.datetime.now()
+        created = asyncio.run(insert_and_read())
+        after = datetime.datetime.now()
+        self.assertEqual(len(created), 2)
+        for created_datetime in created:
+            self.assertIsInstance(created_datetime, datetime.datetime)
+            self.assertTrue(before - datetime.timedelta(seconds=1) <= created_datetime <= after)
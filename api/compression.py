@@ -0,0 +1,188 @@
+"""
+Response compression negotiated from Accept-Encoding.
+
+Brotli is preferred when the `brotli` package is installed and the client accepts it, gzip otherwise. Only textual
+bodies (JSON, text) of at least COMPRESSION_MINIMUM_SIZE bytes are compressed: small bodies gain nothing, and
+attachments are either already compressed or served with byte ranges, which compressing would break. Compressible
+responses get `Vary: Accept-Encoding` whether or not they were compressed, so shared caches keep the variants apart.
+
+The levels favour speed: gzip level 6 and brotli quality 4 get most of the size reduction at a fraction of the CPU
+cost of the maximum settings.
+"""
+import os as _os
+import zlib as _zlib
+
+from starlette.datastructures import Headers as _Headers, MutableHeaders as _MutableHeaders
+from starlette.types import ASGIApp as _ASGIApp, Message as _Message, Receive as _Receive, Scope as _Scope, \
+    Send as _Send
+
+try:
+    import brotli as _brotli
+except ImportError:
+    _brotli = None
+
+COMPRESSION_MINIMUM_SIZE = int(_os.environ.get("COMPRESSION_MINIMUM_SIZE", "1024"))
+GZIP_LEVEL = int(_os.environ.get("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(_os.environ.get("BROTLI_QUALITY", "4"))
+
+_COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "image/svg+xml")
+
+
+class _GzipCompressor:
+
+    def __init__(self, level: int):
+        # wbits=31 writes the gzip header and trailer
+        self._compressor = _zlib.compressobj(level, _zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class _BrotliCompressor:
+
+    def __init__(self, quality: int):
+        self._compressor = _brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+def available_encodings() -> tuple[str, ...]:
+    """
+    Encodings the server can produce, most preferred first
+    """
+    return ("br", "gzip") if _brotli is not None else ("gzip",)
+
+
+def negotiate_encoding(accept_encoding: str, encodings: tuple[str, ...] = None) -> str | None:
+    """
+    Pick the encoding to compress with
+    :param accept_encoding: the request's Accept-Encoding header
+    :param encodings: encodings to choose from, most preferred first; available_encodings() by default
+    :return: the accepted encoding with the highest q-value, ties going to the server's preference, or None
+    """
+    encodings = available_encodings() if encodings is None else encodings
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        weight = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name.strip().lower()] = weight
+    best, best_weight = None, 0.0
+    for encoding in encodings:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def _new_compressor(encoding: str):
+    return _BrotliCompressor(BROTLI_QUALITY) if encoding == "br" else _GzipCompressor(GZIP_LEVEL)
+
+
+def _is_compressible(status: int, headers: _Headers) -> bool:
+    if status in (204, 206, 304) or "content-encoding" in headers or "content-range" in headers:
+        return False
+    # byte ranges are served from the stored file, so such responses have to go out as they are
+    if "accept-ranges" in headers:
+        return False
+    return headers.get("content-type", "").startswith(_COMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware:
+
+    def __init__(self, app: _ASGIApp, minimum_size: int = None):
+        """
+        :param app: the ASGI app to wrap
+        :param minimum_size: smallest body, in bytes, worth compressing; COMPRESSION_MINIMUM_SIZE by default
+        """
+        self.app = app
+        self.minimum_size = COMPRESSION_MINIMUM_SIZE if minimum_size is None else minimum_size
+
+    async def __call__(self, scope: _Scope, receive: _Receive, send: _Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(_Headers(scope=scope).get("accept-encoding", ""))
+        await _CompressionResponder(self.app, encoding, self.minimum_size)(scope, receive, send)
+
+
+class _CompressionResponder:
+
+    def __init__(self, app: _ASGIApp, encoding: str | None, minimum_size: int):
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.send = None
+        self.start_message = None
+        self.compressor = None
+        # None until the first body message shows whether this response is compressed
+        self.passthrough = None
+
+    async def __call__(self, scope: _Scope, receive: _Receive, send: _Send):
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    async def send_compressed(self, message: _Message):
+        if message["type"] == "http.response.start":
+            # held back until the first body message, which decides the headers
+            self.start_message = message
+            return
+        if message["type"] != "http.response.body":
+            if self.passthrough is None and self.start_message is not None:
+                # e.g. http.response.zerocopysend: the body never passes through here, so it goes out as it is
+                await self.start_passthrough()
+            await self.send(message)
+            return
+        if self.passthrough is None:
+            await self.start(message)
+            return
+        if self.passthrough:
+            await self.send(message)
+            return
+        body = self.compressor.compress(message.get("body", b""))
+        if not message.get("more_body", False):
+            body += self.compressor.finish()
+        await self.send({**message, "body": body})
+
+    async def start_passthrough(self):
+        headers = _MutableHeaders(raw=self.start_message["headers"])
+        if _is_compressible(self.start_message["status"], headers):
+            headers.add_vary_header("Accept-Encoding")
+        self.passthrough = True
+        await self.send(self.start_message)
+
+    async def start(self, message: _Message):
+        headers = _MutableHeaders(raw=self.start_message["headers"])
+        body, more_body = message.get("body", b""), message.get("more_body", False)
+        self.passthrough = True
+        if _is_compressible(self.start_message["status"], headers):
+            headers.add_vary_header("Accept-Encoding")
+            self.passthrough = self.encoding is None or (not more_body and len(body) < self.minimum_size)
+        if self.passthrough:
+            await self.send(self.start_message)
+            await self.send(message)
+            return
+
+        self.compressor = _new_compressor(self.encoding)
+        body = self.compressor.compress(body)
+        headers["Content-Encoding"] = self.encoding
+        if more_body:
+            del headers["Content-Length"]
+        else:
+            body += self.compressor.finish()
+            headers["Content-Length"] = str(len(body))
+        await self.send(self.start_message)
+        await self.send({**message, "body": body})
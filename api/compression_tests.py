@@ -0,0 +1,96 @@
+import asyncio
+import gzip
+import unittest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+from api import compression
+from api.responses import JSONResponse
+
+app = FastAPI(default_response_class=JSONResponse)
+app.add_middleware(compression.CompressionMiddleware, minimum_size=100)
+
+
+@app.get("/large")
+async def large():
+    return {"cards": [{"id": number, "title": "Card title"} for number in range(100)]}
+
+
+@app.get("/small")
+async def small():
+    return {"id": 1}
+
+
+@app.get("/stream")
+async def stream():
+    return StreamingResponse((b"line %d\n" % number for number in range(1000)), media_type="text/plain")
+
+
+@app.get("/file")
+async def file():
+    return PlainTextResponse("x" * 1000, headers={"accept-ranges": "bytes"})
+
+
+client = TestClient(app)
+
+
+class TestCompression(unittest.TestCase):
+
+    def get(self, path, accept_encoding="gzip"):
+        # httpx decodes gzip bodies by itself, so ask for the raw stream to see what went over the wire
+        with client.stream("GET", path, headers={"Accept-Encoding": accept_encoding}) as response:
+            return response, b"".join(response.iter_raw())
+
+    def test_large_json_is_gzipped(self):
+        response, body = self.get("/large")
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+        self.assertEqual(response.headers["content-length"], str(len(body)))
+        self.assertEqual(response.headers["vary"], "Accept-Encoding")
+        self.assertEqual(gzip.decompress(body), client.get("/large", headers={"Accept-Encoding": ""}).content)
+
+    def test_small_json_is_sent_as_is(self):
+        response, body = self.get("/small")
+        self.assertNotIn("content-encoding", response.headers)
+        self.assertEqual(response.headers["vary"], "Accept-Encoding")
+        self.assertEqual(body, b'{"id":1}')
+
+    def test_not_accepted(self):
+        response, _ = self.get("/large", accept_encoding="gzip;q=0, identity")
+        self.assertNotIn("content-encoding", response.headers)
+
+    def test_streaming_body_is_gzipped(self):
+        response, body = self.get("/stream")
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+        self.assertNotIn("content-length", response.headers)
+        self.assertEqual(gzip.decompress(body), b"".join(b"line %d\n" % number for number in range(1000)))
+
+    def test_ranged_responses_are_sent_as_is(self):
+        response, body = self.get("/file")
+        self.assertNotIn("content-encoding", response.headers)
+        self.assertEqual(len(body), 1000)
+
+    def test_zerocopysend_gets_its_start_message(self):
+        async def file_app(scope, receive, send):
+            await send({"type": "http.response.start", "status": 200,
+                        "headers": [(b"content-type", b"text/plain"), (b"content-length", b"1000")]})
+            await send({"type": "http.response.zerocopysend", "file": 0, "offset": 0, "count": 1000,
+                        "more_body": False})
+
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "method": "GET", "path": "/file", "headers": [(b"accept-encoding", b"gzip")],
+                 "extensions": {"http.response.zerocopysend": {}}}
+        asyncio.run(compression.CompressionMiddleware(file_app, minimum_size=100)(scope, None, send))
+        self.assertEqual([message["type"] for message in sent],
+                         ["http.response.start", "http.response.zerocopysend"])
+        self.assertNotIn((b"content-encoding", b"gzip"), sent[0]["headers"])
+
+    def test_negotiate_encoding(self):
+        self.assertEqual(compression.negotiate_encoding("gzip, br", ("br", "gzip")), "br")
+        self.assertEqual(compression.negotiate_encoding("br;q=0.5, gzip", ("br", "gzip")), "gzip")
+        self.assertEqual(compression.negotiate_encoding("*", ("br", "gzip")), "br")
+        self.assertEqual(compression.negotiate_encoding("br", ("gzip",)), None)
+        self.assertEqual(compression.negotiate_encoding("", ("br", "gzip")), None)
@@ -0,0 +1,48 @@
+"""
+Conditional GET for board reads.
+
+Every committed change to a board's content bumps Board.version (see record_board_change), so the version is a
+validator for anything read from that board. Endpoints build a weak ETag from it, plus whatever counter the resource
+needs on top, and compare it with If-None-Match before loading anything: a match is answered with an empty 304, which
+costs a primary-key lookup instead of the loaders and the serialization. Nothing is hashed.
+
+The tag only moves with the board's version, so it does not notice a member renaming themselves; clients pick that
+up with the next change to the board.
+"""
+from fastapi import Request as _Request, Response as _Response, status as _status
+
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts) -> str:
+    """
+    Weak ETag from version counters, e.g. make_etag("board", 3, 17) -> W/"board-3-17"
+    """
+    return 'W/"' + "-".join(str(part) for part in parts) + '"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    Weak comparison of an If-None-Match header against an ETag
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in if_none_match.split(","))
+
+
+def check_etag(request: _Request, response: _Response, etag: str) -> _Response | None:
+    """
+    Put the ETag on the response, and answer with a 304 if the client already has this version
+    :param request: the incoming request
+    :param response: the endpoint's response, which gets the validator when the full body is sent
+    :param etag: from make_etag()
+    :return: a 304 response to return as is, or None to go on and build the body
+    """
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return _Response(status_code=_status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return None
@@ -1,14 +1,45 @@
-from sqlalchemy import create_engine as _create_engine
+import inspect as _inspect
+
+from fastapi import Request as _Request, Depends as _Depends
+from fastapi.routing import APIRoute as _APIRoute
 from sqlalchemy.orm import sessionmaker as _sessionmaker
 from sqlalchemy.ext.declarative import declarative_base as _declarative_base
+from sqlalchemy.ext.asyncio import async_sessionmaker as _async_sessionmaker, AsyncAttrs as _AsyncAttrs, \
+    AsyncSession as _AsyncSession
+from api import migrations as _migrations
+from api import engine_profile as _engine_profile
+from api import replica as _replica
 
-DATABASE_URL = "sqlite:///./db.db"
+# connection settings come from the environment, see api/engine_profile.py
+DATABASE_URL, ASYNC_DATABASE_URL = _engine_profile.database_urls()
+ENGINE_PROFILE = _engine_profile.load_profile()
 
-engine = _create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# sync engine: schema creation, scripts and anything that can't run on the event loop
+engine = _engine_profile.create_engine(DATABASE_URL, ENGINE_PROFILE)
 
 SessionLocal = _sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = _declarative_base()
+# async engine: used by the request handlers so queries don't block the event loop.
+# expire_on_commit is off because expired attributes can't be lazily reloaded outside of an await.
+async_engine = _engine_profile.create_async_engine(ASYNC_DATABASE_URL, ENGINE_PROFILE)
+
+AsyncSessionLocal = _async_sessionmaker(bind=async_engine, autocommit=False, autoflush=False,
+                                        expire_on_commit=False)
+
+# optional read replica for GET endpoints, see api/replica.py
+replica_engine = None
+ReplicaSessionLocal = None
+if _replica.REPLICA_DATABASE_URL:
+    replica_engine = _engine_profile.create_async_engine(_replica.REPLICA_DATABASE_URL, ENGINE_PROFILE)
+    ReplicaSessionLocal = _async_sessionmaker(bind=replica_engine, autocommit=False, autoflush=False,
+                                              expire_on_commit=False)
+    _primary_path = _replica.sqlite_path(ASYNC_DATABASE_URL)
+    _replica_path = _replica.sqlite_path(_replica.REPLICA_DATABASE_URL)
+    if _primary_path and _replica_path and _replica.REPLICA_SYNC_INTERVAL > 0:
+        _replica.replica_sync = _replica.ReplicaSync(_primary_path, _replica_path, _replica.REPLICA_SYNC_INTERVAL)
+
+# AsyncAttrs lets handlers await a one-off relationship load: `await obj.awaitable_attrs.relationship`
+Base = _declarative_base(cls=_AsyncAttrs)
 
 
 def get_db():
@@ -19,6 +50,66 @@ def get_db():
         db.close()
 
 
+async def get_async_db(request: _Request):
+    async with AsyncSessionLocal() as db:
+        # UnitOfWorkRoute commits it once the endpoint returns
+        request.state.db = db
+        yield db
+
+
+async def get_read_db(request: _Request, db: _AsyncSession = _Depends(get_async_db)):
+    """
+    Session for endpoints that only read: the replica when there is one, unless the client has just written and the
+    replica may not have its change yet. The primary session is only connected if it is used.
+    """
+    if ReplicaSessionLocal is None or _replica.reads_primary(request):
+        yield db
+        return
+    async with ReplicaSessionLocal() as replica_db:
+        yield replica_db
+
+
+def after_commit(db: _AsyncSession, callback):
+    """
+    Run `callback` once the request's unit of work has committed, for side effects that must not happen if it rolls
+    back (dropping cache entries, queueing writes, deleting files). It may be a coroutine function.
+    """
+    db.info.setdefault("after_commit", []).append(callback)
+
+
+async def commit(db: _AsyncSession):
+    """
+    Commit the unit of work and run its after_commit callbacks
+    """
+    await db.commit()
+    for callback in db.info.pop("after_commit", []):
+        result = callback()
+        if _inspect.isawaitable(result):
+            await result
+
+
+class UnitOfWorkRoute(_APIRoute):
+    """
+    Makes every request one transaction. Services only add and flush their changes; the request's session is
+    committed once, after the endpoint has returned and before the response is sent. An endpoint that raises leaves
+    nothing behind, because the session is rolled back when it closes.
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def unit_of_work_handler(request: _Request):
+            response = await handler(request)
+            db = getattr(request.state, "db", None)
+            if db is not None:
+                await commit(db)
+                _replica.record_write(request)
+            return response
+
+        return unit_of_work_handler
+
+
 def create_db():
     Base.metadata.create_all(bind=engine)
-
+    # bring tables that already existed up to date with the models
+    _migrations.upgrade(engine)
@@ -0,0 +1,55 @@
+import asyncio
+import datetime
+import unittest
+import uuid
+from fastapi import APIRouter, Depends, FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from api.database import UnitOfWorkRoute, after_commit, async_engine, create_db, get_async_db
+from api.cards.card_models import CardActivity
+
+router = APIRouter(route_class=UnitOfWorkRoute)
+committed = []
+
+
+@router.post("/activity/{activity}")
+async def add_activity(activity: str, fail: bool = False, db: AsyncSession = Depends(get_async_db)):
+    db.add(CardActivity(card_id=0, user_id=0, activity=activity, created_datetime=datetime.datetime(2023, 1, 1)))
+    await db.flush()
+    after_commit(db, lambda: committed.append(activity))
+    if fail:
+        raise HTTPException(status_code=409, detail="Conflict")
+    return {"activity": activity}
+
+
+app = FastAPI()
+app.include_router(router)
+client = TestClient(app)
+
+
+async def count_activities(activity):
+    async with async_engine.connect() as connection:
+        return await connection.scalar(select(func.count()).select_from(CardActivity).filter(
+            CardActivity.activity == activity))
+
+
+class TestUnitOfWork(unittest.TestCase):
+    create_db()
+
+    def test_request_commits_on_success(self):
+        activity = f"committed {uuid.uuid4()}"
+        response = client.post(f"/activity/{activity}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.count(activity), 1)
+        self.assertIn(activity, committed)
+
+    def test_request_rolls_back_on_error(self):
+        activity = f"rolled back {uuid.uuid4()}"
+        response = client.post(f"/activity/{activity}", params={"fail": True})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.count(activity), 0)
+        self.assertNotIn(activity, committed)
+
+    def count(self, activity):
+        return asyncio.run(count_activities(activity))
@@ -0,0 +1,157 @@
+"""
+Engine settings, picked by environment.
+
+DATABASE_URL points at the database (default sqlite:///./db.db); ASYNC_DATABASE_URL defaults to the same database
+through aiosqlite. DATABASE_PROFILE picks a set of settings:
+ - production (default): WAL journal, synchronous=NORMAL, memory-mapped reads, a larger page cache and a busy
+   timeout, set on every new connection, with a pool of kept-open connections
+ - baseline: SQLite's own defaults (rollback journal, synchronous=FULL) and SQLAlchemy's default pooling
+
+WAL lets readers carry on while a write is in progress and makes a commit one append to the log; with
+synchronous=NORMAL it is only synced at checkpoints, which can lose the last commits on power loss but never
+corrupts the database. The busy timeout makes a writer wait for the lock instead of failing with "database is
+locked". Each setting can be overridden with the environment variable named in _OVERRIDES.
+
+Foreign key enforcement (SQLITE_FOREIGN_KEYS=1) stays off by default. The schema has no ON DELETE rules; deletes
+remove child rows first in the services (cards with everything under them, boards through the background purge).
+Card activity is written behind: rows still queued when their card is deleted are dropped, but a batch already being
+flushed can land after the delete. An enforcing connection would refuse that batch and the buffer would retry it
+forever.
+
+Server databases (anything but SQLite) ignore the pragmas and get a larger pool with pre-ping and recycling.
+"""
+import os as _os
+import typing as _typing
+
+from sqlalchemy import create_engine as _create_engine, event as _event
+from sqlalchemy.engine import Engine as _Engine, make_url as _make_url
+from sqlalchemy.ext.asyncio import AsyncEngine as _AsyncEngine, create_async_engine as _create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool as _AsyncAdaptedQueuePool, QueuePool as _QueuePool
+
+
+class EngineProfile(_typing.NamedTuple):
+    # SQLite pragmas, None leaves SQLite's default
+    journal_mode: str | None = None
+    synchronous: str | None = None
+    mmap_size: int | None = None
+    cache_size_kib: int | None = None
+    busy_timeout_ms: int | None = None
+    foreign_keys: bool | None = None
+    # pooling, None keeps SQLAlchemy's default pool for the dialect
+    pool_size: int | None = None
+    max_overflow: int | None = None
+    pool_timeout: float = 30
+    pool_recycle: int = 1800
+
+
+PROFILES = {
+    "baseline": EngineProfile(),
+    "production": EngineProfile(journal_mode="WAL", synchronous="NORMAL", mmap_size=256 * 1024 * 1024,
+                                cache_size_kib=64 * 1024, busy_timeout_ms=5000, pool_size=5, max_overflow=10),
+}
+
+# server databases take more concurrent connections than SQLite, which only ever has one writer
+SERVER_POOL_SIZE = 10
+SERVER_MAX_OVERFLOW = 20
+
+_OVERRIDES = {
+    "journal_mode": ("SQLITE_JOURNAL_MODE", str),
+    "synchronous": ("SQLITE_SYNCHRONOUS", str),
+    "mmap_size": ("SQLITE_MMAP_SIZE", int),
+    "cache_size_kib": ("SQLITE_CACHE_SIZE_KIB", int),
+    "busy_timeout_ms": ("SQLITE_BUSY_TIMEOUT_MS", int),
+    "foreign_keys": ("SQLITE_FOREIGN_KEYS", lambda value: value.lower() in ("1", "true", "on")),
+    "pool_size": ("DB_POOL_SIZE", int),
+    "max_overflow": ("DB_MAX_OVERFLOW", int),
+    "pool_timeout": ("DB_POOL_TIMEOUT", float),
+    "pool_recycle": ("DB_POOL_RECYCLE", int),
+}
+
+
+def load_profile(environ: _typing.Mapping[str, str] = _os.environ) -> EngineProfile:
+    """
+    The profile named by DATABASE_PROFILE, with any per-setting overrides applied
+    :raises ValueError: for an unknown profile name
+    """
+    name = environ.get("DATABASE_PROFILE", "production")
+    if name not in PROFILES:
+        raise ValueError(f"Unknown DATABASE_PROFILE {name!r}, expected one of {', '.join(PROFILES)}")
+    overrides = {field: parse(environ[variable]) for field, (variable, parse) in _OVERRIDES.items()
+                 if variable in environ}
+    return PROFILES[name]._replace(**overrides)
+
+
+def database_urls(environ: _typing.Mapping[str, str] = _os.environ) -> tuple[str, str]:
+    """
+    :return: (sync url, async url)
+    """
+    url = environ.get("DATABASE_URL", "sqlite:///./db.db")
+    async_url = environ.get("ASYNC_DATABASE_URL")
+    if async_url is None:
+        async_url = str(_make_url(url).set(drivername="sqlite+aiosqlite")) if url.startswith("sqlite") else url
+    return url, async_url
+
+
+def _is_sqlite_file(url) -> bool:
+    return url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:")
+
+
+def _engine_options(url: str, profile: EngineProfile, is_async: bool) -> dict:
+    url = _make_url(url)
+    if url.get_backend_name() == "sqlite":
+        options = {"connect_args": {"check_same_thread": False}}
+        # in-memory databases live and die with their connection, so they keep the dialect's pool
+        if profile.pool_size is not None and _is_sqlite_file(url):
+            options.update(poolclass=_AsyncAdaptedQueuePool if is_async else _QueuePool, pool_size=profile.pool_size,
+                           max_overflow=profile.max_overflow or 0, pool_timeout=profile.pool_timeout)
+        return options
+    return {"pool_size": profile.pool_size or SERVER_POOL_SIZE, "max_overflow": profile.max_overflow or
+            SERVER_MAX_OVERFLOW, "pool_timeout": profile.pool_timeout, "pool_recycle": profile.pool_recycle,
+            "pool_pre_ping": True}
+
+
+def pragmas(profile: EngineProfile) -> list[str]:
+    statements = []
+    if profile.journal_mode is not None:
+        statements.append(f"PRAGMA journal_mode={profile.journal_mode}")
+    if profile.synchronous is not None:
+        statements.append(f"PRAGMA synchronous={profile.synchronous}")
+    if profile.mmap_size is not None:
+        statements.append(f"PRAGMA mmap_size={profile.mmap_size}")
+    if profile.cache_size_kib is not None:
+        # a negative cache_size is in KiB rather than pages
+        statements.append(f"PRAGMA cache_size=-{profile.cache_size_kib}")
+    if profile.busy_timeout_ms is not None:
+        statements.append(f"PRAGMA busy_timeout={profile.busy_timeout_ms}")
+    if profile.foreign_keys is not None:
+        statements.append(f"PRAGMA foreign_keys={'ON' if profile.foreign_keys else 'OFF'}")
+    return statements
+
+
+def _apply_pragmas(engine: _Engine, profile: EngineProfile):
+    if engine.url.get_backend_name() != "sqlite":
+        return
+    statements = pragmas(profile)
+    if not statements:
+        return
+
+    @_event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+
+
+def create_engine(url: str, profile: EngineProfile) -> _Engine:
+    engine = _create_engine(url, **_engine_options(url, profile, is_async=False))
+    _apply_pragmas(engine, profile)
+    return engine
+
+
+def create_async_engine(url: str, profile: EngineProfile) -> _AsyncEngine:
+    engine = _create_async_engine(url, **_engine_options(url, profile, is_async=True))
+    _apply_pragmas(engine.sync_engine, profile)
+    return engine
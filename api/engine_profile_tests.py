@@ -0,0 +1,57 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+from sqlalchemy import text
+from api import engine_profile
+
+
+class TestEngineProfile(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.workdir, "profile.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_load_profile_defaults_to_production(self):
+        self.assertEqual(engine_profile.load_profile({}), engine_profile.PROFILES["production"])
+
+    def test_load_profile_overrides(self):
+        profile = engine_profile.load_profile({"DATABASE_PROFILE": "baseline", "SQLITE_BUSY_TIMEOUT_MS": "250",
+                                               "SQLITE_FOREIGN_KEYS": "1"})
+        self.assertIsNone(profile.journal_mode)
+        self.assertEqual(profile.busy_timeout_ms, 250)
+        self.assertTrue(profile.foreign_keys)
+
+    def test_load_profile_unknown(self):
+        with self.assertRaises(ValueError):
+            engine_profile.load_profile({"DATABASE_PROFILE": "fast"})
+
+    def test_async_url_follows_database_url(self):
+        self.assertEqual(engine_profile.database_urls({"DATABASE_URL": "sqlite:////data/app.db"}),
+                         ("sqlite:////data/app.db", "sqlite+aiosqlite:////data/app.db"))
+
+    def test_pragmas_are_set_on_connect(self):
+        profile = engine_profile.PROFILES["production"]._replace(foreign_keys=True)
+        engine = engine_profile.create_engine(f"sqlite:///{self.path}", profile)
+        with engine.connect() as connection:
+            self.assertEqual(connection.scalar(text("PRAGMA journal_mode")), "wal")
+            self.assertEqual(connection.scalar(text("PRAGMA synchronous")), 1)
+            self.assertEqual(connection.scalar(text("PRAGMA busy_timeout")), 5000)
+            self.assertEqual(connection.scalar(text("PRAGMA foreign_keys")), 1)
+        engine.dispose()
+
+    def test_async_engine_is_pooled(self):
+        engine = engine_profile.create_async_engine(f"sqlite+aiosqlite:///{self.path}",
+                                                    engine_profile.PROFILES["production"])
+
+        async def busy_timeout():
+            async with engine.connect() as connection:
+                return await connection.scalar(text("PRAGMA busy_timeout"))
+
+        self.assertEqual(asyncio.run(busy_timeout()), 5000)
+        self.assertEqual(engine.pool.size(), 5)
+        asyncio.run(engine.dispose())
@@ -1,45 +1,81 @@
 from fastapi import APIRouter as _APIRouter, Depends as _Depends, HTTPException as _HTTPException, status as _status, \
-    security as _security
+    security as _security, Response as _Response, BackgroundTasks as _BackgroundTasks, Request as _Request
 from . import list_services as _list_services
 from ..users.user_services import get_current_user as _get_current_user
 from ..boards.board_services import get_current_board as _get_current_board
 from ..users import user_schemas as _user_schemas
-from ..database import get_db as _get_db
+from ..database import get_async_db as _get_async_db, get_read_db as _get_read_db, \
+    UnitOfWorkRoute as _UnitOfWorkRoute
+from .. import pagination as _pagination
+from .. import ranking as _ranking
+from .. import conditional as _conditional
+from .. import serializers as _serializers
 from . import list_schemas as _list_schemas
-from sqlalchemy.orm import Session as _Session
+from sqlalchemy.ext.asyncio import AsyncSession as _AsyncSession
 from ..boards import board_schemas as _board_schemas
+from ..boards import board_services as _board_services
 from ..boards.board_services import get_member_board as _get_member_board
 
 router = _APIRouter(
     prefix="/lists",
     tags=["lists"],
+    route_class=_UnitOfWorkRoute,
 )
 
 current_user_dependency = _Depends(_get_current_user)
 board_dependency = _Depends(_get_current_board)
 member_board_dependency = _Depends(_get_member_board)
+page_params_dependency = _Depends(_pagination.page_params)
 
 
 @router.post("/{board_id}/create_list", response_model=_list_schemas.List)
-async def create_list(list_data: _list_schemas.ListCreate, db: _Session = _Depends(_get_db),
+async def create_list(list_data: _list_schemas.ListCreate, db: _AsyncSession = _Depends(_get_async_db),
                       board: _board_schemas.Board = member_board_dependency):
     db_list = await _list_services.create_list(db=db, list_data=list_data, board_id=board.id)
+    await _board_services.record_board_change(db=db, board_id=board.id, entity="list", entity_id=db_list.id,
+                                              action="created", data=_list_schemas.ListSummary.from_orm(db_list))
     return _list_schemas.List.from_orm(db_list)
 
 
 @router.get("/{board_id}", response_model=list[_list_schemas.List])
-async def get_board_lists(db: _Session = _Depends(_get_db),
+async def get_board_lists(request: _Request, response: _Response,
+                          page_params: _pagination.PageParams = page_params_dependency,
+                          db: _AsyncSession = _Depends(_get_read_db),
                           board: _board_schemas.Board = board_dependency,
                           current_user: _user_schemas.User = current_user_dependency):
     if not board.is_public:
         if current_user.id != board.owner_id:
             raise _HTTPException(status_code=_status.HTTP_403_FORBIDDEN, detail="You are not the owner of this board")
-    db_lists = await _list_services.get_board_lists(db=db, board_id=board.id)
-    return [_list_schemas.List.from_orm(db_list) for db_list in db_lists]
+    version = await _board_services.get_board_version(db=db, board_id=board.id)
+    not_modified = _conditional.check_etag(request, response, _conditional.make_etag("board", board.id, version))
+    if not_modified:
+        return not_modified
+    page = await _list_services.get_board_lists(db=db, board_id=board.id, params=page_params)
+    _pagination.set_next_cursor(response, page)
+    return _serializers.json_response(page.items, response)
+
+
+@router.put("/{board_id}/{list_id}/move", response_model=_list_schemas.List)
+async def move_board_list(list_id: int, list_move: _list_schemas.ListMove, background_tasks: _BackgroundTasks,
+                          db: _AsyncSession = _Depends(_get_async_db),
+                          board: _board_schemas.Board = member_board_dependency):
+    db_list = await _list_services.get_list_by_id(db=db, list_id=list_id)
+    if db_list is None or db_list.board_id != board.id:
+        raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="List not found")
+    try:
+        db_list = await _list_services.move_list(db=db, db_list=db_list, list_move=list_move)
+    except LookupError:
+        raise _HTTPException(status_code=_status.HTTP_400_BAD_REQUEST,
+                             detail="after_id and before_id must be other lists of the board")
+    await _board_services.record_board_change(db=db, board_id=board.id, entity="list", entity_id=db_list.id,
+                                              action="moved", data=_list_schemas.ListSummary.from_orm(db_list))
+    if _ranking.needs_rebalance(db_list.rank):
+        background_tasks.add_task(_list_services.rebalance_board_lists, board.id)
+    return _list_schemas.List.from_orm(db_list)
 
 
 @router.get("/{list_id}/{board_id}", response_model=_list_schemas.List, dependencies=[board_dependency])
-async def get_board_list(list_id: int, db: _Session = _Depends(_get_db)):
+async def get_board_list(list_id: int, db: _AsyncSession = _Depends(_get_read_db)):
     db_list = await _list_services.get_list_by_id(db=db, list_id=list_id)
     if db_list is None:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="List not found")
@@ -47,18 +83,24 @@ async def get_board_list(list_id: int, db: _Session = _Depends(_get_db)):
 
 
 @router.put("/{list_id}/{board_id}", response_model=_list_schemas.List, dependencies=[member_board_dependency])
-async def update_board_list(list_id: int, list_data: _list_schemas.ListUpdate, db: _Session = _Depends(_get_db)):
+async def update_board_list(list_id: int, list_data: _list_schemas.ListUpdate,
+                            db: _AsyncSession = _Depends(_get_async_db)):
     db_list = await _list_services.get_list_by_id(db=db, list_id=list_id)
     if db_list is None:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="List not found")
     db_list = await _list_services.update_list(db=db, list_data=list_data, db_list=db_list)
+    await _board_services.record_board_change(db=db, board_id=db_list.board_id, entity="list", entity_id=db_list.id,
+                                              action="updated", data=_list_schemas.ListSummary.from_orm(db_list))
     return _list_schemas.List.from_orm(db_list)
 
 
-@router.delete("/{list_id}/{board_id}", dependencies=[member_board_dependency],
-               status_code=_status.HTTP_204_NO_CONTENT)
-async def delete_board_list(list_id: int, db: _Session = _Depends(_get_db)):
-    db_list = await _list_services.get_list_by_id(db=db, list_id=list_id)
+@router.delete("/{list_id}/{board_id}", status_code=_status.HTTP_204_NO_CONTENT)
+async def delete_board_list(list_id: int, db: _AsyncSession = _Depends(_get_async_db),
+                            board: _board_schemas.Board = member_board_dependency):
+    # only the list row: its cards are deleted set-based, never loaded
+    db_list = await _list_services.get_board_list_by_id(db=db, list_id=list_id, board_id=board.id)
     if db_list is None:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="List not found")
     await _list_services.delete_list(db=db, db_list=db_list)
+    await _board_services.record_board_change(db=db, board_id=board.id, entity="list", entity_id=list_id,
+                                              action="deleted")
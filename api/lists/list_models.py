@@ -1,14 +1,20 @@
 from api.database import Base as _Base
-from sqlalchemy import Column as _Column, Integer as _Integer, String as _String, ForeignKey as _ForeignKey
+from sqlalchemy import Column as _Column, Integer as _Integer, String as _String, ForeignKey as _ForeignKey, \
+    Index as _Index
 from sqlalchemy.orm import relationship as _relationship
 
 
 class List(_Base):
     __tablename__ = "lists"
+    __table_args__ = (
+        _Index("ix_lists_board_id_rank", "board_id", "rank"),
+    )
     id = _Column(_Integer, primary_key=True, index=True)
-    board_id = _Column(_Integer, _ForeignKey("boards.id"))
+    board_id = _Column(_Integer, _ForeignKey("boards.id"), index=True)
     name = _Column(_String, index=True)
     position = _Column(_Integer, default=0)
+    # order within the board, see api.ranking
+    rank = _Column(_String)
 
     board = _relationship("Board", back_populates="lists")
-    cards = _relationship("Card", back_populates="list")
+    cards = _relationship("Card", back_populates="list", order_by="Card.rank, Card.id")
@@ -14,14 +14,22 @@ class ListUpdate(_BaseList):
     position: int
 
 
-class List(_BaseList):
+class ListMove(_pydantic.BaseModel):
+    after_id: int | None = None
+    before_id: int | None = None
+
+
+class ListSummary(_BaseList):
     id: int
     position: int
     board_id: int
-
-    cards: list[_FullCardMember] | None
+    rank: str | None
 
     class Config:
         orm_mode = True
 
 
+class List(ListSummary):
+    cards: list[_FullCardMember] | None
+
+
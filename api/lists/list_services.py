@@ -1,21 +1,40 @@
-from sqlalchemy.orm import Session as _Session
+import os as _os
+
+from sqlalchemy import select as _select, delete as _delete
+from sqlalchemy.ext.asyncio import AsyncSession as _AsyncSession
+from sqlalchemy.orm import selectinload as _selectinload
 from . import list_models as _list_models
+from ..cards import card_models as _card_models
+from ..cards import card_services as _card_services
 import email_validator as _email_check
 import passlib.hash as _hash
 from fastapi import HTTPException as _HTTPException, status as _status, Depends as _Depends
 import fastapi.security as _security
 import jwt as _jwt
 from . import list_schemas as _list_schemas
-from api.database import get_db as _get_db
+from api.database import get_async_db as _get_async_db, AsyncSessionLocal as _AsyncSessionLocal, commit as _commit
+from api import pagination as _pagination
+from api import ranking as _ranking
+from api import serializers as _serializers
+from api.purge import PurgeJob as _PurgeJob
 from ..users.user_services import get_current_user as _get_current_user
 from ..users import user_schemas as _user_schemas
 from ..boards import board_schemas as _board_schemas
 from ..boards.board_services import get_current_board as _get_current_board
 from ..boards.board_services import get_member_board as _get_member_board
+from ..boards import board_services as _board_services
+
+# list responses embed their cards and card members, which can't be lazy loaded from an async session
+_list_with_cards = _selectinload(_list_models.List.cards).selectinload(_card_models.Card.card_members).selectinload(
+    _card_models.CardMember.user)
+_list_serializer = _serializers.RowSerializer(_list_schemas.List, _list_models.List, exclude=("cards",))
+
+# cards deleted per transaction when purging a deleted board
+BOARD_PURGE_BATCH_SIZE = int(_os.environ.get("BOARD_PURGE_BATCH_SIZE", "500"))
 
 
 async def get_current_list(list_id: int, board=_Depends(_get_current_board),
-                           db: _Session = _Depends(_get_db)):
+                           db: _AsyncSession = _Depends(_get_async_db)):
     db_list = await get_board_list_by_id(db=db, list_id=list_id, board_id=board.id)
     if not db_list:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="List not found")
@@ -23,50 +42,134 @@ async def get_current_list(list_id: int, board=_Depends(_get_current_board),
 
 
 async def get_member_list(list_id: int, board=_Depends(_get_member_board),
-                          db: _Session = _Depends(_get_db)):
+                          db: _AsyncSession = _Depends(_get_async_db)):
     db_list = await get_board_list_by_id(db=db, list_id=list_id, board_id=board.id)
     if not db_list:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="List not found")
     return db_list
 
 
-async def get_board_list_by_id(db: _Session, list_id: int, board_id: int):
-    return db.query(_list_models.List).filter(_list_models.List.board_id == board_id).filter(
-        _list_models.List.id == list_id).first()
+async def get_board_list_by_id(db: _AsyncSession, list_id: int, board_id: int):
+    return await db.scalar(_select(_list_models.List).filter(_list_models.List.board_id == board_id).filter(
+        _list_models.List.id == list_id))
 
 
-async def create_list(db: _Session, list_data: _list_schemas.ListCreate, board_id: int):
-    db_list = _list_models.List(**list_data.dict(), board_id=board_id)
+async def create_list(db: _AsyncSession, list_data: _list_schemas.ListCreate, board_id: int):
+    # new lists go last; a new list has no cards yet, starting with a loaded empty collection saves a refresh
+    rank = await _ranking.rank_for_move(db=db, model=_list_models.List, scope=_list_models.List.board_id == board_id,
+                                        moving_id=None)
+    db_list = _list_models.List(**list_data.dict(), board_id=board_id, rank=rank, cards=[])
     db.add(db_list)
-    db.commit()
-    db.refresh(db_list)
+    await db.flush()
     return db_list
 
 
-async def get_board_lists(db: _Session, board_id: int):
-    return db.query(_list_models.List).filter(_list_models.List.board_id == board_id).all()
+async def get_board_lists(db: _AsyncSession, board_id: int, params: _pagination.PageParams):
+    """
+    A page of the board's lists with their cards, serialized like List
+    """
+    query = _list_serializer.select().filter(_list_models.List.board_id == board_id)
+    page = await _pagination.paginate(db, query, order_by=[_list_models.List.rank, _list_models.List.id],
+                                      key=lambda db_list: (db_list.rank, db_list.id), params=params, rows=True)
+    lists = _list_serializer.serialize(page.items)
+    cards = await _card_services.get_cards_by_lists(db=db, list_ids=[item["id"] for item in lists])
+    for item in lists:
+        item["cards"] = cards[item["id"]]
+    return page._replace(items=lists)
 
 
-async def get_list_by_id(db: _Session, list_id: int):
+async def get_list_by_id(db: _AsyncSession, list_id: int):
     """
     Get lists by id
     :param db:
     :param list_id:
     :return:
     """
-    return db.get(_list_models.List, list_id)
+    return await db.get(_list_models.List, list_id, options=[_list_with_cards])
 
 
-async def update_list(db: _Session, list_data: _list_schemas.ListUpdate, db_list: _list_models.List):
+async def update_list(db: _AsyncSession, list_data: _list_schemas.ListUpdate, db_list: _list_models.List):
     update_data = list_data.dict(exclude_unset=True)
     for key, value in update_data.items():
         setattr(db_list, key, value)
     db.add(db_list)
-    db.commit()
-    db.refresh(db_list)
+    await db.flush()
     return db_list
 
 
-async def delete_list(db: _Session, db_list: _list_models.List):
-    db.delete(db_list)
-    db.commit()
+async def delete_list(db: _AsyncSession, db_list: _list_models.List):
+    """
+    Delete a list with its cards and everything under them, one statement per table
+    :param db:
+    :param db_list:
+    """
+    list_cards = _select(_card_models.Card.id).filter(_card_models.Card.list_id == db_list.id)
+    await _card_services.delete_cards(db=db, card_ids=list_cards)
+    await db.execute(_delete(_list_models.List).filter(_list_models.List.id == db_list.id).execution_options(
+        synchronize_session=False))
+
+
+async def move_list(db: _AsyncSession, db_list: _list_models.List, list_move: _list_schemas.ListMove):
+    """
+    Move a list between two of its siblings by giving it a new rank; no other list is touched
+    :param db:
+    :param db_list: list to move
+    :param list_move: lists to land after and/or before, neither for the end of the board
+    :return: moved list
+    :raises LookupError: if after_id or before_id isn't another list of the board
+    """
+    db_list.rank = await _ranking.rank_for_move(db=db, model=_list_models.List,
+                                                scope=_list_models.List.board_id == db_list.board_id,
+                                                moving_id=db_list.id, after_id=list_move.after_id,
+                                                before_id=list_move.before_id)
+    await db.flush()
+    return db_list
+
+
+async def rebalance_board_lists(board_id: int):
+    """
+    Spread out the ranks of a board's lists once they have grown long. Runs as a background task with its own session.
+    """
+    async with _AsyncSessionLocal() as db:
+        list_ids = await _ranking.rebalance(db=db, model=_list_models.List,
+                                            scope=_list_models.List.board_id == board_id)
+        # one change for the whole board, not one per list
+        await _board_services.record_board_change(db=db, board_id=board_id, entity="board", entity_id=board_id,
+                                                  action="rebalanced", data=_board_services.rebalanced(list_ids))
+        await _commit(db)
+
+
+async def purge_board_batch(db: _AsyncSession, board_id: int, batch_size: int = BOARD_PURGE_BATCH_SIZE) -> bool:
+    """
+    Delete the next batch of a deleted board: up to `batch_size` of its cards with everything under them, or once
+    no cards are left, its lists and then the board's own rows
+    :param db:
+    :param board_id: a board marked deleted
+    :param batch_size: cards per batch
+    :return: True once the board is gone
+    """
+    card_ids = (await db.scalars(_select(_card_models.Card.id).join(_card_models.Card.list).filter(
+        _list_models.List.board_id == board_id).limit(batch_size))).all()
+    if card_ids:
+        await _card_services.delete_cards(db=db, card_ids=card_ids)
+        return False
+    await db.execute(_delete(_list_models.List).filter(_list_models.List.board_id == board_id).execution_options(
+        synchronize_session=False))
+    await _board_services.purge_board(db=db, board_id=board_id)
+    return True
+
+
+async def _deleted_board_ids():
+    async with _AsyncSessionLocal() as db:
+        return await _board_services.get_deleted_board_ids(db=db)
+
+
+async def _purge_board_batch(board_id: int) -> bool:
+    # a transaction per batch, so other writers get the lock in between
+    async with _AsyncSessionLocal() as db:
+        done = await purge_board_batch(db=db, board_id=board_id)
+        await _commit(db)
+    return done
+
+
+board_purge = _PurgeJob(pending=_deleted_board_ids, purge=_purge_board_batch)
@@ -1,6 +1,8 @@
 import unittest
 from fastapi.testclient import TestClient
+from sqlalchemy import event, text
 from api.main import app
+from api.database import async_engine, engine
 
 client = TestClient(app)
 
@@ -86,6 +88,52 @@ class TestList(unittest.TestCase):
         list_data = lists[0]
         self.assertEqual(list_data['board_id'], self.board['id'])
 
+    def read_board_lists(self, limit=100):
+        lists, params = [], {"limit": limit}
+        while True:
+            response = client.get(f"/lists/{self.board['id']}", params=params, headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.json()), limit)
+            lists += response.json()
+            if "X-Next-Cursor" not in response.headers:
+                return lists
+            params["cursor"] = response.headers["X-Next-Cursor"]
+
+    def test_get_board_lists_pages_in_order(self):
+        for name in ["Second", "Third", "Fourth"]:
+            client.post(f"/lists/{self.board['id']}/create_list", json={"name": name, "position": 0},
+                        headers=self.headers)
+        lists = self.read_board_lists(limit=2)
+        self.assertEqual([list_data["name"] for list_data in lists], ["List name", "Second", "Third", "Fourth"])
+        self.assertEqual(lists, sorted(lists, key=lambda list_data: list_data["rank"]))
+
+    def test_move_list_updates_one_row(self):
+        second = client.post(f"/lists/{self.board['id']}/create_list", json={"name": "Second", "position": 1},
+                             headers=self.headers).json()
+        third = client.post(f"/lists/{self.board['id']}/create_list", json={"name": "Third", "position": 2},
+                            headers=self.headers).json()
+        updated_rows = []
+
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            # the board's version bump is an UPDATE too; only rows of lists count here
+            if statement.startswith("UPDATE lists"):
+                updated_rows.append(cursor.rowcount)
+
+        event.listen(async_engine.sync_engine, "after_cursor_execute", after_cursor_execute)
+        try:
+            response = client.put(f"/lists/{self.board['id']}/{third['id']}/move",
+                                  json={"after_id": self.list["id"], "before_id": second["id"]}, headers=self.headers)
+        finally:
+            event.remove(async_engine.sync_engine, "after_cursor_execute", after_cursor_execute)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(updated_rows, [1])
+        self.assertEqual([list_data["id"] for list_data in self.read_board_lists()],
+                         [self.list["id"], third["id"], second["id"]])
+
+        response = client.put(f"/lists/{self.board['id']}/{third['id']}/move", json={"after_id": 0},
+                              headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
     def test_get_board_lists_unauthorized(self):
         response = client.get(f"/lists/{self.board['id']}")
         self.assertEqual(response.status_code, 401)
@@ -117,3 +165,36 @@ class TestList(unittest.TestCase):
         # Verify the list is deleted
         response = client.get(f"/lists/{list_id}/{self.board['id']}", headers=self.headers)
         self.assertEqual(response.status_code, 404)
+
+    def test_delete_board_list_deletes_its_cards(self):
+        card_ids = []
+        for _ in range(3):
+            card = client.post(f"/cards/{self.board['id']}/{self.list['id']}/create_card",
+                               json={"title": "Card", "description": "Description"}, headers=self.headers).json()
+            client.post(f"/comments/{self.board['id']}/{self.list['id']}/{card['id']}/create_comment",
+                        json={"comment": "Comment"}, headers=self.headers)
+            client.post(f"/card_members/{self.board['id']}/{card['id']}/add_member", json={"email": self.email},
+                        headers=self.headers)
+            card_ids.append(card["id"])
+        other_list = self.create_list()
+        other_card = client.post(f"/cards/{self.board['id']}/{other_list['id']}/create_card",
+                                 json={"title": "Card", "description": "Description"}, headers=self.headers).json()
+
+        response = client.delete(f"/lists/{self.list['id']}/{self.board['id']}", headers=self.headers)
+        self.assertEqual(response.status_code, 204)
+        with engine.connect() as connection:
+            def count(table, column, ids):
+                return connection.execute(text(f"SELECT count(*) FROM {table} WHERE {column} IN "
+                                               f"({', '.join(map(str, ids))})")).scalar()
+
+            self.assertEqual([count(table, "card_id", card_ids) for table in ("comments", "card_members")], [0, 0])
+            self.assertEqual(count("cards", "id", card_ids), 0)
+            self.assertEqual(count("lists", "id", [self.list["id"]]), 0)
+            self.assertEqual(count("cards", "id", [other_card["id"]]), 1)
+
+    def test_delete_board_list_of_another_board(self):
+        other_board = self.create_board()
+        response = client.delete(f"/lists/{self.list['id']}/{other_board['id']}", headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+        response = client.get(f"/lists/{self.list['id']}/{self.board['id']}", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
@@ -1,13 +1,23 @@
 from fastapi import FastAPI
 from api.users.user_main import router as _users_router
-from api.boards.board_main import router as _boards_router, board_labels_router as _board_labels_router
+from api.boards.board_main import router as _boards_router, board_labels_router as _board_labels_router, \
+    board_events_router as _board_events_router
 from api.lists.list_main import router as _lists_router
 from api.cards.card_main import card_router as _cards_router, comments_router as _comments_router, \
     checklists_router as _check_lists_router, card_member_router as _card_member_router, card_activity_router as \
     _card_activity_router, card_label_router as _card_label_router, card_attachment_router as _card_attachment_router
 from fastapi.middleware.cors import CORSMiddleware as _CORSMiddleware
+from api.search.search_main import router as _search_router
+from api.notifications.notification_main import router as _notifications_router
+from api.database import create_db as _create_db
+from api.pagination import NEXT_CURSOR_HEADER as _NEXT_CURSOR_HEADER
+from api.cards.card_services import activity_log as _activity_log, reminder_scheduler as _reminder_scheduler
+from api.lists.list_services import board_purge as _board_purge
+from api import replica as _replica
+from api.responses import JSONResponse as _JSONResponse
+from api.compression import CompressionMiddleware as _CompressionMiddleware
 
-app = FastAPI()
+app = FastAPI(default_response_class=_JSONResponse)
 
 origins = [
     # "http://localhost",
@@ -22,11 +32,14 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[_NEXT_CURSOR_HEADER],
 )
+app.add_middleware(_CompressionMiddleware)
 
 app.include_router(_users_router)
 app.include_router(_boards_router)
 app.include_router(_board_labels_router)
+app.include_router(_board_events_router)
 app.include_router(_lists_router)
 app.include_router(_cards_router)
 app.include_router(_comments_router)
@@ -35,6 +48,55 @@ app.include_router(_card_member_router)
 app.include_router(_card_activity_router)
 app.include_router(_card_label_router)
 app.include_router(_card_attachment_router)
+app.include_router(_search_router)
+app.include_router(_notifications_router)
+
+
+@app.on_event("startup")
+def upgrade_database():
+    _create_db()
+
+
+@app.on_event("startup")
+async def start_activity_log():
+    _activity_log.start()
+
+
+@app.on_event("startup")
+async def start_replica_sync():
+    if _replica.replica_sync is not None:
+        await _replica.replica_sync.start()
+
+
+@app.on_event("startup")
+async def start_reminder_scheduler():
+    _reminder_scheduler.start()
+
+
+@app.on_event("startup")
+async def start_board_purge():
+    _board_purge.start()
+
+
+@app.on_event("shutdown")
+async def flush_activity_log():
+    await _activity_log.stop()
+
+
+@app.on_event("shutdown")
+async def stop_replica_sync():
+    if _replica.replica_sync is not None:
+        await _replica.replica_sync.stop()
+
+
+@app.on_event("shutdown")
+async def stop_reminder_scheduler():
+    await _reminder_scheduler.stop()
+
+
+@app.on_event("shutdown")
+async def stop_board_purge():
+    await _board_purge.stop()
 
 
 # TODO: UPDATE MODELS TO USE RELATIONSHIPS. ALSO UPDATE ENDPOINTS TO USE RELATIONSHIPS
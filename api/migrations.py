@@ -0,0 +1,325 @@
+"""
+Versioned schema migrations.
+
+create_all only creates missing tables, so changes to tables that already exist (indexes, constraints, new columns)
+are written here as numbered migrations and applied once per database, in order. Applied versions are recorded in
+the schema_migrations table. Migrations spell out their own SQL instead of reading the models, so they keep doing
+the same thing as the models change, and they are written to be safe to re-run if a previous run was interrupted.
+
+usage: python -m api.migrations
+"""
+import datetime as _dt
+
+from sqlalchemy import text as _text
+from sqlalchemy.exc import IntegrityError as _IntegrityError
+
+from api.ranking import spread as _spread
+
+_migrations = []
+
+
+def migration(version: int, description: str):
+    def register(func):
+        _migrations.append((version, description, func))
+        _migrations.sort(key=lambda registered: registered[0])
+        return func
+
+    return register
+
+
+def _execute(connection, *statements: str):
+    for statement in statements:
+        connection.execute(_text(statement))
+
+
+def _delete_duplicates(connection, table: str, *columns: str):
+    # keep the oldest row of every duplicate group so a unique index can be built
+    key = ", ".join(columns)
+    _execute(connection, f"DELETE FROM {table} WHERE id NOT IN (SELECT MIN(id) FROM {table} GROUP BY {key})")
+
+
+def _add_column(connection, table: str, column: str, definition: str):
+    columns = {row[1] for row in connection.execute(_text(f"PRAGMA table_info({table})"))}
+    if column not in columns:
+        _execute(connection, f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def applied_versions(connection) -> set:
+    return {row[0] for row in connection.execute(_text("SELECT version FROM schema_migrations"))}
+
+
+def upgrade(engine):
+    """
+    Apply every migration the database hasn't seen yet, each in its own transaction
+    :param engine: sync engine
+    :return: list of versions applied
+    """
+    with engine.begin() as connection:
+        _execute(connection, "CREATE TABLE IF NOT EXISTS schema_migrations "
+                             "(version INTEGER NOT NULL PRIMARY KEY, description VARCHAR, applied_date VARCHAR)")
+        applied = applied_versions(connection)
+
+    newly_applied = []
+    for version, description, func in _migrations:
+        if version in applied:
+            continue
+        try:
+            with engine.begin() as connection:
+                func(connection)
+                connection.execute(_text("INSERT INTO schema_migrations (version, description, applied_date) "
+                                         "VALUES (:version, :description, :applied_date)"),
+                                   {"version": version, "description": description,
+                                    "applied_date": str(_dt.datetime.now())})
+        except _IntegrityError:
+            with engine.connect() as connection:
+                if version not in applied_versions(connection):
+                    raise
+            # another process applied this version first
+            continue
+        newly_applied.append(version)
+    return newly_applied
+
+
+@migration(1, "indexes and unique constraints on hot lookup columns")
+def _add_lookup_indexes(connection):
+    _delete_duplicates(connection, "board_members", "user_id", "board_id")
+    _delete_duplicates(connection, "card_members", "card_id", "user_id")
+    _delete_duplicates(connection, "card_labels", "card_id", "label_id")
+    _execute(
+        connection,
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_board_members_user_id_board_id ON board_members (user_id, board_id)",
+        "CREATE INDEX IF NOT EXISTS ix_board_members_board_id ON board_members (board_id)",
+        "CREATE INDEX IF NOT EXISTS ix_boards_owner_id ON boards (owner_id)",
+        "CREATE INDEX IF NOT EXISTS ix_boards_is_public ON boards (is_public)",
+        "CREATE INDEX IF NOT EXISTS ix_board_labels_board_id ON board_labels (board_id)",
+        "CREATE INDEX IF NOT EXISTS ix_lists_board_id ON lists (board_id)",
+        "CREATE INDEX IF NOT EXISTS ix_cards_list_id ON cards (list_id)",
+        "CREATE INDEX IF NOT EXISTS ix_comments_card_id ON comments (card_id)",
+        "CREATE INDEX IF NOT EXISTS ix_check_lists_card_id ON check_lists (card_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_card_members_card_id_user_id ON card_members (card_id, user_id)",
+        "CREATE INDEX IF NOT EXISTS ix_card_members_user_id ON card_members (user_id)",
+        "CREATE INDEX IF NOT EXISTS ix_card_activities_card_id ON card_activities (card_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_card_labels_card_id_label_id ON card_labels (card_id, label_id)",
+        "CREATE INDEX IF NOT EXISTS ix_card_labels_label_id ON card_labels (label_id)",
+        "CREATE INDEX IF NOT EXISTS ix_card_attachments_card_id ON card_attachments (card_id)",
+    )
+
+
+@migration(2, "index attachment blob locations")
+def _add_attachment_location_index(connection):
+    _execute(connection, "CREATE INDEX IF NOT EXISTS ix_card_attachments_location ON card_attachments (location)")
+
+
+@migration(3, "rank columns ordering lists and cards")
+def _add_ranks(connection):
+    _add_column(connection, "lists", "rank", "VARCHAR")
+    _add_column(connection, "cards", "rank", "VARCHAR")
+    # lists keep their position order, cards had no order and keep creation order
+    for table, parent, order in [("lists", "board_id", "position, id"), ("cards", "list_id", "id")]:
+        siblings = {}
+        for row_id, parent_id in connection.execute(_text(f"SELECT id, {parent} FROM {table} ORDER BY {order}")):
+            siblings.setdefault(parent_id, []).append(row_id)
+        updates = [{"id": row_id, "rank": rank}
+                   for ids in siblings.values() for row_id, rank in zip(ids, _spread(len(ids)))]
+        if updates:
+            connection.execute(_text(f"UPDATE {table} SET rank = :rank WHERE id = :id"), updates)
+    _execute(connection,
+             "CREATE INDEX IF NOT EXISTS ix_lists_board_id_rank ON lists (board_id, rank)",
+             "CREATE INDEX IF NOT EXISTS ix_cards_list_id_rank ON cards (list_id, rank)")
+
+
+@migration(4, "board versions and change log")
+def _add_board_changes(connection):
+    _add_column(connection, "boards", "version", "INTEGER NOT NULL DEFAULT 0")
+    _execute(
+        connection,
+        "CREATE TABLE IF NOT EXISTS board_changes (id INTEGER NOT NULL, board_id INTEGER, version INTEGER NOT NULL, "
+        "entity VARCHAR NOT NULL, entity_id INTEGER NOT NULL, action VARCHAR NOT NULL, data JSON, "
+        "created_datetime VARCHAR, PRIMARY KEY (id), FOREIGN KEY(board_id) REFERENCES boards (id))",
+        "CREATE INDEX IF NOT EXISTS ix_board_changes_id ON board_changes (id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_board_changes_board_id_version ON board_changes (board_id, version)",
+    )
+
+
+@migration(5, "full-text search index over cards and comments")
+def _add_search_index(connection):
+    if connection.dialect.name != "sqlite":
+        return
+    # one FTS5 table for both: cards are rowid 2 * id, comments 2 * id + 1
+    _execute(
+        connection,
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(title, body, entity UNINDEXED, card_id UNINDEXED, "
+        "tokenize = 'unicode61 remove_diacritics 2')",
+        "CREATE TRIGGER IF NOT EXISTS cards_search_insert AFTER INSERT ON cards BEGIN "
+        "INSERT INTO search_index (rowid, title, body, entity, card_id) "
+        "VALUES (2 * new.id, new.title, new.description, 'card', new.id); END",
+        "CREATE TRIGGER IF NOT EXISTS cards_search_update AFTER UPDATE OF title, description ON cards BEGIN "
+        "DELETE FROM search_index WHERE rowid = 2 * old.id; "
+        "INSERT INTO search_index (rowid, title, body, entity, card_id) "
+        "VALUES (2 * new.id, new.title, new.description, 'card', new.id); END",
+        "CREATE TRIGGER IF NOT EXISTS cards_search_delete AFTER DELETE ON cards BEGIN "
+        "DELETE FROM search_index WHERE rowid = 2 * old.id; END",
+        "CREATE TRIGGER IF NOT EXISTS comments_search_insert AFTER INSERT ON comments BEGIN "
+        "INSERT INTO search_index (rowid, title, body, entity, card_id) "
+        "VALUES (2 * new.id + 1, NULL, new.comment, 'comment', new.card_id); END",
+        "CREATE TRIGGER IF NOT EXISTS comments_search_update AFTER UPDATE OF comment, card_id ON comments BEGIN "
+        "DELETE FROM search_index WHERE rowid = 2 * old.id + 1; "
+        "INSERT INTO search_index (rowid, title, body, entity, card_id) "
+        "VALUES (2 * new.id + 1, NULL, new.comment, 'comment', new.card_id); END",
+        "CREATE TRIGGER IF NOT EXISTS comments_search_delete AFTER DELETE ON comments BEGIN "
+        "DELETE FROM search_index WHERE rowid = 2 * old.id + 1; END",
+        # index what is already there; starting from empty keeps an interrupted run safe to repeat
+        "DELETE FROM search_index",
+        "INSERT INTO search_index (rowid, title, body, entity, card_id) "
+        "SELECT 2 * id, title, description, 'card', id FROM cards",
+        "INSERT INTO search_index (rowid, title, body, entity, card_id) "
+        "SELECT 2 * id + 1, NULL, comment, 'comment', card_id FROM comments",
+    )
+
+
+@migration(6, "reminder index and notifications")
+def _add_reminders(connection):
+    _execute(
+        connection,
+        "CREATE INDEX IF NOT EXISTS ix_cards_reminder_datetime ON cards (reminder_datetime) "
+        "WHERE reminder_datetime IS NOT NULL",
+        "CREATE TABLE IF NOT EXISTS notifications (id INTEGER NOT NULL, user_id INTEGER NOT NULL, "
+        "card_id INTEGER NOT NULL, message VARCHAR NOT NULL, reminder_datetime VARCHAR NOT NULL, "
+        "created_datetime VARCHAR, is_read BOOLEAN NOT NULL, PRIMARY KEY (id), "
+        "FOREIGN KEY(user_id) REFERENCES site_users (id), FOREIGN KEY(card_id) REFERENCES cards (id))",
+        "CREATE INDEX IF NOT EXISTS ix_notifications_id ON notifications (id)",
+        "CREATE INDEX IF NOT EXISTS ix_notifications_user_id_id ON notifications (user_id, id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_notifications_user_id_card_id_reminder "
+        "ON notifications (user_id, card_id, reminder_datetime)",
+    )
+
+
+_DATETIME_COLUMNS = [("comments", "created_datetime"), ("card_activities", "created_datetime"),
+                     ("board_changes", "created_datetime"), ("notifications", "created_datetime"),
+                     ("cards", "reminder_datetime"), ("notifications", "reminder_datetime")]
+_DATE_COLUMNS = [("site_users", "signup_date"), ("boards", "created_date"), ("cards", "created_date"),
+                 ("cards", "due_date"), ("card_attachments", "uploaded_date")]
+
+# the SQL api.timestamps compiles local_now() and local_today() to on SQLite
+_SQLITE_LOCAL_NOW = "(strftime('%Y-%m-%d %H:%M:%f000', 'now', 'localtime'))"
+_SQLITE_LOCAL_TODAY = "(date('now', 'localtime'))"
+
+
+def _temporal_definition(table: str, column: str, notnull: bool) -> str:
+    # the same columns get defaults as on other databases below
+    if (table, column) in _DATETIME_COLUMNS:
+        default = _SQLITE_LOCAL_NOW if column == "created_datetime" else None
+        definition = "DATETIME"
+    else:
+        default = _SQLITE_LOCAL_TODAY if column != "due_date" else None
+        definition = "DATE"
+    if notnull:
+        definition += " NOT NULL"
+    if default is not None:
+        definition += f" DEFAULT {default}"
+    return definition
+
+
+def _rebuild_sqlite_table(connection, table: str, definitions: dict):
+    """
+    Recreate a SQLite table with new definitions for some of its columns, which ALTER TABLE can't change. Rows keep
+    their ids; the table's indexes and triggers are recreated from their stored SQL.
+    :param connection:
+    :param table:
+    :param definitions: column name -> its new type and constraints
+    """
+    # cid, name, type, notnull, dflt_value, pk
+    columns = connection.exec_driver_sql(f"PRAGMA table_info({table})").all()
+    parts = []
+    for _, name, type_, notnull, default, _ in columns:
+        if name in definitions:
+            parts.append(f"{name} {definitions[name]}")
+            continue
+        parts.append(" ".join([name, type_] + (["NOT NULL"] if notnull else []) +
+                              ([f"DEFAULT {default}"] if default is not None else [])))
+    primary_key = [column[1] for column in sorted(columns, key=lambda column: column[5]) if column[5]]
+    parts.append(f"PRIMARY KEY ({', '.join(primary_key)})")
+    # id, seq, table, from, to, on_update, on_delete, match
+    for row in connection.exec_driver_sql(f"PRAGMA foreign_key_list({table})").all():
+        parts.append(f"FOREIGN KEY({row[3]}) REFERENCES {row[2]} ({row[4]})")
+    schema = connection.exec_driver_sql(f"SELECT sql FROM sqlite_master WHERE tbl_name = '{table}' "
+                                        f"AND type IN ('index', 'trigger') AND sql IS NOT NULL").scalars().all()
+    names = ", ".join(column[1] for column in columns)
+    for statement in [f"CREATE TABLE _new_{table} ({', '.join(parts)})",
+                      f"INSERT INTO _new_{table} ({names}) SELECT {names} FROM {table}",
+                      f"DROP TABLE {table}",
+                      f"ALTER TABLE _new_{table} RENAME TO {table}",
+                      *schema]:
+        # exec_driver_sql, as the defaults' colons would read as bind parameters
+        connection.exec_driver_sql(statement)
+
+
+@migration(7, "typed date and datetime columns")
+def _type_temporal_columns(connection):
+    if connection.dialect.name == "sqlite":
+        # rewrite the values the way SQLAlchemy stores Date and DateTime, so they load as such and compare and sort
+        # as text; str(datetime) left out microseconds when there were none
+        for table, column in _DATETIME_COLUMNS:
+            _execute(connection,
+                     f"UPDATE {table} SET {column} = CASE length({column}) "
+                     f"WHEN 10 THEN {column} || ' 00:00:00.000000' "
+                     f"WHEN 19 THEN replace({column}, 'T', ' ') || '.000000' "
+                     f"ELSE substr(replace({column}, 'T', ' ') || '000000', 1, 26) END "
+                     f"WHERE {column} IS NOT NULL AND (length({column}) != 26 OR {column} LIKE '%T%')")
+        for table, column in _DATE_COLUMNS:
+            _execute(connection, f"UPDATE {table} SET {column} = substr({column}, 1, 10) WHERE length({column}) > 10")
+        # SQLite can't change a column's type or default in place, so tables that predate them are rebuilt; tables
+        # created from the current models already have both
+        _execute(connection, "PRAGMA defer_foreign_keys = ON")
+        for table in dict.fromkeys(table for table, _ in _DATETIME_COLUMNS + _DATE_COLUMNS):
+            columns = {row[1]: row for row in connection.exec_driver_sql(f"PRAGMA table_info({table})")}
+            definitions = {column: _temporal_definition(table, column, bool(columns[column][3]))
+                           for column_table, column in _DATETIME_COLUMNS + _DATE_COLUMNS if column_table == table}
+            if any(columns[column][2] != definition.split()[0] for column, definition in definitions.items()):
+                _rebuild_sqlite_table(connection, table, definitions)
+    else:
+        for table, column in _DATETIME_COLUMNS:
+            _execute(connection,
+                     f"ALTER TABLE {table} ALTER COLUMN {column} TYPE TIMESTAMP USING {column}::timestamp")
+        for table, column in _DATE_COLUMNS:
+            _execute(connection, f"ALTER TABLE {table} ALTER COLUMN {column} TYPE DATE USING {column}::date")
+        for table, column in _DATETIME_COLUMNS:
+            if column == "created_datetime":
+                _execute(connection, f"ALTER TABLE {table} ALTER COLUMN {column} SET DEFAULT LOCALTIMESTAMP")
+        for table, column in _DATE_COLUMNS:
+            if column != "due_date":
+                _execute(connection, f"ALTER TABLE {table} ALTER COLUMN {column} SET DEFAULT CURRENT_DATE")
+    _execute(
+        connection,
+        "CREATE INDEX IF NOT EXISTS ix_cards_due_date ON cards (due_date) WHERE due_date IS NOT NULL",
+        "CREATE INDEX IF NOT EXISTS ix_comments_card_id_created_datetime ON comments (card_id, created_datetime)",
+        "CREATE INDEX IF NOT EXISTS ix_card_activities_card_id_created_datetime "
+        "ON card_activities (card_id, created_datetime)",
+    )
+
+
+@migration(8, "board members by board and user")
+def _add_board_member_index(connection):
+    _execute(
+        connection,
+        "CREATE INDEX IF NOT EXISTS ix_board_members_board_id_user_id ON board_members (board_id, user_id)",
+        # its leading column covers everything the single-column index did
+        "DROP INDEX IF EXISTS ix_board_members_board_id",
+    )
+
+
+@migration(9, "soft-deleted boards and cascading card deletes")
+def _add_board_deleted_at(connection):
+    _add_column(connection, "boards", "deleted_at", "DATETIME")
+    _execute(
+        connection,
+        "CREATE INDEX IF NOT EXISTS ix_boards_deleted_at ON boards (deleted_at) WHERE deleted_at IS NOT NULL",
+        # deleting cards deletes their notifications too
+        "CREATE INDEX IF NOT EXISTS ix_notifications_card_id ON notifications (card_id)",
+    )
+
+
+if __name__ == "__main__":
+    from api.database import create_db as _create_db
+
+    _create_db()
@@ -0,0 +1,196 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event, inspect, text
+from api.main import app
+from api import migrations
+from api.database import async_engine, engine
+from api.lists import list_services
+
+client = TestClient(app)
+
+# the schema databases were created with before migrations existed
+_BASELINE_SCHEMA = [
+    "CREATE TABLE site_users (id INTEGER NOT NULL, username VARCHAR, hashed_password VARCHAR, email VARCHAR, "
+    "signup_date VARCHAR, PRIMARY KEY (id))",
+    "CREATE UNIQUE INDEX ix_site_users_email ON site_users (email)",
+    "CREATE TABLE core_labels (id INTEGER NOT NULL, name VARCHAR, color VARCHAR, PRIMARY KEY (id))",
+    "CREATE TABLE boards (id INTEGER NOT NULL, owner_id INTEGER, name VARCHAR, is_public INTEGER, "
+    "created_date VARCHAR, PRIMARY KEY (id), FOREIGN KEY(owner_id) REFERENCES site_users (id))",
+    "CREATE TABLE board_members (id INTEGER NOT NULL, user_id INTEGER, board_id INTEGER, PRIMARY KEY (id), "
+    "FOREIGN KEY(user_id) REFERENCES site_users (id), FOREIGN KEY(board_id) REFERENCES boards (id))",
+    "CREATE TABLE board_labels (id INTEGER NOT NULL, board_id INTEGER, name VARCHAR, color VARCHAR, "
+    "PRIMARY KEY (id), FOREIGN KEY(board_id) REFERENCES boards (id))",
+    "CREATE TABLE lists (id INTEGER NOT NULL, board_id INTEGER, name VARCHAR, position INTEGER, PRIMARY KEY (id), "
+    "FOREIGN KEY(board_id) REFERENCES boards (id))",
+    "CREATE TABLE cards (id INTEGER NOT NULL, list_id INTEGER, title VARCHAR, description VARCHAR, "
+    "created_date VARCHAR, is_active BOOLEAN, due_date VARCHAR, reminder_datetime VARCHAR, PRIMARY KEY (id), "
+    "FOREIGN KEY(list_id) REFERENCES lists (id))",
+    "CREATE TABLE comments (id INTEGER NOT NULL, card_id INTEGER, user_id INTEGER, comment VARCHAR, "
+    "created_datetime VARCHAR, PRIMARY KEY (id), FOREIGN KEY(card_id) REFERENCES cards (id), "
+    "FOREIGN KEY(user_id) REFERENCES site_users (id))",
+    "CREATE TABLE check_lists (id INTEGER NOT NULL, card_id INTEGER, title VARCHAR, is_checked INTEGER, "
+    "position INTEGER, PRIMARY KEY (id), FOREIGN KEY(card_id) REFERENCES cards (id))",
+    "CREATE TABLE card_members (id INTEGER NOT NULL, card_id INTEGER, user_id INTEGER, PRIMARY KEY (id), "
+    "FOREIGN KEY(card_id) REFERENCES cards (id), FOREIGN KEY(user_id) REFERENCES site_users (id))",
+    "CREATE TABLE card_activities (id INTEGER NOT NULL, card_id INTEGER, user_id INTEGER, activity VARCHAR, "
+    "created_datetime VARCHAR, PRIMARY KEY (id), FOREIGN KEY(card_id) REFERENCES cards (id), "
+    "FOREIGN KEY(user_id) REFERENCES site_users (id))",
+    "CREATE TABLE card_labels (id INTEGER NOT NULL, card_id INTEGER, label_id INTEGER, PRIMARY KEY (id), "
+    "FOREIGN KEY(card_id) REFERENCES cards (id), FOREIGN KEY(label_id) REFERENCES board_labels (id))",
+    "CREATE TABLE card_attachments (id INTEGER NOT NULL, card_id INTEGER, uploaded_date VARCHAR, "
+    "file_name VARCHAR, location VARCHAR, PRIMARY KEY (id), FOREIGN KEY(card_id) REFERENCES cards (id))",
+]
+
+
+class TestMigrations(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{os.path.join(self.directory.name, 'baseline.db')}")
+        with self.engine.begin() as connection:
+            for statement in _BASELINE_SCHEMA:
+                connection.execute(text(statement))
+            connection.execute(text("INSERT INTO site_users (id, email) VALUES (1, 'one'), (2, 'two')"))
+            connection.execute(text("INSERT INTO boards (id, owner_id, name, is_public) VALUES (1, 1, 'Board', 1)"))
+            connection.execute(text("INSERT INTO board_members (user_id, board_id) VALUES (1, 1), (2, 1), (1, 1)"))
+            connection.execute(text("INSERT INTO lists (id, board_id, name, position) VALUES (1, 1, 'Done', 2), "
+                                    "(2, 1, 'To do', 0), (3, 1, 'Doing', 1)"))
+            connection.execute(text("INSERT INTO cards (id, list_id, title, created_date, reminder_datetime) VALUES "
+                                    "(1, 2, 'First', '2023-06-01', '2023-06-02 09:30:00'), "
+                                    "(2, 2, 'Second', '2023-06-01', '2023-06-02T09:30:00.25')"))
+            # str(datetime.now()) drops the microseconds when there are none
+            connection.execute(text("INSERT INTO comments (card_id, user_id, comment, created_datetime) VALUES "
+                                    "(1, 1, 'Later', '2023-06-01 10:00:00.000001'), "
+                                    "(1, 1, 'Earlier', '2023-06-01 10:00:00')"))
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.directory.cleanup()
+
+    def test_upgrade_existing_database(self):
+        applied = migrations.upgrade(self.engine)
+        self.assertEqual(applied, [version for version, description, func in migrations._migrations])
+
+        index_names = {index["name"] for index in inspect(self.engine).get_indexes("board_members")}
+        self.assertIn("uq_board_members_user_id_board_id", index_names)
+        self.assertIn("ix_cards_list_id", {index["name"] for index in inspect(self.engine).get_indexes("cards")})
+        with self.engine.connect() as connection:
+            members = connection.execute(text("SELECT user_id, board_id FROM board_members ORDER BY id")).all()
+        self.assertEqual(members, [(1, 1), (2, 1)])
+        with self.engine.connect() as connection:
+            lists = connection.execute(text("SELECT name FROM lists ORDER BY rank")).scalars().all()
+            cards = connection.execute(text("SELECT title FROM cards ORDER BY rank")).scalars().all()
+        self.assertEqual(lists, ["To do", "Doing", "Done"])
+        self.assertEqual(cards, ["First", "Second"])
+        with self.engine.begin() as connection:
+            connection.execute(text("UPDATE cards SET title = 'Renamed' WHERE id = 2"))
+            indexed = connection.execute(text("SELECT card_id FROM search_index WHERE search_index MATCH 'first OR "
+                                              "renamed' ORDER BY card_id")).scalars().all()
+        self.assertEqual(indexed, [1, 2])
+        with self.engine.connect() as connection:
+            reminders = connection.execute(text("SELECT reminder_datetime FROM cards ORDER BY id")).scalars().all()
+            comments = connection.execute(text("SELECT comment FROM comments WHERE card_id = 1 "
+                                               "ORDER BY created_datetime")).scalars().all()
+        self.assertEqual(reminders, ["2023-06-02 09:30:00.000000", "2023-06-02 09:30:00.250000"])
+        self.assertEqual(comments, ["Earlier", "Later"])
+        # the rebuilt tables have the server defaults, and kept their triggers
+        with self.engine.begin() as connection:
+            connection.execute(text("INSERT INTO comments (card_id, user_id, comment) VALUES (2, 1, 'Defaulted')"))
+            created = connection.execute(text("SELECT created_datetime FROM comments "
+                                              "WHERE comment = 'Defaulted'")).scalar()
+            indexed = connection.execute(text("SELECT count(*) FROM search_index WHERE search_index MATCH "
+                                              "'defaulted'")).scalar()
+        self.assertRegex(created, r"^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\.\d{6}$")
+        self.assertEqual(indexed, 1)
+
+    def test_upgrade_is_idempotent(self):
+        migrations.upgrade(self.engine)
+        self.assertEqual(migrations.upgrade(self.engine), [])
+
+
+class TestQueryPlans(unittest.TestCase):
+    email = "test3@gmail.com"
+    password = "password123"
+    username = "Test User"
+
+    from api.database import create_db as _create_db
+    _create_db()
+
+    def setUp(self):
+        client.post("/users/create_user", json={"email": self.email, "password": self.password,
+                                                "username": self.username})
+        response = client.post("/users/token", data={"username": self.email, "password": self.password})
+        self.headers = {
+            "Authorization": f"Bearer {response.json()['access_token']}"
+        }
+
+    def use_every_service(self):
+        headers = self.headers
+        board_id = client.post("/boards/create_board", json={"name": "Plan board", "is_public": False},
+                               headers=headers).json()["id"]
+        member_email = "test3_member1@gmail.com"
+        client.post("/users/create_user", json={"email": member_email, "password": self.password,
+                                                "username": self.username})
+        client.post(f"/boards/add_member/{board_id}", json={"email": member_email}, headers=headers)
+        label_id = client.post(f"/boards/{board_id}/labels", json={"name": "Label", "color": "red"},
+                               headers=headers).json()["id"]
+        list_id = client.post(f"/lists/{board_id}/create_list", json={"name": "List", "position": 0},
+                              headers=headers).json()["id"]
+        card_id = client.post(f"/cards/{board_id}/{list_id}/create_card",
+                              json={"title": "Card", "description": "Description"}, headers=headers).json()["id"]
+        client.post(f"/comments/{board_id}/{list_id}/{card_id}/create_comment", json={"comment": "Comment"},
+                    headers=headers)
+        client.post(f"/checklists/{board_id}/{card_id}/create_checklist",
+                    json={"title": "Item", "is_checked": False, "position": 0}, headers=headers)
+        client.post(f"/card_members/{board_id}/{card_id}/add_member", json={"email": member_email}, headers=headers)
+        client.post(f"/card_labels/{board_id}/{card_id}/{label_id}/add_card_label", headers=headers)
+        client.post(f"/card_attachments/{board_id}/{card_id}/add_card_attachment",
+                    files={"file": ("file.txt", b"attachment")}, headers=headers)
+        other_list_id = client.post(f"/lists/{board_id}/create_list", json={"name": "Other", "position": 1},
+                                    headers=headers).json()["id"]
+        client.put(f"/lists/{board_id}/{other_list_id}/move", json={"before_id": list_id}, headers=headers)
+        client.put(f"/cards/{board_id}/{card_id}/move", json={"list_id": other_list_id}, headers=headers)
+        client.put(f"/cards/{board_id}/{card_id}/move", json={"list_id": list_id}, headers=headers)
+        for path in ["/users", "/boards/me", "/boards/public", f"/boards/members/{board_id}",
+                     f"/boards/{board_id}/labels", f"/boards/get_full_board?board_id={board_id}", f"/lists/{board_id}",
+                     f"/cards/{board_id}/{list_id}/get_cards", f"/cards/{board_id}/{card_id}/get_full_card",
+                     f"/comments/{board_id}/{list_id}/{card_id}/get_comments",
+                     f"/checklists/{board_id}/{card_id}/get_checklists",
+                     f"/card_members/{board_id}/{card_id}/get_card_members",
+                     f"/card_activity/{board_id}/{card_id}/get_card_activity",
+                     f"/card_labels/{board_id}/{card_id}/get_card_labels",
+                     f"/card_attachments/{board_id}/{card_id}/get_card_attachments"]:
+            self.assertEqual(client.get(path, headers=headers).status_code, 200, path)
+        client.post(f"/cards/{board_id}/{other_list_id}/create_card",
+                    json={"title": "Card", "description": "Description"}, headers=headers)
+        client.post(f"/boards/remove_member/{board_id}", json={"email": member_email}, headers=headers)
+        client.delete(f"/lists/{list_id}/{board_id}", headers=headers)
+        client.delete(f"/boards/{board_id}", headers=headers)
+        asyncio.run(list_services.board_purge.run())
+
+    def test_service_queries_use_indexes(self):
+        statements = {}
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if not executemany and statement.lstrip().startswith(("SELECT", "UPDATE", "DELETE")):
+                statements.setdefault(statement, parameters)
+
+        event.listen(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            self.use_every_service()
+        finally:
+            event.remove(async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+
+        self.assertGreater(len(statements), 20)
+        with engine.connect() as connection:
+            for statement, parameters in statements.items():
+                plan = [row[3] for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)]
+                # an unfiltered scan already in key order stops after LIMIT rows (the first page of /users)
+                sorts = any(step.startswith("USE TEMP B-TREE") for step in plan)
+                if "WHERE" not in statement and "LIMIT" in statement and not sorts:
+                    continue
+                full_scans = [step for step in plan if step.startswith("SCAN") and "USING" not in step]
+                self.assertEqual(full_scans, [], statement)
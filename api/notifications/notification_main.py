@@ -0,0 +1,37 @@
+from fastapi import APIRouter as _APIRouter, Depends as _Depends, HTTPException as _HTTPException, \
+    Response as _Response, status as _status
+from . import notification_services as _notification_services
+from . import notification_schemas as _notification_schemas
+from ..users.user_services import get_current_user as _get_current_user
+from ..users import user_schemas as _user_schemas
+from ..database import get_async_db as _get_async_db, get_read_db as _get_read_db, \
+    UnitOfWorkRoute as _UnitOfWorkRoute
+from .. import pagination as _pagination
+from sqlalchemy.ext.asyncio import AsyncSession as _AsyncSession
+
+router = _APIRouter(
+    prefix="/notifications",
+    tags=["notifications"],
+    route_class=_UnitOfWorkRoute,
+)
+
+
+@router.get("", response_model=list[_notification_schemas.Notification])
+async def get_notifications(response: _Response,
+                            page_params: _pagination.PageParams = _Depends(_pagination.page_params),
+                            db: _AsyncSession = _Depends(_get_read_db),
+                            current_user: _user_schemas.User = _Depends(_get_current_user)):
+    page = await _notification_services.get_notifications(db=db, user_id=current_user.id, params=page_params)
+    _pagination.set_next_cursor(response, page)
+    return [_notification_schemas.Notification.from_orm(db_notification) for db_notification in page.items]
+
+
+@router.put("/{notification_id}/read", response_model=_notification_schemas.Notification)
+async def mark_read(notification_id: int, db: _AsyncSession = _Depends(_get_async_db),
+                    current_user: _user_schemas.User = _Depends(_get_current_user)):
+    db_notification = await _notification_services.get_notification(db=db, user_id=current_user.id,
+                                                                     notification_id=notification_id)
+    if not db_notification:
+        raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="Notification not found")
+    db_notification = await _notification_services.mark_read(db=db, db_notification=db_notification)
+    return _notification_schemas.Notification.from_orm(db_notification)
@@ -0,0 +1,25 @@
+from api.database import Base as _Base
+from api.timestamps import local_now as _local_now
+from sqlalchemy import Column as _Column, Integer as _Integer, String as _String, ForeignKey as _ForeignKey, \
+    Boolean as _Boolean, Index as _Index, DateTime as _DateTime
+import datetime as _dt
+
+
+class Notification(_Base):
+    # a due-date reminder sent to one of the card's members
+    __tablename__ = "notifications"
+    __table_args__ = (
+        # one per member and reminder time, so delivering a reminder twice is harmless
+        _Index("uq_notifications_user_id_card_id_reminder", "user_id", "card_id", "reminder_datetime", unique=True),
+        _Index("ix_notifications_user_id_id", "user_id", "id"),
+        # deleting a card's notifications along with it
+        _Index("ix_notifications_card_id", "card_id"),
+    )
+    id = _Column(_Integer, primary_key=True, index=True)
+    user_id = _Column(_Integer, _ForeignKey("site_users.id"), nullable=False)
+    card_id = _Column(_Integer, _ForeignKey("cards.id"), nullable=False)
+    message = _Column(_String, nullable=False)
+    # the card's reminder_datetime when it was sent
+    reminder_datetime = _Column(_DateTime, nullable=False)
+    created_datetime = _Column(_DateTime, default=_dt.datetime.now, server_default=_local_now())
+    is_read = _Column(_Boolean, default=False, nullable=False)
@@ -0,0 +1,14 @@
+import datetime as _dt
+import pydantic as _pydantic
+
+
+class Notification(_pydantic.BaseModel):
+    id: int
+    card_id: int
+    message: str
+    reminder_datetime: _dt.datetime
+    created_datetime: _dt.datetime
+    is_read: bool
+
+    class Config:
+        orm_mode = True
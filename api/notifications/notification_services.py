@@ -0,0 +1,67 @@
+import datetime as _dt
+
+from sqlalchemy import select as _select
+from sqlalchemy.dialects import postgresql as _postgresql, sqlite as _sqlite
+from sqlalchemy.ext.asyncio import AsyncSession as _AsyncSession
+
+from api import pagination as _pagination
+from api.database import AsyncSessionLocal as _AsyncSessionLocal, commit as _commit
+from ..cards import card_models as _card_models
+from . import notification_models as _notification_models
+
+_inserts = {"sqlite": _sqlite.insert, "postgresql": _postgresql.insert}
+
+
+async def get_notifications(db: _AsyncSession, user_id: int, params: _pagination.PageParams):
+    # newest first
+    query = _select(_notification_models.Notification) \
+        .filter(_notification_models.Notification.user_id == user_id)
+    return await _pagination.paginate(db, query, order_by=[_notification_models.Notification.id],
+                                      key=lambda notification: (notification.id,), params=params, descending=True)
+
+
+async def get_notification(db: _AsyncSession, user_id: int, notification_id: int):
+    return await db.scalar(_select(_notification_models.Notification)
+                           .filter(_notification_models.Notification.id == notification_id)
+                           .filter(_notification_models.Notification.user_id == user_id))
+
+
+async def mark_read(db: _AsyncSession, db_notification: _notification_models.Notification):
+    db_notification.is_read = True
+    db.add(db_notification)
+    await db.flush()
+    return db_notification
+
+
+async def notify_card_members(db: _AsyncSession, db_card: _card_models.Card, reminder_datetime: _dt.datetime):
+    """
+    Send the card's reminder to each of its members, skipping members who already have it
+    :param db: async session
+    :param db_card: the card
+    :param reminder_datetime: the reminder being sent
+    :return: number of members notified
+    """
+    member_ids = (await db.scalars(_select(_card_models.CardMember.user_id)
+                                   .filter(_card_models.CardMember.card_id == db_card.id))).all()
+    if not member_ids:
+        return 0
+    rows = [{"user_id": user_id, "card_id": db_card.id, "message": f"Reminder: {db_card.title}",
+             "reminder_datetime": reminder_datetime, "created_datetime": _dt.datetime.now(),
+             "is_read": False} for user_id in member_ids]
+    insert = _inserts[db.bind.dialect.name](_notification_models.Notification).values(rows)
+    result = await db.execute(insert.on_conflict_do_nothing())
+    return result.rowcount
+
+
+async def deliver_reminder(card_id: int, reminder_datetime: _dt.datetime):
+    """
+    Scheduler callback: notify the card's members, in its own transaction, if the card is still active and the
+    reminder is still set for that time
+    """
+    async with _AsyncSessionLocal() as db:
+        db_card = await db.get(_card_models.Card, card_id)
+        if db_card is None or not db_card.is_active or db_card.reminder_datetime != reminder_datetime:
+            return 0
+        notified = await notify_card_members(db=db, db_card=db_card, reminder_datetime=reminder_datetime)
+        await _commit(db)
+        return notified
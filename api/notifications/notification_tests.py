@@ -0,0 +1,114 @@
+import asyncio
+import datetime as dt
+import unittest
+import uuid
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from api.main import app
+from api import database
+from api.reminders import ReminderScheduler
+from api.cards import card_services
+from api.notifications import notification_services
+
+client = TestClient(app)
+
+
+class TestReminderNotifications(unittest.TestCase):
+    email = "test3@gmail.com"
+    password = "password123"
+    username = "Test User"
+
+    database.create_db()
+
+    def setUp(self):
+        client.post("/users/create_user", json={"email": self.email, "password": self.password,
+                                                "username": self.username})
+        token = client.post("/users/token", data={"username": self.email, "password": self.password}).json()
+        self.headers = {"Authorization": f"Bearer {token['access_token']}"}
+        self.board = client.post("/boards/create_board", json={"name": "Reminder board", "is_public": False},
+                                 headers=self.headers).json()
+        self.list = client.post(f"/lists/{self.board['id']}/create_list", json={"name": "List", "position": 0},
+                                headers=self.headers).json()
+        self.card = self.create_card()
+        # whole seconds, the way reminders come in from clients
+        self.reminder = dt.datetime.now().replace(microsecond=0) - dt.timedelta(minutes=1)
+
+    def create_card(self):
+        card = client.post(f"/cards/{self.board['id']}/{self.list['id']}/create_card",
+                           json={"title": f"Card {uuid.uuid4()}", "description": "Description"},
+                           headers=self.headers).json()
+        client.post(f"/card_members/{self.board['id']}/{card['id']}/add_member", json={"email": self.email},
+                    headers=self.headers)
+        return card
+
+    def card_url(self, card, action):
+        return f"/cards/{self.board['id']}/{self.list['id']}/{card['id']}/{action}"
+
+    def set_reminder(self, card, reminder):
+        response = client.put(self.card_url(card, "set_due_date"),
+                              json={"due_date": "2030-01-01", "reminder_datetime": reminder and reminder.isoformat()},
+                              headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def run_scheduler(self):
+        scheduler = ReminderScheduler(load=card_services._load_reminders,
+                                      deliver=notification_services.deliver_reminder)
+        return asyncio.run(scheduler.tick()), scheduler
+
+    def notifications(self, card):
+        notifications = client.get("/notifications", params={"limit": 100}, headers=self.headers).json()
+        return [notification for notification in notifications if notification["card_id"] == card["id"]]
+
+    def test_due_reminder_is_sent_once(self):
+        self.assertEqual(self.set_reminder(self.card, self.reminder)["reminder_datetime"], self.reminder.isoformat())
+        self.run_scheduler()
+        self.run_scheduler()
+        notifications = self.notifications(self.card)
+        self.assertEqual([(n["message"], n["reminder_datetime"], n["is_read"]) for n in notifications],
+                         [(f"Reminder: {self.card['title']}", self.reminder.isoformat(), False)])
+
+        response = client.put(f"/notifications/{notifications[0]['id']}/read", headers=self.headers)
+        self.assertTrue(response.json()["is_read"])
+
+    def test_later_archived_and_cleared_reminders_are_not_sent(self):
+        later = self.create_card()
+        self.set_reminder(later, self.reminder + dt.timedelta(days=1))
+        archived = self.create_card()
+        self.set_reminder(archived, self.reminder)
+        client.put(self.card_url(archived, "archive_card"), headers=self.headers)
+        self.set_reminder(self.card, self.reminder)
+        self.set_reminder(self.card, None)
+
+        _, scheduler = self.run_scheduler()
+        self.assertNotIn(later["id"], scheduler._scheduled)
+        self.assertEqual(self.notifications(later) + self.notifications(archived) + self.notifications(self.card), [])
+
+    def test_reminder_moved_after_loading_is_not_sent_at_the_old_time(self):
+        self.set_reminder(self.card, self.reminder + dt.timedelta(minutes=2))
+        card_services.reminder_scheduler.reset()
+        try:
+            asyncio.run(card_services.reminder_scheduler.tick())
+            self.assertIn(self.card["id"], card_services.reminder_scheduler._scheduled)
+            # the endpoint reschedules the card once it has committed
+            self.set_reminder(self.card, self.reminder + dt.timedelta(days=1))
+            self.assertNotIn(self.card["id"], card_services.reminder_scheduler._scheduled)
+        finally:
+            asyncio.run(card_services.reminder_scheduler.stop())
+
+    def test_range_query_uses_the_index(self):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append((statement, parameters))
+
+        event.listen(database.async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            asyncio.run(card_services._load_reminders((self.reminder, 0), self.reminder + dt.timedelta(hours=1), 100))
+        finally:
+            event.remove(database.async_engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+        with database.engine.connect() as connection:
+            plan = [row[3] for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statements[0][0],
+                                                                 statements[0][1])]
+        self.assertIn("ix_cards_reminder_datetime", " ".join(plan))
+        self.assertFalse(any(step.startswith("USE TEMP B-TREE") for step in plan), plan)
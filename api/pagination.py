@@ -0,0 +1,86 @@
+"""
+Keyset (cursor) pagination for collection endpoints.
+
+Pages are read with `WHERE (sort key) > (last key seen) ORDER BY sort key LIMIT n` instead of OFFSET, so every page
+costs the same no matter how deep it is. The sort key must be unique (end it with the primary key). The cursor
+handed to clients is the last key of the page, base64 encoded; it is sent back in the X-Next-Cursor response
+header, which is left out on the last page. Response bodies stay plain lists.
+"""
+import base64 as _base64
+import binascii as _binascii
+import json as _json
+import typing as _typing
+
+from fastapi import HTTPException as _HTTPException, Query as _Query, Response as _Response, status as _status
+from sqlalchemy import tuple_ as _tuple_
+from sqlalchemy.ext.asyncio import AsyncSession as _AsyncSession
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+class PageParams(_typing.NamedTuple):
+    cursor: str | None
+    limit: int
+
+
+class Page(_typing.NamedTuple):
+    items: list
+    next_cursor: str | None
+
+
+def page_params(cursor: str | None = None,
+                limit: int = _Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)) -> PageParams:
+    return PageParams(cursor=cursor, limit=limit)
+
+
+def encode_cursor(key: tuple) -> str:
+    return _base64.urlsafe_b64encode(_json.dumps(list(key), separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> tuple:
+    try:
+        key = _json.loads(_base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, _binascii.Error):
+        key = None
+    if not isinstance(key, list) or len(key) != size:
+        raise _HTTPException(status_code=_status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return tuple(key)
+
+
+async def paginate(db: _AsyncSession, query, order_by: list, key: _typing.Callable, params: PageParams,
+                   descending: bool = False, rows: bool = False) -> Page:
+    """
+    Read one page of `query`
+    :param db: async session
+    :param query: select() of one ORM entity, or of columns with `rows`, with its filters already applied
+    :param order_by: columns of a unique sort key
+    :param key: returns the values of `order_by` for a loaded row; these become the cursor
+    :param params: cursor and page size from the request
+    :param descending: page from the largest key down
+    :param rows: return the selected rows rather than their first column
+    :return: Page of rows and the cursor of the next page, if there is one
+    """
+    if params.cursor is not None:
+        last_key = decode_cursor(params.cursor, len(order_by))
+        if len(order_by) == 1:
+            sort_key, last_key = order_by[0], last_key[0]
+        else:
+            sort_key = _tuple_(*order_by)
+            last_key = _tuple_(*last_key)
+        query = query.filter(sort_key < last_key if descending else sort_key > last_key)
+    query = query.order_by(*(column.desc() if descending else column for column in order_by))
+
+    # one extra row tells us whether there is a next page without a COUNT
+    result = await db.execute(query.limit(params.limit + 1))
+    items = result.all() if rows else result.scalars().all()
+    if len(items) <= params.limit:
+        return Page(items=items, next_cursor=None)
+    items = items[:params.limit]
+    return Page(items=items, next_cursor=encode_cursor(key(items[-1])))
+
+
+def set_next_cursor(response: _Response, page: Page):
+    if page.next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = page.next_cursor
@@ -0,0 +1,96 @@
+"""
+Background purging of deleted rows.
+
+Deleting something large in one transaction holds SQLite's writer lock for as long as the delete runs, and every
+other write waits behind it. Instead the parent row is only marked deleted, which reads already skip, and PurgeJob
+removes it with everything under it later: each `purge` call deletes one bounded batch in its own short transaction,
+and the job pauses between batches so other writers get the lock.
+
+The job looks for pending work every `interval` seconds, and wake() makes it look straight away. Until start() is
+called nothing is purged in the background; tests and scripts call run() themselves. Marks are stored in the
+database, so a process that stops mid-purge leaves the rest for the next one.
+"""
+import asyncio as _asyncio
+import logging as _logging
+import os as _os
+from typing import Awaitable as _Awaitable, Callable as _Callable
+
+PURGE_INTERVAL = float(_os.environ.get("PURGE_INTERVAL_SECONDS", "60"))
+PURGE_PAUSE = float(_os.environ.get("PURGE_PAUSE_SECONDS", "0.05"))
+
+_logger = _logging.getLogger(__name__)
+
+
+class PurgeJob:
+
+    def __init__(self, pending: _Callable[[], _Awaitable[list[int]]], purge: _Callable[[int], _Awaitable[bool]],
+                 interval: float = PURGE_INTERVAL, pause: float = PURGE_PAUSE):
+        """
+        :param pending: async () -> ids marked deleted and not purged yet, oldest first
+        :param purge: async (id) -> True once it is gone; each call deletes one batch and commits
+        :param interval: seconds between looks for pending work
+        :param pause: seconds between batches
+        """
+        self.pending = pending
+        self.purge = purge
+        self.interval = interval
+        self.pause = pause
+        self._wakeup = _asyncio.Event()
+        self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def wake(self):
+        """
+        Look for pending work now rather than at the next interval; call it once the mark has committed
+        """
+        self._wakeup.set()
+
+    async def run(self) -> int:
+        """
+        Purge everything pending, a batch at a time
+        :return: number of ids purged
+        """
+        purged = 0
+        while item_ids := await self.pending():
+            for item_id in item_ids:
+                while not await self.purge(item_id):
+                    await _asyncio.sleep(self.pause)
+                purged += 1
+        return purged
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run()
+            except Exception:
+                _logger.exception("Purging failed, retrying")
+            try:
+                await _asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except _asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self):
+        """
+        Start purging in the background; must be called from the running event loop
+        """
+        if self.running:
+            return
+        # the loop at startup may not be the one the job was created in
+        self._wakeup = _asyncio.Event()
+        self._task = _asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop purging; a batch in progress rolls back and is picked up again by the next start
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except _asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,139 @@
+"""
+Ordering by rank strings.
+
+Lists and cards are ordered by a `rank` string instead of an integer position. Ranks are base 36 fractions
+("i" is 0.5) compared as plain strings, so a row can always be placed between two neighbours by giving it a rank in
+between, and a move only updates the row being moved. Ranks never end in "0": for strings without trailing zeros,
+string order and numeric order are the same, and there is always room below any rank.
+
+Inserting into the same gap over and over makes ranks longer, about one character every five inserts. Once a rank
+is longer than MAX_RANK_LENGTH the siblings are spread out evenly again by rebalance(), off the request path.
+"""
+from sqlalchemy import select as _select, update as _update
+from sqlalchemy.ext.asyncio import AsyncSession as _AsyncSession
+
+DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+RANK_WIDTH = 6
+MAX_RANK_LENGTH = 12
+# appends step this many units (at the rank's width, counting from the 4th digit) past the last rank, leaving room
+# to insert between neighbours without making ranks longer
+_APPEND_STEP_DIGITS = 4
+
+_BASE = len(DIGITS)
+
+
+def _to_int(rank: str, width: int) -> int:
+    value = 0
+    for char in rank.ljust(width, "0")[:width]:
+        value = value * _BASE + DIGITS.index(char)
+    return value
+
+
+def _to_rank(value: int, width: int) -> str:
+    chars = []
+    for _ in range(width):
+        value, digit = divmod(value, _BASE)
+        chars.append(DIGITS[digit])
+    return "".join(reversed(chars)).rstrip("0")
+
+
+def rank_between(lower: str | None, upper: str | None) -> str:
+    """
+    A rank that sorts after `lower` and before `upper`
+    :param lower: rank to sort after, None for the start
+    :param upper: rank to sort before, None for the end
+    :return: rank
+    """
+    width = max(len(lower or ""), len(upper or ""), RANK_WIDTH)
+    while True:
+        scale = _BASE ** width
+        step = _BASE ** (width - _APPEND_STEP_DIGITS)
+        low = _to_int(lower, width) if lower is not None else None
+        high = _to_int(upper, width) if upper is not None else None
+        # at the open ends step away from the last rank rather than halving the remaining space
+        if low is None:
+            low = max(high - 2 * step, 0) if high is not None else 0
+        if high is None:
+            high = min(low + 2 * step, scale) if lower is not None else scale
+        if high - low > 1:
+            return _to_rank((low + high) // 2, width)
+        width += 1
+
+
+def spread(count: int) -> list[str]:
+    """
+    `count` ranks spaced evenly, in order
+    """
+    width = RANK_WIDTH
+    while _BASE ** width < (count + 1) * _BASE ** 2:
+        width += 1
+    scale = _BASE ** width
+    return [_to_rank((index + 1) * scale // (count + 1), width) for index in range(count)]
+
+
+def needs_rebalance(rank: str | None) -> bool:
+    return rank is not None and len(rank) > MAX_RANK_LENGTH
+
+
+async def neighbour_ranks(db: _AsyncSession, model, scope, moving_id: int | None, after_id: int | None = None,
+                          before_id: int | None = None) -> tuple[str | None, str | None]:
+    """
+    Ranks a row has to go between to land after `after_id` and before `before_id`
+    :param db: async session
+    :param model: ranked model (List or Card)
+    :param scope: filter selecting the siblings, e.g. Card.list_id == list_id
+    :param moving_id: id of the row being placed, never its own neighbour
+    :param after_id: sibling to place the row after
+    :param before_id: sibling to place the row before; neither means the end
+    :return: (lower, upper) ranks, None for an open end
+    :raises LookupError: if after_id or before_id isn't one of the siblings
+    """
+    siblings = _select(model.rank).filter(scope)
+    if moving_id is not None:
+        siblings = siblings.filter(model.id != moving_id)
+
+    async def rank_of(sibling_id: int) -> str:
+        rank = (await db.execute(siblings.filter(model.id == sibling_id))).first()
+        if rank is None:
+            raise LookupError(sibling_id)
+        return rank[0]
+
+    lower = await rank_of(after_id) if after_id is not None else None
+    upper = await rank_of(before_id) if before_id is not None else None
+    if after_id is not None and before_id is None:
+        upper = await db.scalar(siblings.filter(model.rank > lower).order_by(model.rank).limit(1))
+    elif before_id is not None and after_id is None:
+        lower = await db.scalar(siblings.filter(model.rank < upper).order_by(model.rank.desc()).limit(1))
+    elif after_id is None:
+        lower = await db.scalar(siblings.order_by(model.rank.desc()).limit(1))
+    return lower, upper
+
+
+async def rank_for_move(db: _AsyncSession, model, scope, moving_id: int | None, after_id: int | None = None,
+                        before_id: int | None = None) -> str:
+    """
+    Rank for a row placed among its siblings, see neighbour_ranks. Placing between neighbours that are out of order
+    or share a rank (only possible after concurrent moves) puts the row after `lower`.
+    """
+    lower, upper = await neighbour_ranks(db=db, model=model, scope=scope, moving_id=moving_id, after_id=after_id,
+                                         before_id=before_id)
+    if lower is not None and upper is not None and lower >= upper:
+        upper = None
+    return rank_between(lower, upper)
+
+
+async def rebalance(db: _AsyncSession, model, scope):
+    """
+    Give every sibling an evenly spaced rank, keeping their order
+    :param db: async session, committed by the caller
+    :param model: ranked model (List or Card)
+    :param scope: filter selecting the siblings
+    :return: ids of the siblings, in order
+    """
+    # writing first takes SQLite's write lock, so no move can commit between reading the order and rewriting it
+    await db.execute(_update(model).filter(scope).values(rank=model.rank).execution_options(
+        synchronize_session=False))
+    ids = (await db.scalars(_select(model.id).filter(scope).order_by(model.rank, model.id))).all()
+    if ids:
+        await db.execute(_update(model), [{"id": row_id, "rank": rank} for row_id, rank in zip(ids, spread(len(ids)))])
+    return ids
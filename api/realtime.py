@@ -0,0 +1,123 @@
+"""
+In-process fan-out of board changes to WebSocket subscribers.
+
+Every change recorded with record_board_change() is published to the board's subscribers once its unit of work has
+committed. Each subscriber has its own bounded queue, so one slow client never holds up a mutation or other clients:
+a subscriber whose queue is full is dropped and its socket closed with 1013 (try again later). Events carry the
+board version, so a dropped or reconnecting client catches up with GET /boards/{board_id}/changes?since=<version>.
+
+Access is checked again before every event is sent, through the (cached) board access check, so a member who is
+removed or a board made private stops a subscriber's stream at the next change rather than when it disconnects.
+
+The hub only sees changes made by its own process; with several workers, clients miss changes made elsewhere until
+they poll the change feed.
+"""
+import asyncio as _asyncio
+import os as _os
+from typing import Awaitable as _Awaitable, Callable as _Callable
+
+from fastapi import WebSocket as _WebSocket, WebSocketDisconnect as _WebSocketDisconnect, status as _status
+
+SUBSCRIBER_QUEUE_SIZE = int(_os.environ.get("BOARD_EVENTS_QUEUE_SIZE", "100"))
+
+
+class Subscription:
+
+    def __init__(self, board_id: int, queue_size: int):
+        self.board_id = board_id
+        self.queue = _asyncio.Queue(queue_size)
+        self.dropped = False
+
+    def offer(self, event: dict) -> bool:
+        """
+        Queue an event without waiting
+        :return: False if the queue is full and the subscriber has been dropped
+        """
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except _asyncio.QueueFull:
+            # make room for the sentinel that tells the consumer it has been dropped
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.dropped = True
+            self.queue.put_nowait(None)
+            return False
+
+
+class BoardHub:
+
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        """
+        :param queue_size: events a subscriber can fall behind by before it is dropped
+        """
+        self.queue_size = queue_size
+        self._subscribers: dict[int, set[Subscription]] = {}
+
+    def subscribe(self, board_id: int) -> Subscription:
+        subscription = Subscription(board_id, self.queue_size)
+        self._subscribers.setdefault(board_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscribers.get(subscription.board_id)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._subscribers[subscription.board_id]
+
+    def subscriber_count(self, board_id: int) -> int:
+        return len(self._subscribers.get(board_id, ()))
+
+    def publish(self, board_id: int, event: dict):
+        """
+        Hand an event to every subscriber of the board, dropping the ones that have fallen too far behind
+        """
+        for subscription in list(self._subscribers.get(board_id, ())):
+            if not subscription.offer(event):
+                self.unsubscribe(subscription)
+
+
+hub = BoardHub()
+
+
+async def stream(websocket: _WebSocket, board_id: int, board_hub: BoardHub = hub,
+                 authorize: _Callable[[], _Awaitable[bool]] | None = None):
+    """
+    Send the board's events to an accepted websocket until the client goes away, falls too far behind or loses
+    access to the board
+    :param websocket:
+    :param board_id:
+    :param board_hub:
+    :param authorize: async () -> whether the client may still see the board, checked before each event
+    """
+    subscription = board_hub.subscribe(board_id)
+
+    async def drain_client():
+        # clients don't send anything, but receiving is how a disconnect is noticed
+        try:
+            while True:
+                await websocket.receive_text()
+        except _WebSocketDisconnect:
+            pass
+
+    client_gone = _asyncio.create_task(drain_client())
+    try:
+        while True:
+            next_event = _asyncio.create_task(subscription.queue.get())
+            done, _ = await _asyncio.wait({next_event, client_gone}, return_when=_asyncio.FIRST_COMPLETED)
+            if client_gone in done:
+                next_event.cancel()
+                return
+            event = next_event.result()
+            if event is None:
+                await websocket.close(code=_status.WS_1013_TRY_AGAIN_LATER)
+                return
+            if authorize is not None and not await authorize():
+                await websocket.close(code=_status.WS_1008_POLICY_VIOLATION)
+                return
+            await websocket.send_json(event)
+    finally:
+        board_hub.unsubscribe(subscription)
+        client_gone.cancel()
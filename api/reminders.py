@@ -0,0 +1,180 @@
+"""
+Due-date reminders.
+
+ReminderScheduler keeps the reminders due in the next `window` in a heap and hands each one to `deliver` when it
+falls due. It never holds the whole table: reminders are read `batch_size` at a time by a range query on
+(reminder_datetime, card id), ordered like the index, and the next batch is only read once the heap has room and the
+loaded range gets within half a window of now. Memory stays around two batches however many cards there are.
+
+Everything up to `loaded_to` is in the heap, so a card that changes only has to be looked at on its own:
+reschedule() drops its old entry and pushes the new time if that falls in the loaded range; later times are picked up
+by the range query when their turn comes. Dropped entries stay in the heap until they reach the top (or the heap is
+compacted) and are skipped by comparing against the card's current time.
+
+On start the range begins `catch_up` in the past, so reminders that fell due while the process was down are still
+sent. Delivery must be idempotent for that, and because several processes may each run a scheduler.
+"""
+import asyncio as _asyncio
+import datetime as _dt
+import heapq as _heapq
+import logging as _logging
+import os as _os
+import sys as _sys
+from typing import Awaitable as _Awaitable, Callable as _Callable
+
+REMINDER_WINDOW = _dt.timedelta(seconds=float(_os.environ.get("REMINDER_WINDOW_SECONDS", "3600")))
+REMINDER_BATCH_SIZE = int(_os.environ.get("REMINDER_BATCH_SIZE", "1000"))
+REMINDER_CATCH_UP = _dt.timedelta(seconds=float(_os.environ.get("REMINDER_CATCH_UP_SECONDS", "300")))
+
+_logger = _logging.getLogger(__name__)
+
+# (reminder time, card id)
+Key = tuple[_dt.datetime, int]
+# greater than any card id, so (t, _LAST) sorts after every reminder at t
+_LAST = _sys.maxsize
+
+
+class ReminderScheduler:
+
+    def __init__(self, load: _Callable[[Key, _dt.datetime, int], _Awaitable[list[Key]]],
+                 deliver: _Callable[[int, _dt.datetime], _Awaitable], window: _dt.timedelta = REMINDER_WINDOW,
+                 batch_size: int = REMINDER_BATCH_SIZE, catch_up: _dt.timedelta = REMINDER_CATCH_UP,
+                 clock: _Callable[[], _dt.datetime] = _dt.datetime.now):
+        """
+        :param load: async (after, until, limit) -> up to `limit` keys of active cards with after < key and
+            time <= until, in key order
+        :param deliver: async (card_id, reminder time), called once the reminder is due
+        :param window: how far ahead reminders are loaded
+        :param batch_size: keys per load, and the heap size above which no more are loaded
+        :param catch_up: how far back the first load starts
+        :param clock: current local time
+        """
+        self.load = load
+        self.deliver = deliver
+        self.window = window
+        self.batch_size = batch_size
+        self.catch_up = catch_up
+        self.clock = clock
+        self._heap = []
+        # card id -> reminder time of its live heap entry
+        self._scheduled = {}
+        # every reminder with a key up to this one is in the heap or already delivered; None until started
+        self.loaded_to = None
+        self._wakeup = _asyncio.Event()
+        self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def __len__(self):
+        return len(self._scheduled)
+
+    def reset(self):
+        """
+        Forget everything, so the next tick() loads from `catch_up` ago
+        """
+        self._heap, self._scheduled = [], {}
+        self.loaded_to = (self.clock() - self.catch_up, 0)
+
+    def reschedule(self, card_id: int, when: _dt.datetime | None):
+        """
+        The card's reminder is now `when`, or it has none (cleared, archived or deleted). Call it after the change
+        has committed.
+        """
+        if self.loaded_to is None:
+            return
+        self._scheduled.pop(card_id, None)
+        if when is not None and (when, card_id) <= self.loaded_to:
+            self._push(card_id, when)
+        self._wakeup.set()
+
+    def _push(self, card_id: int, when: _dt.datetime):
+        self._scheduled[card_id] = when
+        _heapq.heappush(self._heap, (when, card_id))
+        if len(self._heap) > 2 * len(self._scheduled) + self.batch_size:
+            # mostly dropped entries: rebuild from the live ones
+            self._heap = [(when, card_id) for card_id, when in self._scheduled.items()]
+            _heapq.heapify(self._heap)
+
+    def _needs_load(self, now: _dt.datetime) -> bool:
+        return len(self._scheduled) < self.batch_size and self.loaded_to[0] < now + self.window / 2
+
+    async def _load(self, now: _dt.datetime):
+        until = now + self.window
+        keys = await self.load(self.loaded_to, until, self.batch_size)
+        for when, card_id in keys:
+            # a reschedule may have got there first
+            if card_id not in self._scheduled:
+                self._push(card_id, when)
+        self.loaded_to = keys[-1] if len(keys) == self.batch_size else (until, _LAST)
+
+    async def tick(self) -> int:
+        """
+        Load the next batch if there is room and deliver the reminders that are due
+        :return: number of reminders delivered
+        """
+        if self.loaded_to is None:
+            self.reset()
+        now = self.clock()
+        if self._needs_load(now):
+            await self._load(now)
+        delivered = 0
+        while self._heap and self._heap[0][0] <= now:
+            when, card_id = _heapq.heappop(self._heap)
+            if self._scheduled.get(card_id) != when:
+                continue
+            del self._scheduled[card_id]
+            try:
+                await self.deliver(card_id, when)
+                delivered += 1
+            except Exception:
+                _logger.exception("Delivering the reminder for card %s failed", card_id)
+        return delivered
+
+    def _seconds_to_next(self) -> float:
+        now = self.clock()
+        if self._needs_load(now):
+            return 0
+        wake_at = self.loaded_to[0] - self.window / 2
+        if self._heap:
+            wake_at = min(wake_at, self._heap[0][0])
+        return min(max((wake_at - now).total_seconds(), 0), self.window.total_seconds())
+
+    async def _run(self):
+        while True:
+            try:
+                await self.tick()
+            except Exception:
+                _logger.exception("Loading reminders failed, retrying")
+                await _asyncio.sleep(min(self.window.total_seconds(), 30))
+            try:
+                await _asyncio.wait_for(self._wakeup.wait(), self._seconds_to_next())
+            except _asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self):
+        """
+        Start delivering in the background; must be called from the running event loop
+        """
+        if self.running:
+            return
+        self.reset()
+        # the loop at startup may not be the one the scheduler was created in
+        self._wakeup = _asyncio.Event()
+        self._task = _asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop delivering; reminders due later are picked up by the next start, within `catch_up`
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except _asyncio.CancelledError:
+                pass
+            self._task = None
+        self._heap, self._scheduled = [], {}
+        self.loaded_to = None
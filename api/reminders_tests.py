@@ -0,0 +1,107 @@
+import asyncio
+import datetime as dt
+import unittest
+from api.reminders import ReminderScheduler
+
+START = dt.datetime(2023, 6, 1, 9, 0)
+
+
+class FakeCards:
+    """
+    Cards table stand-in: card id -> reminder time, loaded the way get_upcoming_reminders reads it
+    """
+
+    def __init__(self, reminders):
+        self.reminders = dict(reminders)
+        self.loads = 0
+
+    async def load(self, after, until, limit):
+        self.loads += 1
+        keys = sorted((when, card_id) for card_id, when in self.reminders.items())
+        return [key for key in keys if after < key and key[0] <= until][:limit]
+
+
+class TestReminderScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.now = START
+        self.delivered = []
+
+    def scheduler(self, cards, **kwargs):
+        async def deliver(card_id, when):
+            self.delivered.append((card_id, when))
+
+        kwargs = {"window": dt.timedelta(hours=1), "batch_size": 10, "catch_up": dt.timedelta(minutes=5), **kwargs}
+        scheduler = ReminderScheduler(load=cards.load, deliver=deliver, clock=lambda: self.now, **kwargs)
+        scheduler.reset()
+        return scheduler
+
+    def advance(self, scheduler, minutes):
+        self.now += dt.timedelta(minutes=minutes)
+        return asyncio.run(scheduler.tick())
+
+    def test_delivers_in_order_with_a_small_working_set(self):
+        # 500 reminders over ~4 hours, starting before the catch-up window
+        cards = FakeCards({card_id: START + dt.timedelta(seconds=30 * card_id - 600) for card_id in range(1, 501)})
+        scheduler = self.scheduler(cards)
+        for _ in range(300):
+            self.advance(scheduler, 1)
+            self.assertLessEqual(len(scheduler), 2 * scheduler.batch_size)
+        expected = [(card_id, when) for card_id, when in sorted(cards.reminders.items())
+                    if when >= START - scheduler.catch_up]
+        self.assertEqual(self.delivered, expected)
+
+    def test_reschedule(self):
+        cards = FakeCards({1: START + dt.timedelta(minutes=30), 2: START + dt.timedelta(minutes=40),
+                           3: START + dt.timedelta(minutes=50)})
+        scheduler = self.scheduler(cards)
+        self.advance(scheduler, 0)
+        loads = cards.loads
+
+        # earlier, cleared, and moved past what is loaded
+        scheduler.reschedule(1, START + dt.timedelta(minutes=10))
+        scheduler.reschedule(2, None)
+        cards.reminders[3] = START + dt.timedelta(hours=3)
+        scheduler.reschedule(3, cards.reminders[3])
+        del cards.reminders[2]
+        self.assertEqual(len(scheduler), 1)
+
+        self.advance(scheduler, 15)
+        self.assertEqual(self.delivered, [(1, START + dt.timedelta(minutes=10))])
+        # no rescan for any of it
+        self.assertEqual(cards.loads, loads)
+        self.advance(scheduler, 60)
+        self.assertEqual(len(self.delivered), 1)
+
+        # card 3 comes back with the range query once its time is near
+        for _ in range(12):
+            self.advance(scheduler, 10)
+        self.assertEqual(self.delivered[1:], [(3, START + dt.timedelta(hours=3))])
+
+    def test_same_time_across_batches(self):
+        when = START + dt.timedelta(minutes=1)
+        cards = FakeCards({card_id: when for card_id in range(1, 26)})
+        scheduler = self.scheduler(cards, batch_size=10)
+        for _ in range(5):
+            self.advance(scheduler, 1)
+        self.assertEqual([card_id for card_id, _ in self.delivered], list(range(1, 26)))
+
+    def test_failed_delivery_does_not_stop_others(self):
+        cards = FakeCards({1: START, 2: START})
+
+        async def deliver(card_id, when):
+            if card_id == 1:
+                raise RuntimeError("down")
+            self.delivered.append((card_id, when))
+
+        scheduler = self.scheduler(cards)
+        scheduler.deliver = deliver
+        with self.assertLogs("api.reminders", "ERROR"):
+            self.advance(scheduler, 0)
+            self.advance(scheduler, 1)
+        self.assertEqual(self.delivered, [(2, START)])
+
+    def test_reschedule_before_start_is_ignored(self):
+        scheduler = ReminderScheduler(load=FakeCards({}).load, deliver=None)
+        scheduler.reschedule(1, START)
+        self.assertEqual(len(scheduler), 0)
@@ -0,0 +1,135 @@
+"""
+Routing reads to a replica.
+
+When REPLICA_DATABASE_URL is set, GET endpoints read through get_read_db (api/database.py), which opens a session on
+the replica instead of the primary. Replicas lag behind, so a client that has just made a change would not see it:
+after a successful mutation its credentials are remembered for REPLICA_STICKY_SECONDS, and its reads stay on the
+primary until then, or until the local replica has synced past the write. Stickiness is kept per process; with
+several nodes, route a client to the same node or keep the window above the replica's lag.
+
+A second SQLite file works as a local stand-in for the replica: ReplicaSync copies the primary into it every
+REPLICA_SYNC_INTERVAL seconds with SQLite's online backup, which copies the whole database. That is fine for a
+local setup; a real deployment replicates with the database's own tooling and leaves REPLICA_SYNC_INTERVAL at 0.
+"""
+import asyncio as _asyncio
+import logging as _logging
+import os as _os
+import sqlite3 as _sqlite3
+import time as _time
+
+import anyio as _anyio
+from fastapi import Request as _Request
+from sqlalchemy.engine import make_url as _make_url
+
+from api.cache import TTLCache as _TTLCache
+
+REPLICA_DATABASE_URL = _os.environ.get("REPLICA_DATABASE_URL")
+REPLICA_STICKY_SECONDS = float(_os.environ.get("REPLICA_STICKY_SECONDS", "10"))
+REPLICA_SYNC_INTERVAL = float(_os.environ.get("REPLICA_SYNC_INTERVAL", "1"))
+
+_SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+_logger = _logging.getLogger(__name__)
+
+
+def sqlite_path(url: str) -> str | None:
+    """
+    File path of a SQLite url, None for other databases and in-memory SQLite
+    """
+    url = _make_url(url)
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        return None
+    return url.database
+
+
+class ReplicaSync:
+
+    def __init__(self, primary_path: str, replica_path: str, interval: float):
+        """
+        :param primary_path: SQLite file to copy from
+        :param replica_path: SQLite file to copy into
+        :param interval: seconds between copies
+        """
+        self.primary_path = primary_path
+        self.replica_path = replica_path
+        self.interval = interval
+        # monotonic time the last finished copy started at: every write committed before it is on the replica
+        self.synced_at = None
+        self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def _copy(self):
+        started_at = _time.monotonic()
+        primary = _sqlite3.connect(self.primary_path)
+        replica = _sqlite3.connect(self.replica_path)
+        try:
+            primary.backup(replica)
+        finally:
+            replica.close()
+            primary.close()
+        self.synced_at = started_at
+
+    async def sync(self):
+        """
+        Copy the primary into the replica now
+        """
+        await _anyio.to_thread.run_sync(self._copy)
+
+    async def _run(self):
+        while True:
+            await _asyncio.sleep(self.interval)
+            try:
+                await self.sync()
+            except Exception:
+                _logger.exception("Syncing the replica %s failed, retrying", self.replica_path)
+
+    async def start(self):
+        """
+        Copy the primary once, then keep copying in the background; must be called from the running event loop
+        """
+        if self.running:
+            return
+        await self.sync()
+        self._task = _asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except _asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# credentials -> monotonic time of the client's last committed mutation
+recent_writes = _TTLCache(maxsize=10000, ttl=REPLICA_STICKY_SECONDS)
+replica_sync: ReplicaSync | None = None
+
+
+def _client_key(request: _Request) -> str | None:
+    return request.headers.get("authorization")
+
+
+def record_write(request: _Request):
+    """
+    Remember that the client behind `request` just committed a change, if the request was a mutation
+    """
+    key = _client_key(request)
+    if key is not None and request.method not in _SAFE_METHODS:
+        recent_writes.set(key, _time.monotonic())
+
+
+def reads_primary(request: _Request) -> bool:
+    """
+    Whether the client behind `request` has to read from the primary to see its own recent changes
+    """
+    key = _client_key(request)
+    written_at = recent_writes.get(key) if key is not None else None
+    if written_at is None:
+        return False
+    # with the local stand-in we know exactly when the replica has caught up
+    return replica_sync is None or replica_sync.synced_at is None or replica_sync.synced_at < written_at
@@ -0,0 +1,75 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from api.main import app
+from api import database, engine_profile, replica
+
+client = TestClient(app)
+
+
+class TestReplicaReads(unittest.TestCase):
+    email = "test3@gmail.com"
+    password = "password123"
+    username = "Test User"
+
+    database.create_db()
+
+    def setUp(self):
+        client.post("/users/create_user", json={"email": self.email, "password": self.password,
+                                                "username": self.username})
+        token = client.post("/users/token", data={"username": self.email, "password": self.password}).json()
+        self.headers = {"Authorization": f"Bearer {token['access_token']}"}
+        self.board = client.post("/boards/create_board", json={"name": "Replica board", "is_public": True},
+                                 headers=self.headers).json()
+
+        # a stand-in replica, synced before any list exists on the board
+        self.workdir = tempfile.mkdtemp()
+        replica_url = f"sqlite+aiosqlite:///{os.path.join(self.workdir, 'replica.db')}"
+        self.sync = replica.ReplicaSync(replica.sqlite_path(database.ASYNC_DATABASE_URL),
+                                        replica.sqlite_path(replica_url), interval=0)
+        asyncio.run(self.sync.sync())
+        self.replica_engine = engine_profile.create_async_engine(replica_url, database.ENGINE_PROFILE)
+        database.ReplicaSessionLocal = async_sessionmaker(bind=self.replica_engine, expire_on_commit=False)
+        replica.replica_sync = self.sync
+
+    def tearDown(self):
+        database.ReplicaSessionLocal = None
+        replica.replica_sync = None
+        replica.recent_writes.clear()
+        asyncio.run(self.replica_engine.dispose())
+        shutil.rmtree(self.workdir)
+
+    def create_list(self, name):
+        response = client.post(f"/lists/{self.board['id']}/create_list", json={"name": name, "position": 0},
+                               headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+
+    def list_names(self):
+        response = client.get(f"/lists/{self.board['id']}", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return [board_list["name"] for board_list in response.json()]
+
+    def test_client_reads_its_own_writes(self):
+        self.create_list("First")
+        self.assertEqual(self.list_names(), ["First"])
+
+    def test_reads_go_to_the_replica(self):
+        self.create_list("First")
+        replica.recent_writes.clear()
+        # the replica was copied before the list was created
+        self.assertEqual(self.list_names(), [])
+        asyncio.run(self.sync.sync())
+        self.assertEqual(self.list_names(), ["First"])
+
+    def test_stickiness_ends_once_the_replica_has_synced(self):
+        self.create_list("First")
+        asyncio.run(self.sync.sync())
+        self.create_list("Second")
+        self.assertEqual(self.list_names(), ["First", "Second"])
+        asyncio.run(self.sync.sync())
+        self.assertLess(replica.recent_writes.get(self.headers["Authorization"]), self.sync.synced_at)
+        self.assertEqual(self.list_names(), ["First", "Second"])
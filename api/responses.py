@@ -0,0 +1,14 @@
+"""
+The app's default JSON response class.
+
+orjson encodes several times faster than the standard library and is used when it is installed; otherwise responses
+fall back to Starlette's JSONResponse, which produces the same compact JSON.
+"""
+from fastapi.responses import JSONResponse as _JSONResponse, ORJSONResponse as _ORJSONResponse
+
+try:
+    import orjson as _orjson
+except ImportError:  # pragma: no cover
+    _orjson = None
+
+JSONResponse = _ORJSONResponse if _orjson is not None else _JSONResponse
@@ -0,0 +1,26 @@
+from fastapi import APIRouter as _APIRouter, Depends as _Depends, Query as _Query, Response as _Response
+from . import search_services as _search_services
+from . import search_schemas as _search_schemas
+from ..users.user_services import get_current_user as _get_current_user
+from ..users import user_schemas as _user_schemas
+from ..database import get_read_db as _get_read_db, UnitOfWorkRoute as _UnitOfWorkRoute
+from .. import pagination as _pagination
+from sqlalchemy.ext.asyncio import AsyncSession as _AsyncSession
+
+router = _APIRouter(
+    prefix="/search",
+    tags=["search"],
+    route_class=_UnitOfWorkRoute,
+)
+
+
+@router.get("", response_model=list[_search_schemas.SearchResult])
+async def search(response: _Response, q: str = _Query(..., min_length=1, max_length=200),
+                 board_id: int | None = None,
+                 page_params: _pagination.PageParams = _Depends(_pagination.page_params),
+                 db: _AsyncSession = _Depends(_get_read_db),
+                 current_user: _user_schemas.User = _Depends(_get_current_user)):
+    page = await _search_services.search(db=db, user_id=current_user.id, query=q, params=page_params,
+                                         board_id=board_id)
+    _pagination.set_next_cursor(response, page)
+    return page.items
@@ -0,0 +1,14 @@
+import pydantic as _pydantic
+
+
+class SearchResult(_pydantic.BaseModel):
+    # "card" or "comment"
+    entity: str
+    # id of the card or comment
+    id: int
+    card_id: int
+    card_title: str | None
+    list_id: int
+    board_id: int
+    # HTML-escaped text around the match, matched words wrapped in <mark></mark>
+    snippet: str
@@ -0,0 +1,90 @@
+"""
+Full-text search over card titles, card descriptions and comments.
+
+The FTS5 table search_index is kept in sync with cards and comments by triggers (migration 5), so every write path,
+including ones that bypass the ORM, is indexed in the same transaction. Results are ranked with bm25, title matches
+weighing TITLE_WEIGHT times as much as body matches, and only come from boards the user can see: public ones and
+ones they are a member of. Pages are read by (rank, rowid) keyset, like every other collection.
+"""
+import html as _html
+import re as _re
+
+from sqlalchemy import column as _column, func as _func, literal_column as _literal_column, or_ as _or_, \
+    select as _select, table as _table
+from sqlalchemy.ext.asyncio import AsyncSession as _AsyncSession
+
+from api import pagination as _pagination
+from ..boards import board_models as _board_models
+from ..cards import card_models as _card_models
+from ..lists import list_models as _list_models
+from . import search_schemas as _search_schemas
+
+TITLE_WEIGHT = 10.0
+SNIPPET_WORDS = 12
+
+# not part of Base.metadata: create_all can't build FTS5 tables, migration 5 does
+_search_index = _table("search_index", _column("rowid"), _column("title"), _column("body"), _column("entity"),
+                       _column("card_id"))
+_index = _literal_column("search_index")
+
+# snippet() can't escape HTML, so matches are marked with control characters and swapped for tags after escaping
+_MARK_START, _MARK_END = "\x02", "\x03"
+
+
+def match_expression(query: str) -> str | None:
+    """
+    FTS5 query that matches every word of `query`, the last one as a prefix so results show up while typing.
+    Only words are kept, so nothing the user types is read as FTS5 syntax.
+    :return: the expression, or None if `query` has no words
+    """
+    terms = [f'"{term}"' for term in _re.findall(r"\w+", query)]
+    if not terms:
+        return None
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def _snippet(text: str) -> str:
+    return _html.escape(text).replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>")
+
+
+async def search(db: _AsyncSession, user_id: int, query: str, params: _pagination.PageParams,
+                 board_id: int | None = None):
+    """
+    Cards and comments matching `query` on boards the user can see, best match first
+    :param db: async session
+    :param user_id: the user searching
+    :param query: words to look for
+    :param params: cursor and page size
+    :param board_id: only search this board
+    :return: Page of SearchResult
+    """
+    match = match_expression(query)
+    if match is None:
+        return _pagination.Page(items=[], next_cursor=None)
+
+    visible_boards = _select(_board_models.BoardMember.board_id).filter(_board_models.BoardMember.user_id == user_id)
+    hits = _select(_search_index.c.rowid.label("rowid"), _search_index.c.entity.label("entity"),
+                   _search_index.c.card_id.label("card_id"),
+                   _func.bm25(_index, TITLE_WEIGHT, 1.0).label("rank"),
+                   _func.snippet(_index, -1, _MARK_START, _MARK_END, "…", SNIPPET_WORDS).label("snippet"),
+                   _card_models.Card.title.label("card_title"), _card_models.Card.list_id.label("list_id"),
+                   _list_models.List.board_id.label("board_id")) \
+        .select_from(_search_index) \
+        .join(_card_models.Card, _card_models.Card.id == _search_index.c.card_id) \
+        .join(_list_models.List, _list_models.List.id == _card_models.Card.list_id) \
+        .join(_board_models.Board, _board_models.Board.id == _list_models.List.board_id) \
+        .filter(_index.op("MATCH")(match)) \
+        .filter(_or_(_board_models.Board.is_public == True, _board_models.Board.id.in_(visible_boards))) \
+        .filter(_board_models.Board.deleted_at.is_(None))
+    if board_id is not None:
+        hits = hits.filter(_list_models.List.board_id == board_id)
+    # rank is only known once the FTS5 query has run, so the keyset filter goes on the outside
+    hits = hits.subquery()
+    page = await _pagination.paginate(db, _select(hits), order_by=[hits.c.rank, hits.c.rowid],
+                                      key=lambda hit: (hit.rank, hit.rowid), params=params, rows=True)
+    return page._replace(items=[
+        _search_schemas.SearchResult(entity=hit.entity, id=hit.rowid // 2, card_id=hit.card_id,
+                                     card_title=hit.card_title, list_id=hit.list_id, board_id=hit.board_id,
+                                     snippet=_snippet(hit.snippet or ""))
+        for hit in page.items])
@@ -0,0 +1,95 @@
+import unittest
+import uuid
+from fastapi.testclient import TestClient
+from api.main import app
+from api.search import search_services
+
+client = TestClient(app)
+
+
+class TestSearch(unittest.TestCase):
+    email = "test3@gmail.com"
+    password = "password123"
+    username = "Test User"
+
+    from api.database import create_db as _create_db
+    _create_db()
+
+    def setUp(self):
+        self.headers = self.login(self.email)
+        # a word no other test uses, so results only come from this test
+        self.word = "w" + uuid.uuid4().hex[:12]
+        self.board = self.create_board(self.headers, is_public=False)
+        self.list = client.post(f"/lists/{self.board['id']}/create_list", json={"name": "List", "position": 0},
+                                headers=self.headers).json()
+
+    def login(self, email):
+        client.post("/users/create_user", json={"email": email, "password": self.password,
+                                                "username": self.username})
+        response = client.post("/users/token", data={"username": email, "password": self.password})
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    def create_board(self, headers, is_public):
+        return client.post("/boards/create_board", json={"name": "Search board", "is_public": is_public},
+                           headers=headers).json()
+
+    def create_card(self, title, description="Description", board=None, list_data=None, headers=None):
+        board, list_data = board or self.board, list_data or self.list
+        return client.post(f"/cards/{board['id']}/{list_data['id']}/create_card",
+                           json={"title": title, "description": description}, headers=headers or self.headers).json()
+
+    def search(self, q, headers=None, **params):
+        response = client.get("/search", params={"q": q, **params}, headers=headers or self.headers)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_cards_and_comments_ranked(self):
+        in_description = self.create_card("Other", description=f"mentions {self.word} once")
+        in_title = self.create_card(f"Fix {self.word} <now>")
+        comment = client.post(f"/comments/{self.board['id']}/{self.list['id']}/{in_description['id']}/create_comment",
+                              json={"comment": f"about {self.word}"}, headers=self.headers).json()
+
+        results = self.search(self.word.upper()).json()
+        self.assertEqual(results[0], {"entity": "card", "id": in_title["id"], "card_id": in_title["id"],
+                                      "card_title": in_title["title"], "list_id": self.list["id"],
+                                      "board_id": self.board["id"],
+                                      "snippet": f"Fix <mark>{self.word}</mark> &lt;now&gt;"})
+        self.assertEqual({(result["entity"], result["id"]) for result in results[1:]},
+                         {("card", in_description["id"]), ("comment", comment["id"])})
+        # the last word is a prefix
+        self.assertEqual(len(self.search(self.word[:-3]).json()), 3)
+
+    def test_index_follows_writes(self):
+        card = self.create_card(f"Old {self.word}")
+        client.put(f"/cards/{self.board['id']}/{self.list['id']}/{card['id']}/update_card_basics",
+                   json={"title": f"New {self.word}"}, headers=self.headers)
+        self.assertEqual([result["snippet"] for result in self.search(self.word).json()],
+                         [f"New <mark>{self.word}</mark>"])
+        client.delete(f"/cards/{self.board['id']}/{self.list['id']}/{card['id']}/delete_card", headers=self.headers)
+        self.assertEqual(self.search(self.word).json(), [])
+
+    def test_private_boards_of_others_are_hidden(self):
+        other_headers = self.login("test3_search_other@gmail.com")
+        other_board = self.create_board(other_headers, is_public=False)
+        other_list = client.post(f"/lists/{other_board['id']}/create_list", json={"name": "List", "position": 0},
+                                 headers=other_headers).json()
+        self.create_card(self.word, board=other_board, list_data=other_list, headers=other_headers)
+        self.assertEqual(self.search(self.word).json(), [])
+        self.assertEqual(len(self.search(self.word, headers=other_headers).json()), 1)
+
+        client.put(f"/boards/{other_board['id']}", json={"name": "Search board", "is_public": True},
+                   headers=other_headers)
+        self.assertEqual(len(self.search(self.word).json()), 1)
+
+    def test_pages(self):
+        cards = {self.create_card(f"{self.word} {number}")["id"] for number in range(5)}
+        first = self.search(self.word, limit=3)
+        second = self.search(self.word, limit=3, cursor=first.headers["X-Next-Cursor"])
+        self.assertNotIn("X-Next-Cursor", second.headers)
+        self.assertEqual({result["id"] for result in first.json() + second.json()}, cards)
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.create_card(f"{self.word} AND")
+        self.assertEqual(len(self.search(f'"{self.word} (AND').json()), 1)
+        self.assertEqual(self.search('" * ()').json(), [])
+        self.assertEqual(search_services.match_expression("fix the-bug"), '"fix" "the" "bug"*')
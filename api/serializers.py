@@ -0,0 +1,100 @@
+"""
+Serializing collection endpoints straight from projected rows.
+
+Building Schema.from_orm() for every row, then letting FastAPI validate the list again against response_model,
+checks every value twice and loads ORM instances only to throw them away. A RowSerializer is built once per schema:
+it selects just the schema's columns, and turns each row into a JSON-ready dict. The only fields it validates are the
+ones whose stored type differs from the schema's, such as booleans kept as integers; dates and datetimes are only
+encoded. The endpoint hands the dicts to json_response(), which FastAPI sends as is; response_model still documents
+the shape.
+
+Only flat schemas can be serialized this way; endpoints that embed related rows select them with a serializer of
+their own and nest the dicts.
+"""
+import datetime as _dt
+import functools as _functools
+
+import pydantic as _pydantic
+from fastapi import Response as _Response
+from pydantic.json import ENCODERS_BY_TYPE as _ENCODERS_BY_TYPE
+from sqlalchemy import select as _select
+
+from api.responses import JSONResponse as _JSONResponse
+
+
+def _encode(value):
+    encoder = _ENCODERS_BY_TYPE.get(type(value))
+    return encoder(value) if encoder is not None else value
+
+
+def _converter(schema, field: _pydantic.fields.ModelField):
+    @_functools.lru_cache(maxsize=4096)
+    def convert(value):
+        if value is None and field.allow_none:
+            return None
+        value, errors = field.validate(value, {}, loc=field.alias)
+        if errors:
+            raise _pydantic.ValidationError([errors], schema)
+        return _encode(value)
+    return convert
+
+
+class RowSerializer:
+
+    def __init__(self, schema: type[_pydantic.BaseModel], model, exclude: tuple[str, ...] = ()):
+        """
+        :param schema: pydantic schema of the response items; every field must be a column of `model`
+        :param model: ORM model the rows are selected from
+        :param exclude: fields left out, such as nested objects the caller fills in itself
+        """
+        fields = [field for field in schema.__fields__.values() if field.name not in exclude]
+        self.schema = schema
+        self.columns = [getattr(model, field.name) for field in fields]
+        self.names = tuple(field.alias for field in fields)
+        # (name, converter) for the fields whose stored values aren't what the schema sends
+        self.converters = [(field.alias, _encode if _only_encoded(field, column) else _converter(schema, field))
+                           for field, column in zip(fields, self.columns) if not _passes_through(field, column)]
+
+    def select(self):
+        """
+        select() of the schema's columns, to add filters to
+        """
+        return _select(*self.columns)
+
+    def serialize(self, rows) -> list[dict]:
+        """
+        Turn rows from select() into JSON-ready dicts
+        """
+        items = [dict(zip(self.names, row)) for row in rows]
+        for name, convert in self.converters:
+            for item in items:
+                item[name] = convert(item[name])
+        return items
+
+
+def _passes_through(field: _pydantic.fields.ModelField, column) -> bool:
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return False
+    # bool subclasses int, so compare exactly
+    return field.shape == _pydantic.fields.SHAPE_SINGLETON and field.type_ is python_type \
+        and python_type in (int, str, float, bool)
+
+
+def _only_encoded(field: _pydantic.fields.ModelField, column) -> bool:
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return False
+    return field.shape == _pydantic.fields.SHAPE_SINGLETON and field.type_ is python_type \
+        and python_type in (_dt.date, _dt.datetime)
+
+
+def json_response(content, response: _Response) -> _Response:
+    """
+    Response for already serialized content, carrying the headers the endpoint set on `response`
+    """
+    serialized = _JSONResponse(content)
+    serialized.headers.update(response.headers)
+    return serialized
@@ -0,0 +1,38 @@
+import datetime
+import unittest
+import pydantic
+from fastapi.encoders import jsonable_encoder
+import api.main  # noqa: F401  imports the schemas in an order that resolves
+from api.cards import card_models, card_schemas, card_services
+
+
+class TestRowSerializer(unittest.TestCase):
+    serializer = card_services.card_serializer
+
+    def row(self, **values):
+        card = {"id": 1, "list_id": 2, "title": "Title", "description": "Description",
+                "created_date": datetime.date(2023, 6, 1), "is_active": True, "due_date": None,
+                "reminder_datetime": datetime.datetime(2023, 6, 2, 9, 30, 0, 250000), "rank": "i", **values}
+        return tuple(card[name] for name in self.serializer.names)
+
+    def test_matches_from_orm(self):
+        row = self.row()
+        card = card_models.Card(**dict(zip(self.serializer.names, row)))
+        expected = jsonable_encoder(card_schemas.Card.from_orm(card))
+        self.assertEqual(self.serializer.serialize([row]), [expected])
+        self.assertEqual(expected["reminder_datetime"], "2023-06-02T09:30:00.250000")
+
+    def test_converts_only_mismatched_columns(self):
+        self.assertEqual([name for name, _ in self.serializer.converters],
+                         ["created_date", "due_date", "reminder_datetime"])
+        # is_checked is stored as an integer
+        checklist_serializer = card_services._checklist_serializer
+        values = {"title": "Item", "is_checked": 1, "position": 0, "id": 1, "card_id": 2}
+        checklist = checklist_serializer.serialize([tuple(values[name] for name in checklist_serializer.names)])
+        self.assertIs(checklist[0]["is_checked"], True)
+
+    def test_invalid_value(self):
+        checklist_serializer = card_services._checklist_serializer
+        values = {"title": "Item", "is_checked": "maybe", "position": 0, "id": 1, "card_id": 2}
+        with self.assertRaises(pydantic.ValidationError):
+            checklist_serializer.serialize([tuple(values[name] for name in checklist_serializer.names)])
@@ -0,0 +1,180 @@
+"""
+Local, content-addressed blob storage for card attachments.
+
+Uploads are streamed to disk in chunks while being hashed, then moved to blobs/<sha256[:2]>/<sha256>, so the same
+file uploaded twice is stored once. The location saved on an attachment is that relative blob path. Blocking file
+I/O runs in worker threads so large files never hold up the event loop or sit in memory.
+
+ATTACHMENT_STORAGE_DIR sets where blobs live (default ./attachments).
+"""
+import hashlib as _hashlib
+import mimetypes as _mimetypes
+import os as _os
+import re as _re
+import tempfile as _tempfile
+import time as _time
+import typing as _typing
+import urllib.parse as _parse
+
+import anyio as _anyio
+from fastapi import UploadFile as _UploadFile
+from starlette.responses import Response as _Response
+from starlette.types import Receive as _Receive, Scope as _Scope, Send as _Send
+
+ATTACHMENT_STORAGE_DIR = _os.environ.get("ATTACHMENT_STORAGE_DIR", "./attachments")
+CHUNK_SIZE = 1024 * 1024
+# an existing blob reused by an upload is touched; blobs touched this recently are never deleted, because the
+# upload's attachment row may not be committed yet
+BLOB_GRACE_SECONDS = 300
+
+_LOCATION = _re.compile(r"^blobs/([0-9a-f]{2})/\1[0-9a-f]{62}$")
+_RANGE = _re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class StoredBlob(_typing.NamedTuple):
+    location: str
+    digest: str
+    size: int
+
+
+class LocalBlobStorage:
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, location: str) -> str:
+        """
+        Absolute path of a stored blob
+        :param location: relative blob path, as saved on the attachment
+        :return: path on disk
+        :raises FileNotFoundError: if location is not a blob path, e.g. rows saved before blobs were stored
+        """
+        if not _LOCATION.match(location or ""):
+            raise FileNotFoundError(location)
+        return _os.path.join(self.root, location)
+
+    async def size(self, location: str) -> int:
+        blob_path = self.path(location)
+        return await _anyio.to_thread.run_sync(_os.path.getsize, blob_path)
+
+    async def save(self, file: _UploadFile) -> StoredBlob:
+        """
+        Stream an upload into storage, reusing the existing blob if the same content is already stored
+        :param file: uploaded file
+        :return: StoredBlob
+        """
+        temp_dir = _os.path.join(self.root, "tmp")
+        await _anyio.to_thread.run_sync(lambda: _os.makedirs(temp_dir, exist_ok=True))
+        fd, temp_path = await _anyio.to_thread.run_sync(lambda: _tempfile.mkstemp(dir=temp_dir))
+        digest, size = _hashlib.sha256(), 0
+        try:
+            with open(fd, "wb") as temp_file:
+                while chunk := await file.read(CHUNK_SIZE):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    await _anyio.to_thread.run_sync(temp_file.write, chunk)
+            digest = digest.hexdigest()
+            location = f"blobs/{digest[:2]}/{digest}"
+            await _anyio.to_thread.run_sync(self._store, temp_path, self.path(location))
+        finally:
+            if _os.path.exists(temp_path):
+                _os.unlink(temp_path)
+        return StoredBlob(location=location, digest=digest, size=size)
+
+    @staticmethod
+    def _store(temp_path: str, blob_path: str):
+        if _os.path.exists(blob_path):
+            _os.utime(blob_path)
+            return
+        _os.makedirs(_os.path.dirname(blob_path), exist_ok=True)
+        _os.replace(temp_path, blob_path)
+
+    async def delete(self, location: str):
+        """
+        Delete a blob no attachment refers to any more. Recently reused blobs are kept (see BLOB_GRACE_SECONDS).
+        :param location: relative blob path
+        """
+        try:
+            blob_path = self.path(location)
+        except FileNotFoundError:
+            return
+
+        def delete():
+            try:
+                if _time.time() - _os.path.getmtime(blob_path) > BLOB_GRACE_SECONDS:
+                    _os.unlink(blob_path)
+            except FileNotFoundError:
+                pass
+
+        await _anyio.to_thread.run_sync(delete)
+
+
+storage = LocalBlobStorage(ATTACHMENT_STORAGE_DIR)
+
+
+def parse_range(header: str | None, size: int) -> tuple[int, int] | None:
+    """
+    Parse a single byte range
+    :param header: Range header value
+    :param size: file size
+    :return: inclusive (start, end), None to send the whole file
+    :raises ValueError: if the range can't be satisfied
+    """
+    match = _RANGE.match(header or "")
+    # no header, multiple ranges or another unit: the whole file is a valid answer
+    if not match or match.groups() == ("", ""):
+        return None
+    start, end = match.groups()
+    if start == "":
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        raise ValueError(header)
+    return start, end
+
+
+class RangeFileResponse(_Response):
+    """
+    Serves a file, or one byte range of it, without reading it into memory.
+    Uses the ASGI zero-copy send extension (sendfile) when the server offers it and streams chunks read in a worker
+    thread otherwise.
+    """
+    chunk_size = CHUNK_SIZE
+
+    def __init__(self, path: str, size: int, filename: str, byte_range: tuple[int, int] | None = None,
+                 etag: str | None = None):
+        self.path = path
+        self.start, self.end = byte_range or (0, size - 1)
+        media_type = _mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        headers = {
+            "accept-ranges": "bytes",
+            "content-length": str(self.end - self.start + 1),
+            "content-disposition": f"attachment; filename*=utf-8''{_parse.quote(filename)}",
+        }
+        if byte_range:
+            headers["content-range"] = f"bytes {self.start}-{self.end}/{size}"
+        if etag:
+            headers["etag"] = f'"{etag}"'
+        super().__init__(status_code=206 if byte_range else 200, headers=headers, media_type=media_type)
+
+    async def __call__(self, scope: _Scope, receive: _Receive, send: _Send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"] == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        count = self.end - self.start + 1
+        file = await _anyio.to_thread.run_sync(open, self.path, "rb")
+        with file:
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopysend", "file": file.fileno(), "offset": self.start,
+                            "count": count, "more_body": False})
+                return
+            await _anyio.to_thread.run_sync(file.seek, self.start)
+            more_body = True
+            while more_body:
+                chunk = await _anyio.to_thread.run_sync(file.read, min(self.chunk_size, count)) if count else b""
+                count -= len(chunk)
+                more_body = bool(chunk) and count > 0
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
@@ -0,0 +1,42 @@
+"""
+Server-side defaults for Date and DateTime columns.
+
+The app works in naive local time, so the database's defaults have to be local too: SQLite's CURRENT_TIMESTAMP is
+UTC. On SQLite the values are formatted the way SQLAlchemy stores Date and DateTime, so rows inserted with the
+default sort and compare correctly against rows inserted by the app. Models also keep a Python default, which the ORM
+uses; the server default covers rows inserted any other way.
+"""
+from sqlalchemy import Date as _Date, DateTime as _DateTime
+from sqlalchemy.ext.compiler import compiles as _compiles
+from sqlalchemy.sql.functions import FunctionElement as _FunctionElement
+
+
+class local_now(_FunctionElement):
+    type = _DateTime()
+    inherit_cache = True
+
+
+class local_today(_FunctionElement):
+    type = _Date()
+    inherit_cache = True
+
+
+@_compiles(local_now)
+def _compile_local_now(element, compiler, **kw):
+    return "LOCALTIMESTAMP"
+
+
+@_compiles(local_now, "sqlite")
+def _compile_local_now_sqlite(element, compiler, **kw):
+    # %f is seconds with milliseconds; SQLAlchemy writes microseconds
+    return "(strftime('%Y-%m-%d %H:%M:%f000', 'now', 'localtime'))"
+
+
+@_compiles(local_today)
+def _compile_local_today(element, compiler, **kw):
+    return "CURRENT_DATE"
+
+
+@_compiles(local_today, "sqlite")
+def _compile_local_today_sqlite(element, compiler, **kw):
+    return "(date('now', 'localtime'))"
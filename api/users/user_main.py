@@ -1,19 +1,22 @@
 
 from fastapi import APIRouter as _APIRouter, Depends as _Depends, HTTPException as _HTTPException, status as _status, \
-    security as _security
+    security as _security, Response as _Response
 from . import user_services as _user_services
-from ..database import get_db as _get_db
+from ..database import get_async_db as _get_async_db, UnitOfWorkRoute as _UnitOfWorkRoute
+from .. import pagination as _pagination
+from .. import serializers as _serializers
 from . import user_schemas as _user_schemas
-from sqlalchemy.orm import Session as _Session
+from sqlalchemy.ext.asyncio import AsyncSession as _AsyncSession
 
 router = _APIRouter(
     prefix="/users",
     tags=["users"],
+    route_class=_UnitOfWorkRoute,
 )
 
 
 @router.post("/create_user", response_model=_user_schemas.AccessToken)
-async def create_user(user: _user_schemas.UserCreate, db: _Session = _Depends(_get_db)):
+async def create_user(user: _user_schemas.UserCreate, db: _AsyncSession = _Depends(_get_async_db)):
     db_user = await _user_services.get_user_by_email(db=db, email=user.email)
     if db_user:
         raise _HTTPException(status_code=_status.HTTP_400_BAD_REQUEST, detail="Email already registered")
@@ -24,7 +27,7 @@ async def create_user(user: _user_schemas.UserCreate, db: _Session = _Depends(_g
 
 @router.post("/token", response_model=_user_schemas.AccessToken)
 async def login(form_data: _security.OAuth2PasswordRequestForm = _Depends(),
-                db: _Session = _Depends(_get_db)):
+                db: _AsyncSession = _Depends(_get_async_db)):
     user = await _user_services.authenticate_user(email=form_data.username, password=form_data.password, db=db)
     if not user:
         raise _HTTPException(status_code=_status.HTTP_401_UNAUTHORIZED, detail="Invalid Credentials")
@@ -33,18 +36,20 @@ async def login(form_data: _security.OAuth2PasswordRequestForm = _Depends(),
 
 
 @router.get("", response_model=list[_user_schemas.User])
-async def read_users(skip: int = 0, limit: int = 100, db: _Session = _Depends(_get_db)):
-    users = await _user_services.get_users(db=db, skip=skip, limit=limit)
-    return [_user_schemas.User.from_orm(user) for user in users]
+async def read_users(response: _Response, page_params: _pagination.PageParams = _Depends(_pagination.page_params),
+                     db: _AsyncSession = _Depends(_get_async_db)):
+    page = await _user_services.get_users(db=db, params=page_params)
+    _pagination.set_next_cursor(response, page)
+    return _serializers.json_response(page.items, response)
 
 
 @router.get("/me", response_model=_user_schemas.User)
-async def read_users_me(current_user: _user_schemas.User = _Depends(_user_services.get_current_user)):
+async def read_users_me(current_user: _user_schemas.User = _Depends(_user_services.get_fresh_current_user)):
     return current_user
 
 
 @router.get("/{user_id}", response_model=_user_schemas.User)
-async def read_user(user_id: int, db: _Session = _Depends(_get_db)):
+async def read_user(user_id: int, db: _AsyncSession = _Depends(_get_async_db)):
     db_user = await _user_services.get_user_by_id(db=db, user_id=user_id)
     if db_user is None:
         raise _HTTPException(status_code=_status.HTTP_404_NOT_FOUND, detail="User not found")
@@ -53,7 +58,7 @@ async def read_user(user_id: int, db: _Session = _Depends(_get_db)):
 
 # update username
 @router.put("/update_username", response_model=_user_schemas.User)
-async def update_username(user: _user_schemas.UpdateUsername, db: _Session = _Depends(_get_db),
+async def update_username(user: _user_schemas.UpdateUsername, db: _AsyncSession = _Depends(_get_async_db),
                           current_user: _user_schemas.User = _Depends(_user_services.get_current_user)):
     db_user = await _user_services.get_user_by_id(db=db, user_id=current_user.id)
     if db_user is None:
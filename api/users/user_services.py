@@ -1,74 +1,164 @@
-from sqlalchemy.orm import Session as _Session
+import asyncio as _asyncio
+import concurrent.futures as _futures
+import functools as _functools
+import os as _os
+from sqlalchemy import select as _select
+from sqlalchemy.ext.asyncio import AsyncSession as _AsyncSession
 from . import user_models as _user_models
 import email_validator as _email_check
 import passlib.hash as _hash
 from fastapi import HTTPException as _HTTPException, status as _status, Depends as _Depends
 import fastapi.security as _security
 import jwt as _jwt
+import pydantic as _pydantic
 from . import user_schemas as _user_schemas
-from api.database import get_db as _get_db
+from api.database import get_async_db as _get_async_db, after_commit as _after_commit
+from api.cache import TTLCache as _TTLCache
+from api import pagination as _pagination
+from api import serializers as _serializers
 
 _JWT_SECRET = "supersafeandsecuresecrete"
 oauth2_scheme = _security.OAuth2PasswordBearer(tokenUrl="/users/token")
 
+# build the current user straight from the verified token claims instead of loading it on every request
+_AUTH_FROM_CLAIMS = True
+# users loaded for endpoints that need fresh data are reused for this many seconds (0 turns the cache off)
+_USER_CACHE_TTL = 30
+_user_cache = _TTLCache(maxsize=10_000, ttl=_USER_CACHE_TTL)
+_user_serializer = _serializers.RowSerializer(_user_schemas.User, _user_models.User)
 
-async def get_current_user(db: _Session = _Depends(_get_db), token: str = _Depends(oauth2_scheme)):
+# bcrypt is slow on purpose, so hashing runs on a bounded thread pool rather than on the event loop.
+# bcrypt releases the GIL while it works, so concurrent logins spread across cores. The cost only applies to new
+# hashes; existing ones keep the rounds they were made with.
+_BCRYPT_ROUNDS = int(_os.environ.get("BCRYPT_ROUNDS", "12"))
+_HASH_WORKERS = _os.cpu_count() or 1
+# hashing jobs allowed in flight at once; a burst of logins waits here instead of queueing unbounded work in the pool
+_HASH_MAX_CONCURRENCY = _HASH_WORKERS * 2
+_bcrypt = _hash.bcrypt.using(rounds=_BCRYPT_ROUNDS)
+_hash_executor = _futures.ThreadPoolExecutor(max_workers=_HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_semaphore = _asyncio.Semaphore(_HASH_MAX_CONCURRENCY)
+
+
+async def _run_hashing(func, *args):
+    async with _hash_semaphore:
+        return await _asyncio.get_running_loop().run_in_executor(_hash_executor, func, *args)
+
+
+async def hash_password(password: str) -> str:
+    return await _run_hashing(_bcrypt.hash, password)
+
+
+async def verify_password(password: str, hashed_password: str) -> bool:
+    return await _run_hashing(_bcrypt.verify, password, hashed_password)
+
+
+def _decode_token(token: str) -> dict:
     try:
-        payload = _jwt.decode(token, _JWT_SECRET, algorithms=["HS256"])
-        user = db.get(_user_models.User, payload["id"])
-    except _HTTPException:
+        return _jwt.decode(token, _JWT_SECRET, algorithms=["HS256"])
+    except _jwt.PyJWTError:
         raise _HTTPException(status_code=_status.HTTP_401_UNAUTHORIZED, detail="Invalid Email or Password")
 
-    return _user_schemas.User.from_orm(user)
+
+async def _get_cached_user(db: _AsyncSession, user_id: int) -> _user_schemas.User:
+    user = _user_cache.get(user_id)
+    if user is None:
+        db_user = await get_user_by_id(db=db, user_id=user_id)
+        if db_user is None:
+            raise _HTTPException(status_code=_status.HTTP_401_UNAUTHORIZED, detail="Invalid Email or Password")
+        user = _user_schemas.User.from_orm(db_user)
+        _user_cache.set(user_id, user)
+    return user
+
+
+async def get_current_user(db: _AsyncSession = _Depends(_get_async_db), token: str = _Depends(oauth2_scheme)):
+    """
+    Get the authenticated user from the token claims without touching the database.
+    Username and email may lag behind a rename until the user gets a new token; use get_fresh_current_user
+    where that matters.
+    """
+    payload = _decode_token(token)
+    if _AUTH_FROM_CLAIMS:
+        try:
+            return _user_schemas.User.parse_obj(payload)
+        except _pydantic.ValidationError:
+            # tokens issued before signup_date was added to the claims
+            pass
+    return await _get_cached_user(db=db, user_id=payload["id"])
 
 
-async def get_user_by_email(db: _Session, email: str):
-    return db.query(_user_models.User).filter(_user_models.User.email == email).first()
+async def get_fresh_current_user(db: _AsyncSession = _Depends(_get_async_db),
+                                 token: str = _Depends(oauth2_scheme)):
+    """
+    Get the authenticated user as stored, at most _USER_CACHE_TTL seconds old
+    """
+    payload = _decode_token(token)
+    return await _get_cached_user(db=db, user_id=payload["id"])
 
 
-async def create_user(db: _Session, user: _user_schemas.UserCreate):
+async def get_user_by_email(db: _AsyncSession, email: str):
+    return await db.scalar(_select(_user_models.User).filter(_user_models.User.email == email))
+
+
+async def create_user(db: _AsyncSession, user: _user_schemas.UserCreate):
     try:
         valid_email = _email_check.validate_email(email=user.email)
         email = valid_email.email
     except _email_check.EmailNotValidError as e:
         raise _HTTPException(status_code=_status.HTTP_400_BAD_REQUEST, detail=str(e))
 
-    db_user = _user_models.User(email=email, hashed_password=_hash.bcrypt.hash(user.password),
+    db_user = _user_models.User(email=email, hashed_password=await hash_password(user.password),
                                 username=user.username)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.flush()
     return db_user
 
 
 async def create_token(user: _user_models.User):
     user_obj = _user_schemas.User.from_orm(user)
     user_dict = user_obj.dict()
-    del user_dict["signup_date"]
+    # every User field is a claim, so get_current_user can rebuild the user without a query
+    user_dict["signup_date"] = user_obj.signup_date.isoformat()
     token = _jwt.encode(user_dict, _JWT_SECRET)
     return _user_schemas.AccessToken(access_token=token, token_type="bearer")
 
 
-async def authenticate_user(email: str, password: str, db: _Session):
+async def authenticate_user(email: str, password: str, db: _AsyncSession):
     user = await get_user_by_email(db=db, email=email)
     if not user:
         return False
-    if not user.verify_password(password):
+    if not await verify_password(password, user.hashed_password):
         return False
     return user
 
 
-async def get_users(db: _Session, skip: int = 0, limit: int = 100):
-    return db.query(_user_models.User).offset(skip).limit(limit).all()
+async def get_users(db: _AsyncSession, params: _pagination.PageParams):
+    """
+    A page of users, serialized like User
+    """
+    page = await _pagination.paginate(db, _user_serializer.select(), order_by=[_user_models.User.id],
+                                      key=lambda user: (user.id,), params=params, rows=True)
+    return page._replace(items=_user_serializer.serialize(page.items))
+
+
+async def get_users_by_ids(db: _AsyncSession, user_ids):
+    """
+    Users serialized like User
+    :return: {user_id: user}
+    """
+    if not user_ids:
+        return {}
+    users = _user_serializer.serialize(await db.execute(_user_serializer.select().filter(
+        _user_models.User.id.in_(user_ids))))
+    return {user["id"]: user for user in users}
 
 
-async def get_user_by_id(db: _Session, user_id: int):
-    return db.get(_user_models.User, user_id)
+async def get_user_by_id(db: _AsyncSession, user_id: int):
+    return await db.get(_user_models.User, user_id)
 
 
-async def update_username(db: _Session, user_id: int, username: str):
-    db_user = db.get(_user_models.User, user_id)
+async def update_username(db: _AsyncSession, user_id: int, username: str):
+    db_user = await db.get(_user_models.User, user_id)
     db_user.username = username
-    db.commit()
-    db.refresh(db_user)
+    await db.flush()
+    _after_commit(db, _functools.partial(_user_cache.pop, user_id))
     return db_user
@@ -1,6 +1,8 @@
+import asyncio
 import unittest
 from fastapi.testclient import TestClient
 from api.main import app
+from api.users import user_services
 
 client = TestClient(app)
 
@@ -42,6 +44,16 @@ class TestUser(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         # Add assertions to validate the response data
 
+    def test_read_users_pages(self):
+        for email in ["test1_page1@gmail.com", "test1_page2@gmail.com"]:
+            client.post("/users/create_user", json={"email": email, "password": self.password,
+                                                    "username": self.username})
+        first_page = client.get("/users", params={"limit": 1})
+        self.assertEqual(len(first_page.json()), 1)
+        second_page = client.get("/users", params={"limit": 1, "cursor": first_page.headers["X-Next-Cursor"]})
+        self.assertEqual(second_page.status_code, 200)
+        self.assertGreater(second_page.json()[0]["id"], first_page.json()[0]["id"])
+
     def test_read_users_me_unauthorized(self):
         response = client.get("/users/me")
         self.assertEqual(response.status_code, 401)  # Unauthorized without authentication
@@ -56,3 +68,50 @@ class TestUser(unittest.TestCase):
         response = client.get("/users/me", headers=headers)
         self.assertEqual(response.status_code, 200)
         # Add assertions to validate the response data
+
+    def test_read_users_me_invalid_token(self):
+        headers = {
+            "Authorization": "Bearer not-a-token"
+        }
+        response = client.get("/users/me", headers=headers)
+        self.assertEqual(response.status_code, 401)
+
+    def test_get_current_user_from_claims(self):
+        response = client.post("/users/token", data={"username": self.email, "password": self.password})
+        token = response.json()["access_token"]
+        # no session at all: the user has to come from the token claims alone
+        user = asyncio.run(user_services.get_current_user(db=None, token=token))
+        self.assertEqual(user.email, self.email)
+        self.assertIsNotNone(user.signup_date)
+
+    def test_update_username_refreshes_me(self):
+        response = client.post("/users/token", data={"username": self.email, "password": self.password})
+        headers = {
+            "Authorization": f"Bearer {response.json()['access_token']}"
+        }
+        client.get("/users/me", headers=headers)
+        response = client.put("/users/update_username", json={"username": "Renamed User"}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        response = client.get("/users/me", headers=headers)
+        self.assertEqual(response.json()["username"], "Renamed User")
+        client.put("/users/update_username", json={"username": self.username}, headers=headers)
+
+    def test_password_hashing_does_not_block_event_loop(self):
+        async def hash_while_ticking():
+            ticks = 0
+
+            async def tick():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.005)
+                    ticks += 1
+
+            ticker = asyncio.create_task(tick())
+            hashed_password = await user_services.hash_password(self.password)
+            ticker.cancel()
+            return hashed_password, ticks
+
+        hashed_password, ticks = asyncio.run(hash_while_ticking())
+        self.assertGreater(ticks, 0)
+        self.assertTrue(asyncio.run(user_services.verify_password(self.password, hashed_password)))
+        self.assertFalse(asyncio.run(user_services.verify_password("wrong password", hashed_password)))
@@ -0,0 +1,129 @@
+"""
+Write-behind buffering for append-only rows.
+
+Rows are queued in memory and inserted in batches, as multi-row INSERTs in one transaction: every `interval` seconds,
+or straight away once `batch_size` rows are waiting. Requests no longer wait for their own commit, and SQLite syncs
+once per batch instead of once per row.
+
+Until start() is called every add() is written immediately, so tests and scripts, which never start the flusher,
+behave synchronously. The app starts the flusher on startup and stop() flushes what is left on shutdown. Rows
+queued when a process dies without shutting down are lost, so only buffer rows that can afford that.
+"""
+import asyncio as _asyncio
+import logging as _logging
+
+from sqlalchemy.ext.asyncio import AsyncEngine as _AsyncEngine
+
+_logger = _logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+
+    def __init__(self, table, engine: _AsyncEngine, batch_size: int = 500, interval: float = 0.5,
+                 max_pending: int = 10000, synchronous: bool = False):
+        """
+        :param table: Table the rows are inserted into
+        :param engine: async engine to write with
+        :param batch_size: rows per INSERT, and the queue length that triggers an early flush
+        :param interval: seconds between flushes
+        :param max_pending: queue length at which add() waits for a flush instead of queueing more
+        :param synchronous: always write immediately, even once started
+        """
+        self.table = table
+        self.engine = engine
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self.synchronous = synchronous
+        self._pending = []
+        self._lock = _asyncio.Lock()
+        self._wakeup = _asyncio.Event()
+        self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def add(self, row: dict):
+        """
+        Queue a row, or insert it now when the flusher isn't running. Every row must have the same keys.
+        """
+        if self.synchronous or not self.running:
+            await self._insert([row])
+            return
+        self._pending.append(row)
+        if len(self._pending) >= self.max_pending:
+            # the database is falling behind: make writers wait rather than grow the queue without bound
+            await self.flush()
+        elif len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def discard(self, key: str, values) -> int:
+        """
+        Drop queued rows whose `key` is one of `values`, such as rows for parents that have just been deleted.
+        Rows already being flushed still get inserted.
+        :return: number of rows dropped
+        """
+        values = set(values)
+        kept = [row for row in self._pending if row[key] not in values]
+        dropped = len(self._pending) - len(kept)
+        self._pending = kept
+        return dropped
+
+    async def flush(self):
+        """
+        Insert everything queued so far. Rows that fail to insert go back on the queue.
+        """
+        async with self._lock:
+            rows, self._pending = self._pending, []
+            if not rows:
+                return
+            try:
+                await self._insert(rows)
+            except BaseException:
+                self._pending[:0] = rows
+                raise
+
+    async def _insert(self, rows: list[dict]):
+        async with self.engine.begin() as connection:
+            for start in range(0, len(rows), self.batch_size):
+                await connection.execute(self.table.insert().values(rows[start:start + self.batch_size]))
+
+    async def _run(self):
+        while True:
+            try:
+                await _asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except _asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                _logger.exception("Flushing %s rows to %s failed, retrying", len(self._pending), self.table.name)
+
+    def start(self):
+        """
+        Start flushing in the background; must be called from the running event loop
+        """
+        if self.synchronous or self.running:
+            return
+        # the loop at startup may not be the one the buffer was created in
+        self._lock = _asyncio.Lock()
+        self._wakeup = _asyncio.Event()
+        self._task = _asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop the background flusher and write out everything still queued
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except _asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
@@ -0,0 +1,81 @@
+"""
+Card mutation latency and throughput: activity written in its own commit vs through the write-behind log.
+
+Builds a throwaway SQLite database and runs the same "mutation" (rename a card, then log the activity) through
+ - direct:       the old path, the activity row inserted and committed by the request
+ - write-behind: the activity queued on a started WriteBehindBuffer and flushed in batches
+and reports mean request latency and mutations/second at a few concurrency levels.
+
+usage: python -m benchmarks.activity_log_benchmark [--requests 2000]
+"""
+import argparse as _argparse
+import asyncio as _asyncio
+import datetime as _dt
+import os as _os
+import shutil as _shutil
+import statistics as _statistics
+import tempfile as _tempfile
+import time as _time
+
+from sqlalchemy import update as _update
+from sqlalchemy.ext.asyncio import create_async_engine as _create_async_engine, \
+    async_sessionmaker as _async_sessionmaker
+
+import api as _api  # noqa: F401  registers every model on Base.metadata
+from api.database import Base as _Base
+from api.cards import card_models as _card_models
+from api.write_behind import WriteBehindBuffer as _WriteBehindBuffer
+
+
+def _activity(number: int) -> dict:
+    return {"card_id": 1, "user_id": 1, "activity": f"renamed the card to {number}",
+            "created_datetime": str(_dt.datetime.now())}
+
+
+async def _run(path: str, write_behind: bool, requests: int, concurrency: int):
+    engine = _create_async_engine(f"sqlite+aiosqlite:///{path}")
+    async with engine.begin() as connection:
+        await connection.run_sync(_Base.metadata.create_all)
+        await connection.execute(_card_models.Card.__table__.insert(), {"id": 1, "list_id": 1, "title": "card"})
+    sessions = _async_sessionmaker(bind=engine, expire_on_commit=False)
+    activity_log = _WriteBehindBuffer(_card_models.CardActivity.__table__, engine)
+    if write_behind:
+        activity_log.start()
+    semaphore, latencies = _asyncio.Semaphore(concurrency), []
+
+    async def mutation(number: int):
+        async with semaphore:
+            start = _time.perf_counter()
+            async with sessions() as db:
+                await db.execute(_update(_card_models.Card).filter(_card_models.Card.id == 1).values(
+                    title=f"card {number}"))
+                await db.commit()
+            await activity_log.add(_activity(number))
+            latencies.append(_time.perf_counter() - start)
+
+    start = _time.perf_counter()
+    await _asyncio.gather(*(mutation(number) for number in range(requests)))
+    elapsed = _time.perf_counter() - start
+    await activity_log.stop()
+    await engine.dispose()
+    return _statistics.mean(latencies) * 1000, requests / elapsed
+
+
+def main():
+    parser = _argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{args.requests} mutations per run")
+    print(f"{'concurrency':>11} {'path':>12} {'mean ms':>9} {'mutations/s':>12}")
+    for concurrency in (1, 8, 32):
+        for name, write_behind in (("direct", False), ("write-behind", True)):
+            workdir = _tempfile.mkdtemp()
+            latency, throughput = _asyncio.run(_run(_os.path.join(workdir, "bench.db"), write_behind, args.requests,
+                                                    concurrency))
+            _shutil.rmtree(workdir)
+            print(f"{concurrency:>11} {name:>12} {latency:>9.2f} {throughput:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
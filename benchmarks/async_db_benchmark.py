@@ -0,0 +1,100 @@
+"""
+Concurrent request throughput: blocking Session vs AsyncSession inside `async def` handlers.
+
+Builds a throwaway SQLite database, then fires batches of concurrent "requests" at the same query through
+ - sync:  the old path, a blocking Session called straight from a coroutine
+ - async: the AsyncSession path the services now use
+and reports requests/second plus the longest event loop stall seen by a 1ms heartbeat.
+
+usage: python -m benchmarks.async_db_benchmark [--boards 20000] [--requests 200]
+"""
+import argparse as _argparse
+import asyncio as _asyncio
+import os as _os
+import shutil as _shutil
+import tempfile as _tempfile
+import time as _time
+
+from sqlalchemy import create_engine as _create_engine, select as _select, func as _func
+from sqlalchemy.orm import sessionmaker as _sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine as _create_async_engine, \
+    async_sessionmaker as _async_sessionmaker
+
+import api as _api  # noqa: F401  registers every model on Base.metadata
+from api.database import Base as _Base
+from api.boards import board_models as _board_models
+
+
+def _query():
+    # a deliberately unindexed filter so every request does real work inside SQLite
+    return _select(_func.count()).select_from(_board_models.Board).filter(_board_models.Board.name.like("%7%"))
+
+
+def _populate(url: str, boards: int):
+    engine = _create_engine(url)
+    _Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(_board_models.Board.__table__.insert(),
+                     [{"name": f"board {i}", "owner_id": 1, "is_public": True} for i in range(boards)])
+    engine.dispose()
+
+
+async def _heartbeat(stop: _asyncio.Event, stalls: list):
+    last = _time.perf_counter()
+    while not stop.is_set():
+        await _asyncio.sleep(0.001)
+        now = _time.perf_counter()
+        stalls.append(now - last - 0.001)
+        last = now
+
+
+async def _run(handler, requests: int, concurrency: int):
+    semaphore = _asyncio.Semaphore(concurrency)
+    stop, stalls = _asyncio.Event(), []
+    beat = _asyncio.create_task(_heartbeat(stop, stalls))
+
+    async def one():
+        async with semaphore:
+            await handler()
+
+    start = _time.perf_counter()
+    await _asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = _time.perf_counter() - start
+    stop.set()
+    await beat
+    return requests / elapsed, max(stalls, default=0.0) * 1000
+
+
+def main():
+    parser = _argparse.ArgumentParser()
+    parser.add_argument("--boards", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    workdir = _tempfile.mkdtemp()
+    path = _os.path.join(workdir, "bench.db")
+    _populate(f"sqlite:///{path}", args.boards)
+
+    sync_session = _sessionmaker(bind=_create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False}))
+    async_session = _async_sessionmaker(bind=_create_async_engine(f"sqlite+aiosqlite:///{path}"),
+                                        expire_on_commit=False)
+
+    async def sync_handler():
+        with sync_session() as db:
+            db.execute(_query()).scalar()
+
+    async def async_handler():
+        async with async_session() as db:
+            (await db.execute(_query())).scalar()
+
+    print(f"{args.boards} boards, {args.requests} requests per run")
+    print(f"{'concurrency':>11} {'path':>6} {'req/s':>9} {'max loop stall ms':>18}")
+    for concurrency in (1, 8, 32):
+        for name, handler in (("sync", sync_handler), ("async", async_handler)):
+            rps, stall = _asyncio.run(_run(handler, args.requests, concurrency))
+            print(f"{concurrency:>11} {name:>6} {rps:>9.1f} {stall:>18.1f}")
+    _shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Mixed read/write throughput under each engine profile (see api/engine_profile.py).
+
+Builds a throwaway SQLite database per profile, then runs concurrent "requests" through an async engine created with
+that profile: most read a board's lists, the rest add a card and commit. Reports operations/second, mean and worst
+write latency and how many requests failed with "database is locked".
+
+usage: python -m benchmarks.engine_profile_benchmark [--requests 2000] [--write-percent 20]
+"""
+import argparse as _argparse
+import asyncio as _asyncio
+import os as _os
+import random as _random
+import shutil as _shutil
+import statistics as _statistics
+import tempfile as _tempfile
+import time as _time
+
+from sqlalchemy import create_engine as _create_engine, select as _select
+from sqlalchemy.exc import OperationalError as _OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker as _async_sessionmaker
+
+import api as _api  # noqa: F401  registers every model on Base.metadata
+from api import engine_profile as _engine_profile
+from api.database import Base as _Base
+from api.lists import list_models as _list_models
+from api.cards import card_models as _card_models
+
+_BOARDS = 50
+_LISTS_PER_BOARD = 5
+
+
+def _populate(path: str):
+    engine = _create_engine(f"sqlite:///{path}")
+    _Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(_list_models.List.__table__.insert(),
+                     [{"board_id": board_id, "name": f"list {number}", "rank": f"{number + 1}"}
+                      for board_id in range(1, _BOARDS + 1) for number in range(_LISTS_PER_BOARD)])
+    engine.dispose()
+
+
+async def _run(path: str, profile: _engine_profile.EngineProfile, requests: int, concurrency: int,
+               write_percent: int):
+    engine = _engine_profile.create_async_engine(f"sqlite+aiosqlite:///{path}", profile)
+    sessions = _async_sessionmaker(bind=engine, expire_on_commit=False)
+    semaphore, write_latencies, locked = _asyncio.Semaphore(concurrency), [], 0
+    random = _random.Random(0)
+
+    async def read(board_id: int):
+        async with sessions() as db:
+            (await db.scalars(_select(_list_models.List).filter(_list_models.List.board_id == board_id)
+                              .order_by(_list_models.List.rank))).all()
+
+    async def write(list_id: int):
+        start = _time.perf_counter()
+        async with sessions() as db:
+            db.add(_card_models.Card(list_id=list_id, title="card", rank="i"))
+            await db.commit()
+        write_latencies.append(_time.perf_counter() - start)
+
+    async def one(is_write: bool, target: int):
+        nonlocal locked
+        async with semaphore:
+            try:
+                await (write(target) if is_write else read(target))
+            except _OperationalError:
+                locked += 1
+
+    work = [(random.randrange(100) < write_percent, random.randint(1, _BOARDS)) for _ in range(requests)]
+    start = _time.perf_counter()
+    await _asyncio.gather(*(one(is_write, target) for is_write, target in work))
+    elapsed = _time.perf_counter() - start
+    await engine.dispose()
+    return (requests / elapsed, _statistics.mean(write_latencies or [0]) * 1000,
+            max(write_latencies, default=0) * 1000, locked)
+
+
+def main():
+    parser = _argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--write-percent", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{args.requests} requests per run, {args.write_percent}% writes")
+    print(f"{'concurrency':>11} {'profile':>10} {'ops/s':>9} {'write ms':>9} {'worst ms':>9} {'locked':>7}")
+    for concurrency in (1, 8, 32):
+        for name, profile in _engine_profile.PROFILES.items():
+            workdir = _tempfile.mkdtemp()
+            path = _os.path.join(workdir, "bench.db")
+            _populate(path)
+            ops, write_ms, worst_ms, locked = _asyncio.run(_run(path, profile, args.requests, concurrency,
+                                                                args.write_percent))
+            _shutil.rmtree(workdir)
+            print(f"{concurrency:>11} {name:>10} {ops:>9.1f} {write_ms:>9.2f} {worst_ms:>9.1f} {locked:>7}")
+
+
+if __name__ == "__main__":
+    main()
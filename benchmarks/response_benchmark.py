@@ -0,0 +1,90 @@
+"""
+Encode time and bytes on the wire for a large board response.
+
+Builds a synthetic FullBoard with 1,000 cards (10 lists of 100, two members per card) and reports
+ - encode: rendering the body with the standard library's json (Starlette's JSONResponse) vs orjson
+ - compress: size and time of the rendered body under each encoding and level the middleware could use
+Times are the median of --repeat runs. Brotli rows are left out when the `brotli` package isn't installed.
+
+usage: python -m benchmarks.response_benchmark [--cards 1000] [--repeat 50]
+"""
+import argparse as _argparse
+import datetime as _dt
+import gzip as _gzip
+import statistics as _statistics
+import time as _time
+
+from fastapi.encoders import jsonable_encoder as _jsonable_encoder
+from fastapi.responses import JSONResponse as _JSONResponse, ORJSONResponse as _ORJSONResponse
+
+from api.boards import board_schemas as _board_schemas
+from api import compression as _compression
+
+try:
+    import brotli as _brotli
+except ImportError:
+    _brotli = None
+
+_LISTS = 10
+
+
+def _board(cards: int) -> _board_schemas.FullBoard:
+    today = _dt.date(2023, 6, 1)
+    users = [{"id": number, "email": f"user{number}@example.com", "username": f"User {number}", "signup_date": today}
+             for number in range(1, 11)]
+    per_list = cards // _LISTS
+    lists = [{"id": list_id, "name": f"List {list_id}", "position": list_id, "board_id": 1, "rank": f"{list_id}",
+              "cards": [{"id": list_id * per_list + number, "list_id": list_id, "title": f"Card {number}",
+                         "description": "Something that needs doing, with enough words to look like a real card.",
+                         "created_date": today, "is_active": True, "due_date": today, "reminder_datetime": None,
+                         "rank": f"i{number:04}",
+                         "card_members": [{"id": number * 2 + offset, "card_id": list_id * per_list + number,
+                                           "user_id": users[(number + offset) % 10]["id"],
+                                           "user": users[(number + offset) % 10]} for offset in range(2)]}
+                        for number in range(per_list)]}
+             for list_id in range(_LISTS)]
+    return _board_schemas.FullBoard(id=1, name="Board", is_public=True, owner_id=1, created_date=today, version=1,
+                                    lists=lists, board_members=[])
+
+
+def _median_ms(function, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = _time.perf_counter()
+        function()
+        times.append(_time.perf_counter() - start)
+    return _statistics.median(times) * 1000
+
+
+def main():
+    parser = _argparse.ArgumentParser()
+    parser.add_argument("--cards", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    content = _jsonable_encoder(_board(args.cards))
+    print(f"FullBoard with {args.cards} cards")
+    print(f"{'encoder':>14} {'ms':>8} {'bytes':>9}")
+    for name, response_class in (("json", _JSONResponse), ("orjson", _ORJSONResponse)):
+        body = response_class(content).body
+        ms = _median_ms(lambda: response_class(content), args.repeat)
+        print(f"{name:>14} {ms:>8.2f} {len(body):>9}")
+
+    body = _ORJSONResponse(content).body
+    encoders = [(f"gzip -{level}", lambda level=level: _gzip.compress(body, compresslevel=level))
+                for level in (1, 6, 9)]
+    if _brotli is not None:
+        encoders += [(f"br q{quality}", lambda quality=quality: _brotli.compress(body, quality=quality))
+                     for quality in (4, 11)]
+    print(f"\n{'compression':>14} {'ms':>8} {'bytes':>9} {'ratio':>7}")
+    print(f"{'none':>14} {0:>8.2f} {len(body):>9} {1:>7.2f}")
+    for name, encode in encoders:
+        size = len(encode())
+        ms = _median_ms(encode, args.repeat)
+        print(f"{name:>14} {ms:>8.2f} {size:>9} {len(body) / size:>7.2f}")
+    print(f"\nmiddleware default: {', '.join(_compression.available_encodings())}; gzip -{_compression.GZIP_LEVEL}, "
+          f"br q{_compression.BROTLI_QUALITY}, bodies from {_compression.COMPRESSION_MINIMUM_SIZE} bytes")
+
+
+if __name__ == "__main__":
+    main()
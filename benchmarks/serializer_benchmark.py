@@ -0,0 +1,99 @@
+"""
+Per-row cost of list responses: from_orm plus response_model validation vs projected rows and a RowSerializer.
+
+Builds a throwaway SQLite database with --rows cards and times, end to end from the query to the JSON-ready content:
+ - from_orm:   select(Card) -> Card.from_orm() per row -> FastAPI's response_model validation and encoding
+ - projection: card_serializer.select() -> RowSerializer.serialize()
+Times are the median of --repeat runs; "serialize" leaves out the query.
+
+usage: python -m benchmarks.serializer_benchmark [--rows 10000] [--repeat 10]
+"""
+import argparse as _argparse
+import asyncio as _asyncio
+import datetime as _dt
+import os as _os
+import shutil as _shutil
+import statistics as _statistics
+import tempfile as _tempfile
+import time as _time
+
+from fastapi.routing import serialize_response as _serialize_response
+from fastapi.utils import create_response_field as _create_response_field
+from sqlalchemy import create_engine as _create_engine, select as _select
+from sqlalchemy.ext.asyncio import async_sessionmaker as _async_sessionmaker
+
+import api as _api  # noqa: F401  registers every model on Base.metadata
+from api import engine_profile as _engine_profile
+from api.database import Base as _Base
+from api.boards import board_schemas as _board_schemas  # noqa: F401  card_schemas can only be imported after it
+from api.cards import card_models as _card_models, card_schemas as _card_schemas, card_services as _card_services
+
+
+def _populate(path: str, rows: int):
+    engine = _create_engine(f"sqlite:///{path}")
+    _Base.metadata.create_all(bind=engine)
+    today = str(_dt.date(2023, 6, 1))
+    with engine.begin() as conn:
+        conn.execute(_card_models.Card.__table__.insert(),
+                     [{"list_id": 1, "title": f"Card {number}", "description": "Something that needs doing",
+                       "created_date": today, "is_active": True, "due_date": today if number % 2 else None,
+                       "reminder_datetime": None, "rank": f"i{number:06}"} for number in range(rows)])
+    engine.dispose()
+
+
+async def _run(path: str, repeat: int):
+    engine = _engine_profile.create_async_engine(f"sqlite+aiosqlite:///{path}", _engine_profile.PROFILES["production"])
+    sessions = _async_sessionmaker(bind=engine, expire_on_commit=False)
+    response_field = _create_response_field(name="cards", type_=list[_card_schemas.Card])
+    serializer = _card_services.card_serializer
+
+    async def from_orm(db):
+        cards = (await db.scalars(_select(_card_models.Card))).all()
+        start = _time.perf_counter()
+        content = [_card_schemas.Card.from_orm(card) for card in cards]
+        content = await _serialize_response(field=response_field, response_content=content)
+        return content, start
+
+    async def projection(db):
+        rows = (await db.execute(serializer.select())).all()
+        start = _time.perf_counter()
+        return serializer.serialize(rows), start
+
+    results = {}
+    for name, run in (("from_orm", from_orm), ("projection", projection)):
+        totals, serialize_times = [], []
+        for _ in range(repeat):
+            async with sessions() as db:
+                start = _time.perf_counter()
+                content, serialize_start = await run(db)
+                end = _time.perf_counter()
+            totals.append(end - start)
+            serialize_times.append(end - serialize_start)
+        results[name] = (len(content), _statistics.median(totals), _statistics.median(serialize_times))
+    await engine.dispose()
+    return results
+
+
+def main():
+    parser = _argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    workdir = _tempfile.mkdtemp()
+    path = _os.path.join(workdir, "bench.db")
+    try:
+        _populate(path, args.rows)
+        results = _asyncio.run(_run(path, args.repeat))
+    finally:
+        _shutil.rmtree(workdir)
+
+    print(f"{args.rows} cards, median of {args.repeat} runs")
+    print(f"{'path':>11} {'total ms':>9} {'us/row':>7} {'serialize ms':>13} {'us/row':>7}")
+    for name, (rows, total, serialize) in results.items():
+        print(f"{name:>11} {total * 1000:>9.1f} {total * 1e6 / rows:>7.2f} {serialize * 1000:>13.1f} "
+              f"{serialize * 1e6 / rows:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()